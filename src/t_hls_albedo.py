@@ -1,10 +1,23 @@
 import t_stac_search
+import t_stac_cache
+import t_stac_retry
+import t_stac_checkpoint
+import t_hls_catalog
+import t_hls_catalog_sqlite
+import t_support_manifest
 import t_lookups
 import datetime
 import logging
 import json
+import math
+import heapq
+import shutil
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
-from os import environ, walk
+from os import environ, replace, walk
+from os.path import exists
 from pathlib import Path
 
 
@@ -15,113 +28,476 @@ load_dotenv()
 # Class for HLS (v2.0) data
 class HLSDataCatalog:
 
-    def __init__(self):
+    def __init__(self, refresh=False, look_back_days=5):
+
+        # Number of workers for each crawl
+        max_workers = int(environ.get('stac_max_workers', 1))
+        # Session shared by both crawls (one connection pool, large enough for the workers of both)
+        session = t_stac_search.make_STAC_session(max_workers * 2)
+        # Retry policy shared by both crawls (one retry budget, circuit breaker and rate limit for the server)
+        retry_policy = t_stac_retry.STACRetryPolicy(
+            requests_per_second=float(environ.get('stac_requests_per_second', 0)) or None)
+        # Build (or refresh) both datasets at the same time
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            l30_future = executor.submit(HLSDataset, 'L30', refresh=refresh, look_back_days=look_back_days,
+                                         session=session, retry_policy=retry_policy)
+            s30_future = executor.submit(HLSDataset, 'S30', refresh=refresh, look_back_days=look_back_days,
+                                         session=session, retry_policy=retry_policy)
+            self.l30 = l30_future.result()
+            self.s30 = s30_future.result()
+
+    # Iterate over the files of both datasets (L30 and S30) in some MGRS cells (e.g. ['14TPL', '14TQL']) in a range of
+    # dates (datetime date objects, both included), in acquisition order, optionally only the files within cloud cover
+    # and spatial coverage thresholds. The time series of each cell in each dataset is already in order, so they are
+    # merged lazily (the files are only read as the iteration reaches them)
+    def iterate_files_of_cells(self, mgrs_cells, start_date, end_date, max_cloud_cover=None,
+                               min_spatial_coverage=None):
+        # Time series of each dataset and cell (leaving out repeated cells)
+        series = [dataset.iterate_time_series(mgrs_cell, start_date, end_date, max_cloud_cover=max_cloud_cover,
+                                              min_spatial_coverage=min_spatial_coverage)
+                  for dataset in (self.l30, self.s30) for mgrs_cell in dict.fromkeys(mgrs_cells)]
+        # Acquisition of the files yielded last, and the files yielded with it
+        last_key = None
+        last_files = set()
+        # For each file, in acquisition order
+        for file in heapq.merge(*series, key=get_acquisition_key):
+            # If it is from a later acquisition
+            if file[15:29] != last_key:
+                # Start a new set of files
+                last_key = file[15:29]
+                last_files = set()
+            # If it has already been yielded
+            if file in last_files:
+                # Skip it
+                continue
+            # Yield the file
+            last_files.add(file)
+            yield file
+
+    # Iterate over the files of both datasets in an MGRS cell (e.g. '14TPL') in a range of dates, in acquisition order
+    # (see iterate_files_of_cells)
+    def iterate_time_series(self, mgrs_cell, start_date, end_date, max_cloud_cover=None, min_spatial_coverage=None):
+        return self.iterate_files_of_cells([mgrs_cell], start_date, end_date, max_cloud_cover=max_cloud_cover,
+                                           min_spatial_coverage=min_spatial_coverage)
 
-        self.l30 = HLSDataset('L30')
-        self.s30 = HLSDataset('S30')
+    # Iterate over the files of both datasets in the cells of a strip (HLSTargetStrip) in a range of dates (the strip's
+    # date if there is no range), in acquisition order (see iterate_files_of_cells)
+    def iterate_strip_files(self, strip, start_date=None, end_date=None, max_cloud_cover=None,
+                            min_spatial_coverage=None):
+        return self.iterate_files_of_cells([get_tile_from_file(file) for file in strip.files],
+                                           start_date or strip.date, end_date or strip.date,
+                                           max_cloud_cover=max_cloud_cover, min_spatial_coverage=min_spatial_coverage)
 
 
 # Class for HLS (v2.0) data. Either Sentinel (S30) or Landsat (L30)
 class HLSDataset:
 
-    def __init__(self, dataset):
+    def __init__(self, dataset, refresh=False, look_back_days=5, session=None, retry_policy=None,
+                 memory_limit_bytes=None, catalog_backend=None, harvest_mode=None, snapshot_date=None):
 
         self.dataset = f'HLS{dataset}.v2.0'
+        # Session and retry policy for crawling STAC (None to make new ones for each crawl)
+        self.session = session
+        self.retry_policy = retry_policy
+        # How the files are harvested from STAC: 'crawl' (the catalog's years, months and days, checkpointed) or
+        # 'search' (the item search endpoint, a page of many items at a time)
+        self.harvest_mode = harvest_mode or environ.get('stac_harvest_mode', 'crawl')
+        # Memory the catalog's open years can use before the least recently used ones are closed (None for no limit)
+        self.memory_limit_bytes = memory_limit_bytes
+        # Where the catalog is kept: 'binary' (memory-mapped files for each support file) or 'sqlite' (one database for
+        # the dataset that is updated in place, for many processes reading while a refresh writes)
+        self.catalog_backend = catalog_backend or environ.get('hls_catalog_backend', 'binary')
+        # Columnar catalog of the files (and views of it by date, by ID and by tile)
+        self.catalog = None
         self.by_date = {}
         self.by_id = {}
         self.by_tile = {}
+        # Date of the support file the catalog was opened from (None if it was made from titles in memory, and until
+        # the support file is opened unless a snapshot is given)
+        self.snapshot_date = snapshot_date
 
-        # Get the latest date of a file for the dataset (if any)
-        latest_date = self.get_latest_dataset_file()
+        # Get the date of the support file to open: the snapshot given (e.g. the one opened by the process that started
+        # a worker process, opened as it is), otherwise the latest date of a file for the dataset (if any)
+        latest_date = snapshot_date or self.get_latest_dataset_file()
         # If there is no file (indicated by the None response from the latest date)
         if latest_date is None:
             # Make a dataset file
             self.make_new_dataset_file()
             # Try again for the latest date
             latest_date = self.get_latest_dataset_file()
+        # Otherwise, if the existing file should be brought up to date (and no snapshot was given)
+        elif refresh and snapshot_date is None:
+            # Refresh the dataset file
+            self.refresh_dataset_file(latest_date, look_back_days=look_back_days)
+            # Try again for the latest date
+            latest_date = self.get_latest_dataset_file()
+        # If there is still no file (the harvest failed)
+        if latest_date is None:
+            # Log error
+            logging.error(f'There is no support file for {self.dataset}. Opening it empty.')
+            # Use an empty catalog
+            self.ingest_titles([])
+            return
         # Ingest the support file
         self.ingest_support_file(latest_date)
+        # Reference the date of the support file
+        self.snapshot_date = latest_date
+
+    # Get the path to the support file for this dataset from a particular date
+    def get_dataset_file_path(self, date):
+        # Assemble the path to the (line-delimited) file
+        file_path = Path(environ["support_files_path"] + f'{self.dataset}_files_' + date.strftime("%m%d%Y") + ".jsonl")
+        # Path to a file in the older format (a single JSON list)
+        legacy_path = file_path.with_suffix('.json')
+        # If there is only a file in the older format
+        if not exists(file_path) and exists(legacy_path):
+            # Use that
+            return legacy_path
+        # Return the path
+        return file_path
 
     # Ingest a support file for this dataset
     def ingest_support_file(self, latest_date):
-        # Assemble the path to the file
-        latest_file_path = Path(
-            environ["support_files_path"] + f'{self.dataset}_files_' + latest_date.strftime(
-                "%m%d%Y") + ".json")
-        # Open the file
-        with open(latest_file_path, 'r') as f:
-            # Load as dictionary and reference
-            input_list = json.load(f)
-        # For each file in the list
-        for file in input_list:
-            # Add the file to the various search dictionaries
-            self.add_file_by_date(file)
-            self.add_file_by_tile(file)
-
-    # Add a file to the "by_date" dictionary
-    def add_file_by_date(self, file):
-        # Split the name of the file
-        split_name = file.split('.')
-        # Get the date designators
-        year = split_name[3][0:4]
-        doy = split_name[3][4:7]
-        # Reference the file
-        if year not in self.by_date.keys():
-            self.by_date[year] = {}
-        if doy not in self.by_date[year].keys():
-            self.by_date[year][doy] = []
-        self.by_date[year][doy].append(file)
-
-    # Add a file to the "by_tile" dictionary
-    def add_file_by_tile(self, file):
-        # Split the name of the file
-        split_name = file.split('.')
-        # Get the tile designators
-        tile_col_major = split_name[2][1:3]
-        tile_row_major = split_name[2][3]
-        tile_col_minor = split_name[2][4]
-        tile_row_minor = split_name[2][5]
-        if tile_row_major not in self.by_tile.keys():
-            self.by_tile[tile_row_major] = {}
-        if tile_col_major not in self.by_tile[tile_row_major].keys():
-            self.by_tile[tile_row_major][tile_col_major] = {}
-        if tile_row_minor not in self.by_tile[tile_row_major][tile_col_major].keys():
-            self.by_tile[tile_row_major][tile_col_major][tile_row_minor] = {}
-        if tile_col_minor not in self.by_tile[tile_row_major][tile_col_major][tile_row_minor].keys():
-            self.by_tile[tile_row_major][tile_col_major][tile_row_minor][tile_col_minor] = []
-        self.by_tile[tile_row_major][tile_col_major][tile_row_minor][tile_col_minor].append(file)
-
-    # Add a file to the "by_id" dictionary
-    def add_file_by_id(self, file):
-        # Split the name of the file
-        split_name = file.split('.')
-        # Assemble the predictable part of the ID (losing acquisition time)
-        base_name = split_name[0] + split_name[1] + split_name[2] + split_name[3][0:7]
-        # Enter into dictionary
-        self.by_id[base_name] = file
+        # Path to the support file
+        file_path = self.get_dataset_file_path(latest_date)
+        # If the catalog is kept in a database
+        if self.catalog_backend == 'sqlite':
+            # Open the database
+            catalog = t_hls_catalog_sqlite.HLSSQLiteCatalog(self.get_catalog_database_path())
+            # If it is not up to date with the support file (and this is not a given snapshot, e.g. opened by a worker
+            # process, which leaves the shared database to the process that opened the dataset)
+            if not catalog.is_up_to_date(file_path) and self.snapshot_date is None:
+                # Write the files in the support file to it
+                catalog.write_catalog(self.make_catalog_from_file(file_path), source_path=file_path)
+            # Use it
+            self.use_catalog(catalog)
+            return
+        # Write the binary catalog made from it (one file per year), if it is not there or up to date
+        catalog_path = self.write_binary_catalog(file_path)
+        # Open the catalog (each year is opened, memory-mapped, the first time it is used)
+        self.use_catalog(t_hls_catalog.HLSPartitionedCatalog(catalog_path,
+                                                             memory_limit_bytes=self.memory_limit_bytes))
+
+    # Write the binary catalog of a support file (next to it), or bring the one there up to date if the file has changed
+    # since it was written (as an update, so that processes reading it are not disturbed). Returns its path
+    def write_binary_catalog(self, file_path):
+        # Path to the binary catalog
+        catalog_path = t_hls_catalog.get_catalog_path(file_path)
+        # If it is there and up to date
+        if t_hls_catalog.is_catalog_up_to_date(catalog_path, file_path):
+            # Nothing to write
+            return catalog_path
+        # Make the catalog from the files in the support file (read in one pass)
+        catalog = self.make_catalog_from_file(file_path)
+        # Try and write it (if there is already one there, it is kept). If there is one and it is older than the file
+        if not t_hls_catalog.write_partitioned_catalog(catalog, catalog_path) and \
+                not t_hls_catalog.is_catalog_up_to_date(catalog_path, file_path):
+            # Update it to match the file
+            t_hls_catalog.HLSPartitionedCatalog(catalog_path).apply_catalog(catalog)
+        # Return the path
+        return catalog_path
+
+    # Make the catalog of the files in a support file, with the cloud and spatial coverage of the files from the
+    # metadata file of the same date (if the metadata was harvested). The metadata is only read here, when a catalog is
+    # written, and is kept in the catalog's columns from then on
+    def make_catalog_from_file(self, file_path):
+        # Make the catalog from the files in the support file (read in one pass)
+        catalog = t_hls_catalog.make_granule_catalog_from_file(file_path)
+        # Path to the metadata file of the same date
+        metadata_path = file_path.with_name(file_path.name.replace('_files_', '_metadata_')).with_suffix('.jsonl')
+        # If there is one
+        if exists(metadata_path):
+            # Lists for the titles and their cloud and spatial coverage
+            titles = []
+            cloud_cover = []
+            spatial_coverage = []
+            # For each record in the file
+            for record in iterate_support_file(metadata_path):
+                titles.append(record['title'])
+                cloud_cover.append(record['cloud_cover'])
+                spatial_coverage.append(record['spatial_coverage'])
+            # Set the coverage of the files
+            catalog.set_coverage(titles, t_hls_catalog.encode_coverage(cloud_cover),
+                                 t_hls_catalog.encode_coverage(spatial_coverage))
+        # Return the catalog
+        return catalog
+
+    # Get the path to the catalog database of this dataset (see HLSSQLiteCatalog)
+    def get_catalog_database_path(self):
+        return Path(environ["support_files_path"] + f'{self.dataset}_catalog.sqlite')
+
+    # Ingest file names (any iterable of titles, e.g. the stream from a STAC harvest)
+    def ingest_titles(self, titles):
+        # Make the catalog of the files and use it
+        self.use_catalog(t_hls_catalog.make_granule_catalog(titles))
+        # It is not from a support file
+        self.snapshot_date = None
+
+    # Use a catalog of the files
+    def use_catalog(self, catalog):
+        # Reference the catalog
+        self.catalog = catalog
+        # Views of the catalog by date (by_date[year][doy]), by tile (by_tile[row][col][minor_row][minor_col]) and by
+        # granule ID (by_id['HLS.S30.T14TPL.2015334T173002'])
+        self.by_date = self.catalog.get_by_date_view()
+        self.by_tile = self.catalog.get_by_tile_view()
+        self.by_id = self.catalog.get_by_id_view()
 
     # Make a new file for the dates
     def make_new_dataset_file(self):
-        # Get the file details to make a file
-        file_list = t_stac_search.get_items_from_STAC(self.dataset)
+        # Whether to also harvest the metadata of each file (band hrefs, cloud cover etc.)
+        with_metadata = environ.get('stac_harvest_metadata', 'False') == 'True'
+        # Path to the checkpoint of the harvest (so that an interrupted harvest can pick up where it stopped)
+        checkpoint_path = Path(environ["support_files_path"] + f'{self.dataset}_' +
+                               ('metadata' if with_metadata else 'harvest') + '_checkpoint.jsonl')
+        # Checkpoint of a crawl (None for the item search)
+        checkpoint = None
+        # If the files are harvested with the item search endpoint (always for metadata, which the search returns
+        # whole, instead of a request for each item in a crawl)
+        if self.harvest_mode == 'search' or with_metadata:
+            # Get the file details as they are harvested (a page of results at a time)
+            file_iterator = t_stac_search.iterate_items_from_STAC_search(self.dataset,
+                                                                         with_metadata=with_metadata,
+                                                                         session=self.session,
+                                                                         retry_policy=self.retry_policy)
+        # Otherwise
+        else:
+            # Open the checkpoint (picking up the days finished by an earlier harvest)
+            checkpoint = t_stac_checkpoint.STACHarvestCheckpoint(checkpoint_path)
+            # Get the file details as they are harvested (crawling with as many workers as configured)
+            file_iterator = t_stac_search.iterate_items_from_STAC(self.dataset,
+                                                                  max_workers=int(environ.get('stac_max_workers', 1)),
+                                                                  cache=t_stac_cache.get_default_cache(),
+                                                                  checkpoint=checkpoint,
+                                                                  with_metadata=with_metadata,
+                                                                  session=self.session,
+                                                                  retry_policy=self.retry_policy)
+        # If the harvest could not be started
+        if file_iterator is False:
+            # Log error
+            logging.error(f'Harvest of {self.dataset} failed. No file was made.')
+            return
+        # Write the files (and their metadata) to the support file(s) as they are harvested (only moved into place if
+        # the crawl lost no days)
+        file_count = self.write_dataset_files(file_iterator, datetime.datetime.now(), with_metadata=with_metadata,
+                                              is_complete=None if checkpoint is None else
+                                              lambda: len(checkpoint.lost_days) == 0)
+        # If days were lost (e.g. once the retry budget was used up)
+        if file_count is False:
+            # Log error (the checkpoint is kept, so the next harvest only requests the lost days again)
+            logging.error(f'Harvest of {self.dataset} could not retrieve {len(checkpoint.lost_days)} days. No file was '
+                          f'made. The finished days are kept in {checkpoint_path} for the next harvest.')
+            return
+        # Log the info
+        logging.info(f'{file_count} files written for {self.dataset}.')
+        # The harvest is safely written, so remove its checkpoint
+        checkpoint_path.unlink(missing_ok=True)
+
+    # Write harvested items (titles, or metadata records) to the support file(s) for a particular date, optionally only
+    # if the harvest is complete (a function checked once all the items are written). Returns the file count (False if
+    # the harvest was not complete, in which case no support file is moved into place)
+    def write_dataset_files(self, items, date, with_metadata=False, is_complete=None):
+        # Path to the support file
+        file_path = self.get_dataset_file_path(date).with_suffix('.jsonl')
+        # If there is no metadata
+        if not with_metadata:
+            # Write the titles to the support file
+            file_count = write_lines_file(items, file_path, is_complete=is_complete)
+        # Otherwise
+        else:
+            # Write the titles to the support file, writing each record to the metadata file on the way (the metadata
+            # file is moved into place first, so a catalog made from the support file always finds it)
+            file_count = write_lines_file(write_records_and_get_titles(items, self.get_metadata_file_path(date)),
+                                          file_path, is_complete=is_complete)
+        # If the harvest was not complete
+        if file_count is False:
+            return False
+        # Record the support file in the manifest
+        t_support_manifest.SupportFileManifest(environ["support_files_path"]).add_snapshot(self.dataset, date,
+                                                                                           file_path, file_count)
+        # Return the file count
+        return file_count
+
+    # Get the path to the metadata file (one record per line) for this dataset from a particular date
+    def get_metadata_file_path(self, date):
         # Assemble the path to the file
-        output_path = Path(
-            environ["support_files_path"] + f'{self.dataset}_files_' + datetime.datetime.now().strftime(
-                "%m%d%Y") + ".json")
-        # Write the file
-        with open(output_path, 'w') as f:
-            json.dump(file_list, f)
-
-    # Get the latest date of a support file for the dataset
+        return Path(environ["support_files_path"] + f'{self.dataset}_metadata_' + date.strftime("%m%d%Y") + ".jsonl")
+
+    # Bring the support file from a particular date up to date, only crawling the days since its newest file
+    def refresh_dataset_file(self, latest_date, look_back_days=5):
+        # Path to the existing file
+        old_path = self.get_dataset_file_path(latest_date)
+        # Path to the existing metadata file
+        old_metadata_path = self.get_metadata_file_path(latest_date)
+        # If there is a metadata file, keep it up to date too
+        with_metadata = exists(old_metadata_path)
+        # Newest acquisition date in the file (YYYYDOY strings sort chronologically), and file count
+        newest_year_doy = None
+        old_count = 0
+        # For each file in the existing file
+        for file in iterate_support_file(old_path):
+            # Keep the newest acquisition date
+            if newest_year_doy is None or file.split('.')[3][0:7] > newest_year_doy:
+                newest_year_doy = file.split('.')[3][0:7]
+            # Increment file count
+            old_count += 1
+        # If there are no files in the existing file
+        if newest_year_doy is None:
+            # Make a whole new file instead
+            self.make_new_dataset_file()
+            return
+        # Get the newest acquisition date
+        newest_date = datetime.date(year=int(newest_year_doy[0:4]), month=1, day=1) + \
+            datetime.timedelta(days=int(newest_year_doy[4:7]) - 1)
+        # Start the crawl a few days earlier to catch files that were published late
+        start_date = newest_date - datetime.timedelta(days=look_back_days)
+        # Log the info
+        logging.info(f'Refreshing {self.dataset} from {start_date} (newest file is from {newest_date}).')
+        # If the files are harvested with the item search endpoint (always for metadata, see make_new_dataset_file)
+        if self.harvest_mode == 'search' or with_metadata:
+            # Search for the files on or after the start date (only a few days, so held in memory)
+            new_list = t_stac_search.get_items_from_STAC_search(self.dataset,
+                                                                start_date=start_date,
+                                                                with_metadata=with_metadata,
+                                                                session=self.session,
+                                                                retry_policy=self.retry_policy)
+        # Otherwise
+        else:
+            # Get the files on or after the start date (only a few days, so held in memory)
+            new_list = t_stac_search.get_items_from_STAC(self.dataset,
+                                                         max_workers=int(environ.get('stac_max_workers', 1)),
+                                                         start_date=start_date,
+                                                         cache=t_stac_cache.get_default_cache(),
+                                                         with_metadata=with_metadata,
+                                                         session=self.session,
+                                                         retry_policy=self.retry_policy)
+        # If the crawl failed
+        if new_list is False:
+            # Log error
+            logging.error(f'Refresh of {self.dataset} failed. Keeping the file from {latest_date}.')
+            return
+        # Titles in the existing file from the refreshed window
+        old_window_set = set([file for file in iterate_support_file(old_path)
+                              if get_date_from_file(file) >= start_date])
+        # Titles that are new since the existing file
+        added_list = [title for title in dict.fromkeys([t_stac_search.get_title_from_item(item) for item in new_list])
+                      if title not in old_window_set]
+        # Cloud and spatial coverage of the new titles (if the metadata is being kept up to date)
+        coverage = {item['title']: (item['cloud_cover'], item['spatial_coverage']) for item in new_list} \
+            if with_metadata else None
+        # Date of the refreshed file
+        refresh_date = datetime.datetime.now()
+        # If the metadata is being kept up to date
+        if with_metadata:
+            # Merge the old and new records into the file
+            file_count = self.write_dataset_files(merge_refreshed_items(old_metadata_path, new_list, start_date),
+                                                  refresh_date, with_metadata=True)
+        # Otherwise
+        else:
+            # Merge the old and new files into the file
+            file_count = self.write_dataset_files(merge_refreshed_items(old_path, new_list, start_date), refresh_date)
+        # Log the info
+        logging.info(f'{file_count - old_count} files added to {self.dataset}.')
+        # Update the binary catalog in place with the new files (files that were not retrieved again are kept, as in
+        # the support file, so none are removed)
+        self.update_catalog(old_path, self.get_dataset_file_path(refresh_date), added=added_list, coverage=coverage)
+
+    # Make the binary catalog of a newer support file from the one of an older support file, with titles added and
+    # removed, optionally with the coverage of the titles added (see t_hls_catalog.HLSPartitionedCatalog.apply_delta).
+    # It is a new version of the catalog, with the older catalog's update log. The older catalog is left as it is for
+    # processes still reading it. A catalog database is just updated in place
+    def update_catalog(self, old_path, new_path, added=(), removed=(), coverage=None):
+        # If the catalog is kept in a database
+        if self.catalog_backend == 'sqlite':
+            # Open the database
+            catalog = t_hls_catalog_sqlite.HLSSQLiteCatalog(self.get_catalog_database_path())
+            # If it is not up to date with the older file
+            if not catalog.is_up_to_date(old_path):
+                # If the files are the same, the file has already been replaced (it will be written from the file when
+                # it is opened)
+                if old_path == new_path:
+                    return
+                # Write the files in the older file to it
+                catalog.write_catalog(self.make_catalog_from_file(old_path), source_path=old_path)
+            # Update it in place (readers see the whole update or none of it)
+            version = catalog.apply_delta(added=added, removed=removed, coverage=coverage, source_path=new_path)
+            # Log the info
+            logging.info(f'{self.dataset} catalog updated to version {version}.')
+            return
+        # Paths to the binary catalogs
+        old_catalog_path = t_hls_catalog.get_catalog_path(old_path)
+        new_catalog_path = t_hls_catalog.get_catalog_path(new_path)
+        # If the files are the same (refreshed twice on one date), the file has already been replaced
+        if old_path == new_path:
+            # If there is no catalog
+            if not exists(old_catalog_path / 'partitions.json'):
+                # It will be written from the file when it is opened
+                return
+            # Update the catalog in place
+            version = t_hls_catalog.HLSPartitionedCatalog(new_catalog_path).apply_delta(added=added, removed=removed,
+                                                                                        coverage=coverage)
+        # Otherwise
+        else:
+            # Make sure the binary catalog of the older file is there and up to date
+            self.write_binary_catalog(old_path)
+            # Copy it next to the newer file (the year files are linked, so only the years with changes take space)
+            temp_path = t_hls_catalog.copy_partitioned_catalog(old_catalog_path, new_catalog_path)
+            # Update the copy
+            version = t_hls_catalog.HLSPartitionedCatalog(temp_path).apply_delta(added=added, removed=removed,
+                                                                                 coverage=coverage)
+            # Move it into place (if another process has already written the newer file's catalog, that one is kept)
+            if not t_hls_catalog.move_partitioned_catalog(temp_path, new_catalog_path):
+                # Log the info
+                logging.info(f'{self.dataset} catalog of {new_path} was already written. Keeping it.')
+                return
+        # Log the info
+        logging.info(f'{self.dataset} catalog updated to version {version}.')
+
+    # Get the titles added to the catalog after one version, up to and including another (the latest if None). Returns
+    # False if the catalog has no versions (made from titles in memory)
+    def get_added_between(self, from_version, to_version=None):
+        # If the catalog has no update log
+        if not hasattr(self.catalog, 'get_added_between'):
+            # Log error
+            logging.error(f'The {self.dataset} catalog was made from titles in memory, so it has no versions. Open it '
+                          f'from a support file to get the titles added between versions.')
+            return False
+        # Return the titles
+        return self.catalog.get_added_between(from_version, to_version=to_version)
+
+    # Get the latest date of a support file for the dataset (from the manifest, or by looking through the support file
+    # directory if the manifest doesn't have it)
     def get_latest_dataset_file(self):
+        # Manifest of the support files
+        manifest = t_support_manifest.SupportFileManifest(environ["support_files_path"])
+        # Get the latest date in the manifest
+        latest_date = manifest.get_latest_date(self.dataset)
+        # If there is one (and its file is still there)
+        if latest_date is not None and exists(self.get_dataset_file_path(latest_date)):
+            # Return it
+            return latest_date
+        # Otherwise, look for the latest file
+        latest_date = self.find_latest_dataset_file()
+        # If there is one
+        if latest_date is not None:
+            # Path to the file
+            file_path = self.get_dataset_file_path(latest_date)
+            # Record it in the manifest (so the directory doesn't need looking through next time)
+            manifest.add_snapshot(self.dataset, latest_date, file_path,
+                                  sum(1 for file in iterate_support_file(file_path)))
+        # Return the latest date
+        return latest_date
+
+    # Find the latest date of a support file for the dataset by walking the support file directory
+    def find_latest_dataset_file(self):
         # Latest date variable
         latest_date = None
         # Walk the support file directory
         for root, dirs, files in walk(environ["support_files_path"]):
             # For each file name
             for name in files:
-                # If the file is one of the URL files
-                if f"{self.dataset}_files_" in name:
+                # If the file is one of the URL files (in either format)
+                if f"{self.dataset}_files_" in name and (name.endswith('.json') or name.endswith('.jsonl')):
                     # Split the name
                     split_name = name.split('_')
                     # Make a datetime date object from the name
@@ -139,176 +515,243 @@ class HLSDataset:
         # Return latest date
         return latest_date
 
-    # Takes a MGSR tile designation, and a datetime date object.
-    def get_relevant_tiles(self, mgrs_cell, date):
+    # Remove the support files (and their binary catalogs and metadata files) of all but the latest few snapshots of the
+    # dataset in the manifest
+    def prune_dataset_files(self, keep=1):
+        # Manifest of the support files
+        manifest = t_support_manifest.SupportFileManifest(environ["support_files_path"])
+        # For each old snapshot (removed from the manifest)
+        for snapshot in manifest.remove_old_snapshots(self.dataset, keep=keep):
+            # Get the date
+            date = datetime.date.fromisoformat(snapshot['date'])
+            # Path to the support file
+            file_path = self.get_dataset_file_path(date)
+            # For each file of the snapshot
+            for path in (file_path, self.get_metadata_file_path(date)):
+                # Remove it (if it is there)
+                path.unlink(missing_ok=True)
+            # Remove its binary catalogs (of every layout)
+            for catalog_path in file_path.parent.glob(file_path.stem + '*.catalog'):
+                shutil.rmtree(catalog_path, ignore_errors=True)
+            # Log the info
+            logging.info(f'Removed the {self.dataset} support files from {date}.')
+
+    # Takes a MGSR tile designation, and a datetime date object. Optionally leaves out files over a cloud cover
+    # (maximum %) or under a spatial coverage (minimum %) threshold, after searching through all the files. Searches
+    # northward and southward from the target tile, and westward and eastward from every tile reached (one search
+    # over (tile, direction) states, so no state is searched twice). Optionally stops after a number of moves
+    def get_relevant_tiles(self, mgrs_cell, date, max_cloud_cover=None, min_spatial_coverage=None, max_hops=None):
         # Split out the MGSR cell designation into its components
         major_row, major_col, minor_row, minor_col = get_mgrs_components(mgrs_cell)
-        # Tile files
+        # Target (major) tile
+        target_tile = f'{major_col}{major_row}'
+        # Files of each (major) tile checked
+        files_by_tile = {}
+        # Search from the target tile in every direction
+        tiles = self.search_tiles([(target_tile, direction) for direction in ('N', 'S', 'W', 'E')], date,
+                                  max_hops=max_hops, files_by_tile=files_by_tile)
+        # Files of each tile within the thresholds (the same as the files checked if there are none)
+        passing_files_by_tile = files_by_tile if max_cloud_cover is None and min_spatial_coverage is None else {}
+        # Return the files of the target tile and all the tiles reached, leaving out the files that are too cloudy or
+        # small (the search still went through them, so that it is not cut short by a cloudy tile)
+        return self.get_files_of_tiles([target_tile] + tiles, date, passing_files_by_tile,
+                                       max_cloud_cover=max_cloud_cover, min_spatial_coverage=min_spatial_coverage)
+
+    # Search for the (major) tiles with files that can be reached from (tile, direction) states on a date. Northward and
+    # southward moves also start westward and eastward searches. Optionally stops after a number of moves, shares the
+    # files of each tile checked (dictionary) and reuses the tiles already reached from other states (dictionary of
+    # lists by state). Returns the tiles in the order they were reached
+    def search_tiles(self, start_states, date, max_hops=None, files_by_tile=None, closures=None):
+        # Directions to carry on searching in after a move in each direction
+        next_directions = {'N': ('N', 'W', 'E'), 'S': ('S', 'W', 'E'), 'W': ('W',), 'E': ('E',)}
+        # If there are no files of tiles to share
+        if files_by_tile is None:
+            files_by_tile = {}
+        # Tiles reached (dictionary, to keep the order they were reached in)
+        reached_tiles = {}
+        # States searched
+        visited = set(start_states)
+        # Queue of (tile, direction, moves so far) to search
+        to_search = deque([(tile, direction, 0) for tile, direction in start_states])
+        # While there are still searches
+        while len(to_search) > 0:
+            # Take the next search from the queue
+            curr_tile, direction, hops = to_search.popleft()
+            # If the tiles reached from this state are already known (from another search)
+            if closures is not None and (curr_tile, direction) in closures.keys():
+                # Add them instead of searching again
+                reached_tiles.update(dict.fromkeys(closures[(curr_tile, direction)]))
+                continue
+            # If it is as far as the search should go
+            if max_hops is not None and hops >= max_hops:
+                # Don't move any further
+                continue
+            # For each tile in the direction
+            for tile in move_in_direction(curr_tile[-1], curr_tile[0:2], direction):
+                # If the tile hasn't been checked yet
+                if tile not in files_by_tile.keys():
+                    # Get any files
+                    files_by_tile[tile] = self.check_for_files(tile, date)
+                # If there were no files
+                if len(files_by_tile[tile]) == 0:
+                    # The search stops here
+                    continue
+                # Add the tile to the tiles reached
+                reached_tiles[tile] = None
+                # For each direction to carry on in
+                for next_direction in next_directions[direction]:
+                    # If the tile hasn't been searched in the direction yet
+                    if (tile, next_direction) not in visited:
+                        # Add it to the queue
+                        visited.add((tile, next_direction))
+                        to_search.append((tile, next_direction, hops + 1))
+        # Return the tiles reached
+        return list(reached_tiles.keys())
+
+    # Get the files of (major) tiles on a date (once per tile), optionally only those within cloud cover and spatial
+    # coverage thresholds, using the files already checked (with the same thresholds) where possible
+    def get_files_of_tiles(self, tiles, date, files_by_tile, max_cloud_cover=None, min_spatial_coverage=None):
+        # List for files
         tile_files = []
-        # Set the current row and column
-        curr_row = major_row
-        curr_col = major_col
-        # Stacks for the ongoing searches
-        to_search_northward = [f'{curr_col}{curr_row}']
-        to_search_westward = [f'{curr_col}{curr_row}']
-        to_search_eastward = [f'{curr_col}{curr_row}']
-        to_search_southward = [f'{curr_col}{curr_row}']
-
-        # Check for other tiles in the same major tile as the target
-        files_list = self.check_for_files(f'{curr_col}{curr_row}', date)
-        # For each file
-        for file in files_list:
-            # Add to the tile files (note this process will add the original tile file)
-            tile_files.append(file)
-
-        # While we are still looking northward
-        while len(to_search_northward) > 0:
-            # Pop a tile from the northward search stack
-            curr_tile = to_search_northward.pop()
-            # Update the current search row and col
-            curr_row = curr_tile[-1]
-            curr_col = curr_tile[0:2]
-            # For each northward tile
-            for tile in move_northwards(curr_row, curr_col):
-                # Get any files
-                files_list = self.check_for_files(tile, date)
-                # If there was at least one file
-                if len(files_list) > 0:
-                    # Add the tile to the relevant stacks for further searching
-                    if tile not in to_search_northward:
-                        to_search_northward.append(tile)
-                    if tile not in to_search_westward:
-                        to_search_westward.append(tile)
-                    if tile not in to_search_eastward:
-                        to_search_eastward.append(tile)
-                # For each file in the list
-                for file in files_list:
-                    # If it is not already in the tile files list
-                    if file not in tile_files:
-                        # Add it
-                        tile_files.append(file)
-
-        # While we are still looking southward
-        while len(to_search_southward) > 0:
-            # Pop a tile from the southward search stack
-            curr_tile = to_search_southward.pop()
-            # Update the current search row and col
-            curr_row = curr_tile[-1]
-            curr_col = curr_tile[0:2]
-            # For each southward tile
-            for tile in move_southwards(curr_row, curr_col):
-                # Get any files
-                files_list = self.check_for_files(tile, date)
-                # If there was at least one file
-                if len(files_list) > 0:
-                    # Add the tile to the relevant stacks for further searching
-                    if tile not in to_search_southward:
-                        to_search_southward.append(tile)
-                    if tile not in to_search_westward:
-                        to_search_westward.append(tile)
-                    if tile not in to_search_eastward:
-                        to_search_eastward.append(tile)
-                # For each file in the list
-                for file in files_list:
-                    # If it is not already in the tile files list
-                    if file not in tile_files:
-                        # Add it
-                        tile_files.append(file)
-
-        # While we are still looking westward
-        while len(to_search_westward) > 0:
-            # Pop a tile from the westward search stack
-            curr_tile = to_search_westward.pop()
-            # Update the current search row and col
-            curr_row = curr_tile[-1]
-            curr_col = curr_tile[0:2]
-            # For each westward tile
-            for tile in move_westwards(curr_row, curr_col):
+        # For each tile (leaving out repeats)
+        for tile in dict.fromkeys(tiles):
+            # If the tile hasn't been checked yet
+            if tile not in files_by_tile.keys():
                 # Get any files
-                files_list = self.check_for_files(tile, date)
-                # If there was at least one file
-                if len(files_list) > 0:
-                    # Add the tile to the relevant stacks for further searching
-                    if tile not in to_search_westward:
-                        to_search_westward.append(tile)
-                # For each file in the list
-                for file in files_list:
-                    # If it is not already in the tile files list
-                    if file not in tile_files:
-                        # Add it
-                        tile_files.append(file)
-
-        # While we are still looking eastward
-        while len(to_search_eastward) > 0:
-            # Pop a tile from the eastward search stack
-            curr_tile = to_search_eastward.pop()
-            # Update the current search row and col
-            curr_row = curr_tile[-1]
-            curr_col = curr_tile[0:2]
-            # For each eastward tile
-            for tile in move_eastwards(curr_row, curr_col):
-                # Get any files
-                files_list = self.check_for_files(tile, date)
-                # If there was at least one file
-                if len(files_list) > 0:
-                    # Add the tile to the relevant stacks for further searching
-                    if tile not in to_search_eastward:
-                        to_search_eastward.append(tile)
-                # For each file in the list
-                for file in files_list:
-                    # If it is not already in the tile files list
-                    if file not in tile_files:
-                        # Add it
-                        tile_files.append(file)
-
+                files_by_tile[tile] = self.check_for_files(tile, date, max_cloud_cover=max_cloud_cover,
+                                                           min_spatial_coverage=min_spatial_coverage)
+            # Add the files
+            tile_files.extend(files_by_tile[tile])
+        # Return the files
         return tile_files
 
-    # Check for files for a particular tile
-    def check_for_files(self, tile, date):
-        # Get the year and DOY to search
-        year = str(date.year)
-        doy = zero_pad_number((date - datetime.date(year=date.year, month=1, day=1)).days + 1, digits=3)
-        # List for files
-        files_list = []
-        # Search for the year
-        if year in self.by_date.keys():
-            # Search for the DOY
-            if doy in self.by_date[year].keys():
-                # For each file
-                for file in self.by_date[year][doy]:
-                    # Get the file's tile
-                    file_tile = file.split('.')[2][1:4]
-                    # If the (major) tile matches
-                    if file_tile == tile:
-                        # Add the file to the list
-                        files_list.append(file)
-        # Return the list
-        return files_list
+    # Get the relevant files (see get_relevant_tiles) for many targets ((MGRS cell, datetime date object) tuples).
+    # Targets are grouped by date, so that the search work is shared by the targets of a date. Optionally spreads the
+    # dates over a pool of processes (each process opens the dataset from its support files). Returns a dictionary of
+    # the files by target
+    def get_relevant_tiles_for_targets(self, targets, max_cloud_cover=None, min_spatial_coverage=None, max_hops=None,
+                                       max_workers=1):
+        # Group the target cells by date
+        cells_by_date = {}
+        for mgrs_cell, date in targets:
+            cells_by_date.setdefault(date, []).append(mgrs_cell)
+        # Dictionary for the files by target
+        relevant_files = {}
+        # If there is only one worker (or the catalog can't be opened by other processes, see make_worker_pool)
+        if max_workers <= 1 or self.snapshot_date is None:
+            # For each date
+            for date, cells in cells_by_date.items():
+                # Get the files of the date's targets
+                relevant_files.update(self.get_relevant_tiles_on_date(cells, date, max_cloud_cover=max_cloud_cover,
+                                                                      min_spatial_coverage=min_spatial_coverage,
+                                                                      max_hops=max_hops))
+            # Return the files
+            return relevant_files
+        # Otherwise, search the dates in a pool of processes
+        with self.make_worker_pool(max_workers) as executor:
+            # Submit each date
+            futures = [executor.submit(get_relevant_tiles_on_worker, cells, date, max_cloud_cover,
+                                       min_spatial_coverage, max_hops) for date, cells in cells_by_date.items()]
+            # For each date
+            for future in futures:
+                # Add the files of the date's targets
+                relevant_files.update(future.result())
+        # Return the files
+        return relevant_files
+
+    # Get the relevant files (see get_relevant_tiles) for many MGRS cells on a date. The files of each tile are only
+    # checked once, targets in the same (major) tile share a search and (without a limit on moves) the tiles reached
+    # from each target's states are reused by later searches that reach those states. Returns a dictionary of the files
+    # by (cell, date) target
+    def get_relevant_tiles_on_date(self, cells, date, max_cloud_cover=None, min_spatial_coverage=None, max_hops=None):
+        # Files of each (major) tile checked, and the ones within the thresholds (the same if there are none)
+        files_by_tile = {}
+        passing_files_by_tile = files_by_tile if max_cloud_cover is None and min_spatial_coverage is None else {}
+        # Tiles reached from each (tile, direction) state searched
+        closures = {}
+        # Files of each target (major) tile
+        files_by_target_tile = {}
+        # Dictionary for the files by target
+        relevant_files = {}
+        # For each cell
+        for mgrs_cell in cells:
+            # Split out the MGSR cell designation into its components
+            major_row, major_col, minor_row, minor_col = get_mgrs_components(mgrs_cell)
+            # Target (major) tile
+            target_tile = f'{major_col}{major_row}'
+            # If the target tile hasn't been searched yet
+            if target_tile not in files_by_target_tile.keys():
+                # List for the tiles reached
+                tiles = [target_tile]
+                # For each direction
+                for direction in ('N', 'S', 'W', 'E'):
+                    # Search in the direction (reusing the tiles reached from other states, unless moves are limited)
+                    state_tiles = self.search_tiles([(target_tile, direction)], date, max_hops=max_hops,
+                                                    files_by_tile=files_by_tile,
+                                                    closures=closures if max_hops is None else None)
+                    # If moves are not limited
+                    if max_hops is None:
+                        # Keep the tiles reached from the state for the other searches
+                        closures[(target_tile, direction)] = state_tiles
+                    # Add the tiles
+                    tiles.extend(state_tiles)
+                # Get the files of the tiles (leaving out the files that are too cloudy or small)
+                files_by_target_tile[target_tile] = self.get_files_of_tiles(tiles, date, passing_files_by_tile,
+                                                                            max_cloud_cover=max_cloud_cover,
+                                                                            min_spatial_coverage=min_spatial_coverage)
+            # Add the files of the target
+            relevant_files[(mgrs_cell, date)] = files_by_target_tile[target_tile]
+        # Return the files
+        return relevant_files
+
+    # Check for files for a particular tile (optionally within cloud cover and spatial coverage thresholds)
+    def check_for_files(self, tile, date, max_cloud_cover=None, min_spatial_coverage=None):
+        # Return the files on the date in the (major) tile (within the thresholds, read from the catalog's columns)
+        return self.catalog.get_files(get_year_doy_from_date(date), major_tile=tile, max_cloud_cover=max_cloud_cover,
+                                      min_spatial_coverage=min_spatial_coverage)
+
+    # Get the files in a range of dates (datetime date objects, both included), optionally only those in a (major) tile
+    # and within cloud cover and spatial coverage thresholds
+    def get_files_between(self, start_date, end_date, tile=None, max_cloud_cover=None, min_spatial_coverage=None):
+        # Return the files in the range (within the thresholds)
+        return self.catalog.get_files_between(get_year_doy_from_date(start_date), get_year_doy_from_date(end_date),
+                                              major_tile=tile, max_cloud_cover=max_cloud_cover,
+                                              min_spatial_coverage=min_spatial_coverage)
+
+    # Get the time series of files (in date and time order) of each of some MGRS cells (e.g. ['14TPL', '31UDQ']) in a
+    # range of dates (datetime date objects, both included), optionally only the files within cloud cover and spatial
+    # coverage thresholds. Returns a dictionary of the time series by cell
+    def get_time_series(self, mgrs_cells, start_date, end_date, max_cloud_cover=None, min_spatial_coverage=None):
+        # Return the time series (of the files within the thresholds)
+        return self.catalog.get_time_series(mgrs_cells, get_year_doy_from_date(start_date),
+                                            get_year_doy_from_date(end_date), max_cloud_cover=max_cloud_cover,
+                                            min_spatial_coverage=min_spatial_coverage)
+
+    # Iterate over the time series of files (in date and time order) of an MGRS cell (e.g. '14TPL') in a range of dates
+    # (datetime date objects, both included), optionally only the files within cloud cover and spatial coverage
+    # thresholds. The files are only read from the catalog as the iteration reaches them
+    def iterate_time_series(self, mgrs_cell, start_date, end_date, max_cloud_cover=None, min_spatial_coverage=None):
+        # Yield the files of the time series (within the thresholds)
+        yield from self.catalog.iterate_time_series(mgrs_cell, get_year_doy_from_date(start_date),
+                                                    get_year_doy_from_date(end_date), max_cloud_cover=max_cloud_cover,
+                                                    min_spatial_coverage=min_spatial_coverage)
 
     # Check for slivers of the same minor cell in another major cell
     def check_for_slivers(self, target_cell, date):
         # List for cross-boundary cells
         cell_list = []
-        # Get the DOY as a string
-        doy = zero_pad_number(get_doy_from_date(date), digits=2)
+        # Get the year and DOY to search
+        year_doy = get_year_doy_from_date(date)
         # Get list of northward and southward cells
         northward_cells, southward_cells = get_northward_and_southward_cells(target_cell)
-        # For each file on the target date
-        for file in self.by_date[str(date.year)][doy]:
-            # Get the MGRS grid cell from the file name
-            cell = get_tile_from_file(file)
+        # For each northward or southward cell (in catalog order)
+        for cell in sorted(set(northward_cells + southward_cells), key=t_hls_catalog.encode_tile):
             # If the cell is a complete match
             if cell == target_cell:
                 # This is the target cell, skip it
                 continue
-            # If the cell name is in the northwards cells
-            if cell in northward_cells:
-                # Add the cell to the cell list
-                cell_list.append(cell)
-            # Otherwise, if the cell name is in the southward cells
-            elif cell in southward_cells:
-                # Add the cell to the cell list
-                cell_list.append(cell)
+            # Add the cell to the cell list (once for each of its files on the target date)
+            cell_list.extend([cell] * len(self.catalog.get_tile_files(year_doy, cell)))
         # Return the cell list
         return cell_list
 
@@ -317,64 +760,203 @@ class HLSDataset:
         # Check for slivers
         self.check_for_slivers(mgrs_cell, date)
 
-    # Generate strip targets from this dataset
-    def generate_strip_targets(self):
+    # Generate strip targets from this dataset (optionally only from files within cloud cover and spatial coverage
+    # thresholds). The files of each date are grouped into strips in one pass (see make_strips_of_day). Optionally
+    # spreads the dates over a pool of processes (each process opens the dataset from the same support file, so the
+    # memory-mapped catalog is shared rather than copied to each one, and sends back the finished strips of its
+    # dates). Returns an organizer of the strips
+    def generate_strip_targets(self, max_cloud_cover=None, min_spatial_coverage=None, max_workers=1):
         # Make an organizer
         organizer = HLSStripOrganizer()
-        # For each year
-        for year in self.by_date.keys():
-            # For each doy
-            for doy in self.by_date[year].keys():
-                # For each file
-                for file in self.by_date[year][doy]:
-                    # If the file is not already in the organizer dictionary
-                    if file not in organizer.by_file.keys():
-                        # Get the date
-                        date = datetime.date(year=int(year), day=1, month=1) + datetime.timedelta(days=int(doy) - 1)
-                        # Add the file with a new target strip
-                        organizer.by_file[file] = HLSTargetStrip(date)
-                        # Reference the strip object
-                        strip = organizer.by_file[file]
-                        # Add the file to the strip
-                        strip.files.append(file)
-                        # Get the cell from the file
-                        cell = get_tile_from_file(file)
-                        # Stacks for the ongoing searches
-                        to_search_westward = [cell]
-                        to_search_eastward = [cell]
-                        # Check for slivers that overlap into other northward and southward major cells
-                        overlap_slivers = self.check_for_slivers(cell, date)
-                        # For each sliver
-                        for sliver in overlap_slivers:
-                            # Add to the slivers in the strip
-                            strip.files.append(sliver)
-                            # Reference the strip in the organizer
-                            organizer.by_file[sliver] = strip
-                            # Add the slivers to the westward and eastward searches
-                            to_search_eastward.append(sliver)
-                            to_search_westward.append(sliver)
-                        # While the eastward stack yet lives
-                        while len(to_search_eastward) > 0:
-                            # Pop a cell from the eastward search stack
-                            curr_cell = to_search_eastward.pop()
-                            # Get the components of the tile
-                            curr_row, curr_col, curr_minor_row, curr_minor_col = get_mgrs_components(curr_cell)
-                            # For each eastward tile
-                            for tile in move_minor_eastwards(curr_cell):
-                                pass
-                                # Get any files
-                                #files_list = self.check_for_files(tile, date)
-                                # If there was at least one file
-                                #if len(files_list) > 0:
-                                    # Add the tile to the relevant stacks for further searching
-                                    #if tile not in to_search_eastward:
-                                     #   to_search_eastward.append(tile)
-                                # For each file in the list
-                                #for file in files_list:
-                                    # If it is not already in the tile files list
-                                    #if file not in tile_files:
-                                        # Add it
-                                        #tile_files.append(file)
+        # Get the dates (YYYYDDD) of the files
+        year_doys = [int(year + doy) for year in self.by_date.keys() for doy in self.by_date[year].keys()]
+        # If there is only one worker (or the catalog can't be opened by other processes, see make_worker_pool)
+        if max_workers <= 1 or self.snapshot_date is None:
+            # Add the strips of every date
+            for strip in self.get_strips_on_dates(year_doys, max_cloud_cover=max_cloud_cover,
+                                                  min_spatial_coverage=min_spatial_coverage):
+                organizer.add_strip(strip)
+            # Return the organizer
+            return organizer
+        # Otherwise, split the dates into runs of consecutive dates (a few for each worker, so that the work stays
+        # balanced and each worker only opens a few years of the catalog)
+        run_length = max(1, -(-len(year_doys) // (max_workers * 4)))
+        runs = [year_doys[start:start + run_length] for start in range(0, len(year_doys), run_length)]
+        # Group the files of the runs into strips in a pool of processes (each sends back the finished groups of its
+        # dates)
+        with self.make_worker_pool(max_workers) as executor:
+            # Submit each run
+            futures = [executor.submit(get_strip_groups_on_worker, run, max_cloud_cover, min_spatial_coverage)
+                       for run in runs]
+            # For each run (in date order)
+            for future in futures:
+                # For each date of the run
+                for year_doy, files, strip_ends in future.result():
+                    # Add the strips of the date
+                    for strip in make_strips_from_groups(files, get_date_from_year_doy(year_doy), strip_ends):
+                        organizer.add_strip(strip)
+        # Return the organizer
+        return organizer
+
+    # Get the strips (see make_strips_of_day) of the files on some dates (YYYYDDD) as groups of files, optionally only
+    # from files within cloud cover and spatial coverage thresholds. Returns a list of each date, its files in strip
+    # order and where each strip ends (compact to send between processes, see make_strips_from_groups)
+    def get_strip_groups_on_dates(self, year_doys, max_cloud_cover=None, min_spatial_coverage=None):
+        # List for the groups
+        groups = []
+        # For each date
+        for year_doy in year_doys:
+            # Get the files and their tiles
+            files, tiles = self.get_files_and_tiles_on_date(year_doy, max_cloud_cover=max_cloud_cover,
+                                                            min_spatial_coverage=min_spatial_coverage)
+            # Get the strip number of each file
+            strip_numbers = np.array(get_strip_numbers(tiles), dtype=np.int64)
+            # Add the files in strip order (in the order given within each strip) and where each strip ends
+            groups.append((year_doy, [files[index] for index in np.argsort(strip_numbers, kind='stable').tolist()],
+                           np.cumsum(np.bincount(strip_numbers)).tolist()))
+        # Return the groups
+        return groups
+
+    # Make a pool of processes that each open this dataset's catalog from the same support file (the snapshot this
+    # process opened, as it is, so the workers never harvest or refresh, or open a newer snapshot). Only for a catalog
+    # opened from a support file
+    def make_worker_pool(self, max_workers):
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=open_worker_dataset,
+                                   initargs=(self.dataset[3:6], self.snapshot_date, self.catalog_backend,
+                                             self.memory_limit_bytes))
+
+    # Get the files on a date (YYYYDDD) and their tile codes (from the catalog, see t_hls_catalog.encode_tile),
+    # optionally only those within cloud cover and spatial coverage thresholds
+    def get_files_and_tiles_on_date(self, year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        # Return the files and tiles (within the thresholds)
+        return self.catalog.get_files_and_tiles(year_doy, max_cloud_cover=max_cloud_cover,
+                                                min_spatial_coverage=min_spatial_coverage)
+
+    # Get the strips (see make_strips_of_day) of the files on some dates (YYYYDDD), optionally only from files within
+    # cloud cover and spatial coverage thresholds
+    def get_strips_on_dates(self, year_doys, max_cloud_cover=None, min_spatial_coverage=None):
+        # List for the strips
+        strips = []
+        # For each date
+        for year_doy in year_doys:
+            # Get the files and their tiles
+            files, tiles = self.get_files_and_tiles_on_date(year_doy, max_cloud_cover=max_cloud_cover,
+                                                            min_spatial_coverage=min_spatial_coverage)
+            # Add the strips of the files (grouped by their tile codes)
+            strips.extend(make_strips_of_day(files, get_date_from_year_doy(year_doy),
+                                             strip_numbers=get_strip_numbers(tiles)))
+        # Return the strips
+        return strips
+
+
+# Dataset opened by a worker process (see open_worker_dataset)
+worker_dataset = None
+
+
+# Open a dataset (L30 or S30) from the support file of a date in a worker process (initializer for a process pool, see
+# HLSDataset.make_worker_pool)
+def open_worker_dataset(dataset, snapshot_date, catalog_backend=None, memory_limit_bytes=None):
+    global worker_dataset
+    # Open the dataset
+    worker_dataset = HLSDataset(dataset, catalog_backend=catalog_backend, memory_limit_bytes=memory_limit_bytes,
+                                snapshot_date=snapshot_date)
+
+
+# Get the relevant files for MGRS cells on a date with the dataset opened by a worker process
+def get_relevant_tiles_on_worker(cells, date, max_cloud_cover=None, min_spatial_coverage=None, max_hops=None):
+    return worker_dataset.get_relevant_tiles_on_date(cells, date, max_cloud_cover=max_cloud_cover,
+                                                     min_spatial_coverage=min_spatial_coverage, max_hops=max_hops)
+
+
+# Get the strips of the files on some dates as groups of files (see HLSDataset.get_strip_groups_on_dates) with the
+# dataset opened by a worker process
+def get_strip_groups_on_worker(year_doys, max_cloud_cover=None, min_spatial_coverage=None):
+    return worker_dataset.get_strip_groups_on_dates(year_doys, max_cloud_cover=max_cloud_cover,
+                                                    min_spatial_coverage=min_spatial_coverage)
+
+
+# Iterate over the files in a support file (line-delimited, or the older single JSON list)
+def iterate_support_file(file_path):
+    # Open the file
+    with open(file_path, 'r') as f:
+        # If the file is line-delimited
+        if str(file_path).endswith('.jsonl'):
+            # For each line
+            for line in f:
+                # Yield the file
+                yield json.loads(line)
+        # Otherwise (single JSON list)
+        else:
+            # Load the list and yield its files
+            yield from json.load(f)
+
+
+# Write items to a line-delimited file (via a temporary file) and return how many were written. Optionally only moves
+# the file into place if the items are complete (a function checked once they are all written), otherwise removes it
+# and returns False
+def write_lines_file(items, file_path, is_complete=None):
+    # Temporary path (so that a partly written file is never picked up as the latest)
+    temp_path = file_path.with_suffix('.partial')
+    # Item count
+    item_count = 0
+    # Open the temporary file
+    with open(temp_path, 'w') as f:
+        # For each item
+        for item in items:
+            # Write it on its own line
+            f.write(json.dumps(item) + '\n')
+            # Increment item count
+            item_count += 1
+    # If the items are not complete
+    if is_complete is not None and not is_complete():
+        # Remove the file
+        temp_path.unlink()
+        return False
+    # Move the file into place
+    replace(temp_path, file_path)
+    # Return the item count
+    return item_count
+
+
+# Write metadata records to a line-delimited file (via a temporary file, moved into place once all are written) and
+# yield their titles
+def write_records_and_get_titles(records, file_path):
+    # Temporary path (so that a partly written file is never picked up)
+    temp_path = file_path.with_suffix('.partial')
+    # Open the temporary file
+    with open(temp_path, 'w') as f:
+        # For each record
+        for record in records:
+            # Write it on its own line
+            f.write(json.dumps(record) + '\n')
+            # Yield the title
+            yield record['title']
+    # Move the file into place
+    replace(temp_path, file_path)
+
+
+# Merge the items (titles or metadata records) of a support file with those of a refresh from a start date: the old
+# items from before the start date, then the new items, then any old items from the refreshed window that were not
+# retrieved again
+def merge_refreshed_items(old_path, new_items, start_date):
+    # Set of the newly retrieved titles
+    new_set = set([t_stac_search.get_title_from_item(item) for item in new_items])
+    # For each old item
+    for item in iterate_support_file(old_path):
+        # If it is from before the start date
+        if get_date_from_file(t_stac_search.get_title_from_item(item)) < start_date:
+            # Yield it
+            yield item
+    # Yield the new items
+    yield from new_items
+    # For each old item
+    for item in iterate_support_file(old_path):
+        # Get the title
+        title = t_stac_search.get_title_from_item(item)
+        # If it is from the refreshed window and was not retrieved again
+        if get_date_from_file(title) >= start_date and title not in new_set:
+            # Yield it
+            yield item
 
 
 # Class for HLS processing targets
@@ -393,8 +975,106 @@ class HLSStripOrganizer:
 
     def __init__(self):
 
+        self.strips = []
         self.by_file = {}
 
+    # Add a strip (and reference it by each of its files)
+    def add_strip(self, strip):
+        self.strips.append(strip)
+        for file in strip.files:
+            self.by_file[file] = strip
+
+
+# Group the files of one date into strips: files whose cells are next to each other (east and west, or the same minor
+# cell in the major cells to the north and south, see get_northward_and_southward_cells) end up in the same strip.
+# Joins the cells with a union-find, so the time taken grows with the number of files. Optionally takes the strip
+# numbers of the files already worked out (see get_strip_numbers). Returns the strips (files in the order given)
+def make_strips_of_day(files, date, strip_numbers=None):
+    # If the strip numbers haven't been worked out
+    if strip_numbers is None:
+        # Work them out from the tile codes of the files
+        strip_numbers = get_strip_numbers(t_hls_catalog.encode_title_tiles(files))
+    # There must be a strip number for each file
+    assert len(strip_numbers) == len(files), f'{len(strip_numbers)} strip numbers for {len(files)} files.'
+    # List for the strips
+    strips = []
+    # For each file
+    for file, strip_number in zip(files, strip_numbers):
+        # If it is the first file of its strip
+        if strip_number == len(strips):
+            # Make the strip
+            strips.append(HLSTargetStrip(date))
+        # Add the file to the strip
+        strips[strip_number].files.append(file)
+    # Return the strips
+    return strips
+
+
+# Make the strips of one date from its files in strip order and where each strip ends (see
+# HLSDataset.get_strip_groups_on_dates)
+def make_strips_from_groups(files, date, strip_ends):
+    # List for the strips
+    strips = []
+    # For each strip
+    for start, end in zip([0] + strip_ends[:-1], strip_ends):
+        # Make the strip, with its files
+        strip = HLSTargetStrip(date)
+        strip.files = files[start:end]
+        strips.append(strip)
+    # Return the strips
+    return strips
+
+
+# Get the strip number of each of the files of one date (see make_strips_of_day) from their tile codes (see
+# t_hls_catalog.encode_tile). Each cell is only looked at once, however many files it has. Strips are numbered in the
+# order of their first files
+def get_strip_numbers(tile_codes):
+    # Get the cells of the files, and the index of each file's cell
+    cell_codes, file_cells = np.unique(np.asarray(tile_codes, dtype=np.int64), return_inverse=True)
+    # Index of each cell by name
+    cell_indexes = {t_hls_catalog.decode_tile(code): index for index, code in enumerate(cell_codes.tolist())}
+    # Parent of each cell (each cell starts as its own group) and the size of each group
+    parents = list(range(len(cell_indexes)))
+    sizes = [1] * len(cell_indexes)
+    # For each cell
+    for cell, index in cell_indexes.items():
+        # Get the cells next to it (eastwards, and northwards and southwards in other major cells)
+        northward_cells, southward_cells = get_northward_and_southward_cells(cell)
+        # For each one that has files
+        for other_cell in move_minor_eastwards(cell) + northward_cells + southward_cells:
+            if other_cell in cell_indexes.keys():
+                # Get the groups of the two cells
+                root = find_root(parents, index)
+                other_root = find_root(parents, cell_indexes[other_cell])
+                # If they are different groups
+                if root != other_root:
+                    # Join the smaller group onto the larger one
+                    if sizes[root] < sizes[other_root]:
+                        root, other_root = other_root, root
+                    parents[other_root] = root
+                    sizes[root] += sizes[other_root]
+    # Get the group of each file (the group of its cell)
+    file_groups = np.array([find_root(parents, index) for index in range(len(parents))], dtype=np.int64)[file_cells]
+    # Number the groups in the order of their first files
+    groups, first_files, file_group_indexes = np.unique(file_groups, return_index=True, return_inverse=True)
+    group_numbers = np.empty(len(groups), dtype=np.int64)
+    group_numbers[np.argsort(first_files)] = np.arange(len(groups))
+    # Return the strip number of each file
+    return group_numbers[file_group_indexes].tolist()
+
+
+# Find the group of an item in a union-find (list of parents), pointing the items on the way at it
+def find_root(parents, index):
+    # Find the root
+    root = index
+    while parents[root] != root:
+        root = parents[root]
+    # Point every item on the way at the root
+    while parents[index] != root:
+        parents[index], index = root, parents[index]
+    # Return the root
+    return root
+
 
 # Split an MGRS cell into its components (major and minor rows and cols)
 def get_mgrs_components(cell):
@@ -412,6 +1092,12 @@ def get_northward_and_southward_cells(target_cell):
     # Lists  for northward and southward cells
     northward_cells = []
     southward_cells = []
+    # If there are exceptions for the cell
+    if target_cell in t_lookups.northward_intermajor_minor.keys() or \
+            target_cell in t_lookups.southward_intermajor_minor.keys():
+        # Use those instead
+        return list(t_lookups.northward_intermajor_minor.get(target_cell, [])), \
+            list(t_lookups.southward_intermajor_minor.get(target_cell, []))
     # Get the northwards major cell(s)
     northward_major_cells = move_northwards(target_row, target_col)
     # For each northward major cell (typically one)
@@ -435,7 +1121,7 @@ def northwards_row(row):
     # If the new row is 'I' or 'O'
     if new_row == 'I' or new_row == 'O':
         # Increment the row again
-        new_row = chr(ord(row) + 1)
+        new_row = chr(ord(row) + 2)
     return new_row
 
 
@@ -446,11 +1132,34 @@ def get_tile_from_file(file):
     return file.split('.')[2][1:6]
 
 
+# Get the acquisition date (datetime.date object) from an HLS file
+def get_date_from_file(file):
+    # Get the year and DOY designator
+    year_doy = file.split('.')[3]
+    # Return the date
+    return datetime.date(year=int(year_doy[0:4]), month=1, day=1) + datetime.timedelta(days=int(year_doy[4:7]) - 1)
+
+
+# Get the acquisition (YYYYDDDTHHMMSS, sorts chronologically) of an HLS file
+def get_acquisition_key(file):
+    return file[15:29]
+
+
 # Get DOY from date (datetime.date object)
 def get_doy_from_date(date):
     return (date - datetime.date(year=date.year, day=1, month=1)).days + 1
 
 
+# Get the date (datetime.date object) from the year and DOY as a number (YYYYDDD)
+def get_date_from_year_doy(year_doy):
+    return datetime.date(year=year_doy // 1000, month=1, day=1) + datetime.timedelta(days=year_doy % 1000 - 1)
+
+
+# Get the year and DOY as a number (YYYYDDD) from date (datetime.date object)
+def get_year_doy_from_date(date):
+    return date.year * 1000 + get_doy_from_date(date)
+
+
 # Takes N, S, E, or W as direction
 def check_for_dragons(row, col, direction):
     if direction == 'E':
@@ -493,8 +1202,8 @@ def move_southwards(row, col):
     new_row = chr(ord(row) - 1)
     # If the new row is 'I' or 'O'
     if new_row == 'I' or new_row == 'O':
-        # Increment the row again
-        new_row = chr(ord(row) - 1)
+        # Decrement the row again
+        new_row = chr(ord(row) - 2)
     # Otherwise, return the incremented tile col (+1, eastwards)
     return [f'{col}{new_row}']
 
@@ -510,8 +1219,8 @@ def move_eastwards(row, col):
     new_col = zero_pad_number(int(col) + 1, digits=2)
     # If the new col will be '61' (leaving the east edge of the grid)
     if new_col == '61':
-        # Change it to the west-most col ('00')
-        new_col = '00'
+        # Change it to the west-most col ('01')
+        new_col = '01'
     # Otherwise, return the incremented tile col (+1, eastwards)
     return [f'{new_col}{row}']
 
@@ -533,11 +1242,78 @@ def move_westwards(row, col):
     return [f'{new_col}{row}']
 
 
+# Move one (major) tile in a direction (N, S, E, or W)
+def move_in_direction(row, col, direction):
+    if direction == 'N':
+        return move_northwards(row, col)
+    elif direction == 'S':
+        return move_southwards(row, col)
+    elif direction == 'E':
+        return move_eastwards(row, col)
+    elif direction == 'W':
+        return move_westwards(row, col)
+    else:
+        logging.error(f'Moving only accepts strings N, S, E, or W as direction, not {direction}.')
+
+
+# Move one minor cell (100km square) eastwards. Returns the cells that can be next to it (more than one where the
+# squares of the next zone don't line up with it)
 def move_minor_eastwards(cell):
+    # If there are exceptions for the cell
+    if cell in t_lookups.eastward_intermajor_minor.keys():
+        # Return those instead
+        return list(t_lookups.eastward_intermajor_minor[cell])
     # Get the cell components
     row, col, minor_row, minor_col = get_mgrs_components(cell)
-    # Increment
-
+    # Get the column letters of the zone
+    column_letters = t_lookups.minor_column_letters[int(col) % 3]
+    # If the cell is not in the grid
+    if row not in t_lookups.band_letters or minor_col not in column_letters or \
+            minor_row not in t_lookups.minor_row_letters:
+        # Nothing is next to it
+        return []
+    # Get the column of the cell (100km of easting)
+    easting = column_letters.index(minor_col) + 1
+    # Get the first and last columns of the zone at the ends of the band (where it is narrowest and widest)
+    narrowest_columns, widest_columns = get_zone_columns(row)
+    # List for the cells
+    cells = []
+    # If the zone carries on eastwards
+    if easting < len(column_letters):
+        # Add the next cell in the zone
+        cells.append(f'{col}{row}{column_letters[easting]}{minor_row}')
+    # If the cell can be at the east edge of the zone
+    if easting >= narrowest_columns[1]:
+        # For each (major) tile eastwards
+        for tile in move_eastwards(row, col):
+            # Get the column letters of its zone
+            next_column_letters = t_lookups.minor_column_letters[int(tile[0:2]) % 3]
+            # Get the row letter (rows line up at the zone edge, but their letters start 5 later in even zones)
+            next_minor_row = t_lookups.minor_row_letters[(t_lookups.minor_row_letters.index(minor_row) -
+                                                          5 * (int(col) % 2 == 0) + 5 * (int(tile[0:2]) % 2 == 0)) % 20]
+            # Add the cells that can be at the west edge of its zone
+            for next_easting in range(widest_columns[0], narrowest_columns[0] + 1):
+                cells.append(f'{tile}{next_column_letters[next_easting - 1]}{next_minor_row}')
+    # Return the cells
+    return cells
+
+
+# Get the first and last columns of the 100km squares (1 to 8, 100km of easting) of a zone in a latitude band, where
+# the band is narrowest (its poleward edge) and widest (its equatorward edge)
+def get_zone_columns(row):
+    # Get the south and north edges of the band (degrees)
+    south = -80 + 8 * t_lookups.band_letters.index(row)
+    north = 84 if row == 'X' else south + 8
+    # List for the columns
+    columns = []
+    # For the poleward and equatorward edges
+    for latitude in (max(abs(south), abs(north)), 0 if south < 0 < north else min(abs(south), abs(north))):
+        # Get the half width of the zone (km, 3 degrees of longitude)
+        half_width = 3 * 111.32 * math.cos(math.radians(latitude))
+        # Add the first and last columns
+        columns.append((max(1, int((500 - half_width) // 100)), min(8, int((500 + half_width) // 100))))
+    # Return the columns
+    return columns
 
 
 def zero_pad_number(input_number, digits=3):
@@ -0,0 +1,1200 @@
+import re
+import json
+import shutil
+import datetime
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+from os import getpid, link, makedirs, replace
+from os.path import exists
+from pathlib import Path
+
+
+# Sensors (in the order of their codes)
+SENSORS = ('L30', 'S30')
+# Width of an HLS title (e.g. HLS.S30.T14TPL.2015334T173002.v2.0)
+TITLE_WIDTH = 34
+# Pattern of a quoted HLS title (for finding titles in a support file)
+TITLE_PATTERN = re.compile(rb'"(HLS\.[^"\\]*)"')
+# Positions of the '.' and 'T' separators in a title
+SEPARATORS = {3: b'.', 7: b'.', 8: b'T', 14: b'.', 22: b'T', 29: b'.', 30: b'v', 32: b'.'}
+
+
+# Start of a binary catalog file (and the version of its layout)
+CATALOG_MAGIC = b'HLSCAT'
+CATALOG_VERSION = 2
+# Header of a binary catalog file (magic, layout version, padding, row count, title width)
+CATALOG_HEADER = np.dtype([('magic', 'S6'), ('version', '<u2'), ('padding', '<u4'), ('rows', '<u8'),
+                           ('title_width', '<u8')])
+# Columns of a binary catalog file, in the order they are written (little-endian, fixed width)
+CATALOG_COLUMNS = (('year_doy', '<i4'), ('tile', '<i4'), ('time', '<i4'), ('sensor', '<i1'), ('version', '<i2'),
+                   ('cloud_cover', '<i1'), ('spatial_coverage', '<i1'))
+
+
+# Class for a compact, columnar catalog of HLS granules. One row per granule, sorted by date, tile and time
+class HLSGranuleCatalog:
+
+    def __init__(self, year_doy, tile, time, sensor, version, titles, cloud_cover=None, spatial_coverage=None):
+
+        # Acquisition date (YYYYDDD)
+        self.year_doy = year_doy
+        # Tile code (see encode_tile, major tile code is the tile code // 676)
+        self.tile = tile
+        # Acquisition time (HHMMSS)
+        self.time = time
+        # Sensor code (index in SENSORS)
+        self.sensor = sensor
+        # Version (major * 10 + minor, e.g. 20 for v2.0)
+        self.version = version
+        # Titles (one contiguous buffer of fixed width byte strings)
+        self.titles = titles
+        # Cloud cover and spatial coverage (whole %, -1 if unknown, see encode_coverage)
+        self.cloud_cover = np.full(len(titles), -1, dtype=np.int8) if cloud_cover is None else cloud_cover
+        self.spatial_coverage = np.full(len(titles), -1, dtype=np.int8) if spatial_coverage is None else \
+            spatial_coverage
+        # Rows in (band, column, minor row, minor column) order and their keys (made when first needed)
+        self.tile_order = None
+        self.tile_keys = None
+        # Indexes of the (date, major tile) and (date, tile) groups of rows (made when first needed)
+        self.date_major_index = None
+        self.date_tile_index = None
+        # Rows in granule ID order and their packed ID keys (made when first needed)
+        self.id_order = None
+        self.id_keys = None
+
+    # Get the number of granules
+    def __len__(self):
+        return len(self.year_doy)
+
+    # Get the (approximate) memory used by the catalog and its indexes
+    def get_size_bytes(self):
+        # Arrays of the catalog
+        arrays = [self.year_doy, self.tile, self.time, self.sensor, self.version, self.titles, self.cloud_cover,
+                  self.spatial_coverage, self.tile_order, self.tile_keys, self.id_order, self.id_keys]
+        arrays += list(self.date_major_index or []) + list(self.date_tile_index or [])
+        # Add up their sizes
+        return sum([array.nbytes for array in arrays if array is not None])
+
+    # Get a catalog of the granules of each year (dictionary by year, sharing the columns of this catalog)
+    def split_by_year(self):
+        # Get the first row of each year (rows are in date order)
+        years = self.year_doy // 1000
+        starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]]) if len(years) > 0 else np.zeros(0, dtype=int)
+        ends = np.r_[starts[1:], len(years)]
+        # Return the catalogs
+        return {int(years[start]): HLSGranuleCatalog(self.year_doy[start:end], self.tile[start:end],
+                                                     self.time[start:end], self.sensor[start:end],
+                                                     self.version[start:end], self.titles[start:end],
+                                                     self.cloud_cover[start:end], self.spatial_coverage[start:end])
+                for start, end in zip(starts, ends)}
+
+    # Get the title of a row
+    def get_title(self, row):
+        return self.titles[row].decode()
+
+    # Get the titles of some rows (slice or array of row numbers)
+    def get_titles(self, rows):
+        return [title.decode() for title in self.titles[rows]]
+
+    # Keep the rows (slice or array of row numbers) of the granules within cloud cover (maximum %) and spatial coverage
+    # (minimum %) thresholds (granules with no metadata are kept)
+    def filter_rows(self, rows, max_cloud_cover=None, min_spatial_coverage=None):
+        # If there are no thresholds
+        if max_cloud_cover is None and min_spatial_coverage is None:
+            # Keep all the rows
+            return rows
+        # Get the row numbers
+        rows = np.arange(*rows.indices(len(self))) if isinstance(rows, slice) else rows
+        # Mark the rows that pass
+        passes = np.ones(len(rows), dtype=bool)
+        if max_cloud_cover is not None:
+            cloud_cover = self.cloud_cover[rows]
+            passes &= (cloud_cover < 0) | (cloud_cover <= max_cloud_cover)
+        if min_spatial_coverage is not None:
+            spatial_coverage = self.spatial_coverage[rows]
+            passes &= (spatial_coverage < 0) | (spatial_coverage >= min_spatial_coverage)
+        # Return them
+        return rows[passes]
+
+    # Set the cloud cover and spatial coverage (whole %, -1 if unknown, see encode_coverage) of the granules with some
+    # titles (titles that are not in the catalog are skipped)
+    def set_coverage(self, titles, cloud_cover, spatial_coverage):
+        # Get the titles (one fixed width byte string per title)
+        titles = np.array([title.encode() if isinstance(title, str) else title for title in titles],
+                          dtype=f'S{TITLE_WIDTH}') if not isinstance(titles, np.ndarray) else titles
+        # If there are none (or no granules)
+        if len(titles) == 0 or len(self) == 0:
+            return
+        # Find the row of each title (through the titles in sorted order)
+        order = np.argsort(self.titles)
+        positions = np.minimum(np.searchsorted(self.titles, titles, sorter=order), len(self) - 1)
+        rows = order[positions]
+        found = self.titles[rows] == titles
+        # Set their coverage
+        self.cloud_cover[rows[found]] = np.asarray(cloud_cover)[found]
+        self.spatial_coverage[rows[found]] = np.asarray(spatial_coverage)[found]
+
+    # Get the first and last (exclusive) rows of a date (YYYYDDD)
+    def get_date_rows(self, year_doy):
+        return np.searchsorted(self.year_doy, year_doy, side='left'), \
+            np.searchsorted(self.year_doy, year_doy, side='right')
+
+    # Get the titles of the granules on a date (YYYYDDD), optionally only those in a (major) tile (e.g. '14T') and
+    # within cloud cover and spatial coverage thresholds (see filter_rows)
+    def get_files(self, year_doy, major_tile=None, max_cloud_cover=None, min_spatial_coverage=None):
+        # Get the rows of the date (in the major tile)
+        rows = slice(*self.get_date_rows(year_doy)) if major_tile is None else \
+            slice(*self.get_date_major_rows(year_doy, encode_major_tile(major_tile)))
+        # Return their titles (of those within the thresholds)
+        return self.get_titles(self.filter_rows(rows, max_cloud_cover=max_cloud_cover,
+                                                min_spatial_coverage=min_spatial_coverage))
+
+    # Get the titles of the granules in a tile (e.g. '14TPL') on a date (YYYYDDD)
+    def get_tile_files(self, year_doy, tile):
+        return self.get_titles(slice(*self.get_date_tile_rows(year_doy, encode_tile(tile))))
+
+    # Get the titles of the granules on a date (YYYYDDD) and their tile codes (see encode_tile), optionally only those
+    # within cloud cover and spatial coverage thresholds (see filter_rows)
+    def get_files_and_tiles(self, year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        rows = self.filter_rows(slice(*self.get_date_rows(year_doy)), max_cloud_cover=max_cloud_cover,
+                                min_spatial_coverage=min_spatial_coverage)
+        return self.get_titles(rows), self.tile[rows]
+
+    # Get the first and last (exclusive) rows of a range of dates (YYYYDDD, both included)
+    def get_date_range_rows(self, start_year_doy, end_year_doy):
+        return np.searchsorted(self.year_doy, start_year_doy, side='left'), \
+            np.searchsorted(self.year_doy, end_year_doy, side='right')
+
+    # Get the titles of the granules in a range of dates (YYYYDDD, both included), optionally only those in a (major)
+    # tile (e.g. '14T') and within cloud cover and spatial coverage thresholds (see filter_rows)
+    def get_files_between(self, start_year_doy, end_year_doy, major_tile=None, max_cloud_cover=None,
+                          min_spatial_coverage=None):
+        # Get the rows of the range
+        start, end = self.get_date_range_rows(start_year_doy, end_year_doy)
+        rows = slice(start, end)
+        # If there is a tile
+        if major_tile is not None:
+            # Get the rows of the range that are in the major tile
+            rows = start + np.flatnonzero(self.tile[start:end] // 676 == encode_major_tile(major_tile))
+        # Return their titles (of those within the thresholds)
+        return self.get_titles(self.filter_rows(rows, max_cloud_cover=max_cloud_cover,
+                                                min_spatial_coverage=min_spatial_coverage))
+
+    # Get the time series (titles in date and time order) of each of some tiles (e.g. ['14TPL', '31UDQ']) in a range
+    # of dates (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage
+    # thresholds (see filter_rows). Returns a dictionary of the time series by tile
+    def get_time_series(self, tiles, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        return {tile: self.get_titles(self.filter_rows(self.get_time_series_rows(tile, start_year_doy, end_year_doy),
+                                                       max_cloud_cover=max_cloud_cover,
+                                                       min_spatial_coverage=min_spatial_coverage))
+                for tile in tiles}
+
+    # Iterate over the time series (titles in date and time order) of a tile (e.g. '14TPL') in a range of dates
+    # (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage thresholds (see
+    # filter_rows), decoding a chunk of titles at a time
+    def iterate_time_series(self, tile, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None,
+                            chunk_size=64):
+        # Get the rows of the time series (within the thresholds)
+        rows = self.filter_rows(self.get_time_series_rows(tile, start_year_doy, end_year_doy),
+                                max_cloud_cover=max_cloud_cover, min_spatial_coverage=min_spatial_coverage)
+        # For each chunk of rows
+        for start in range(0, len(rows), chunk_size):
+            # Yield the titles
+            yield from self.get_titles(rows[start:start + chunk_size])
+
+    # Get the rows (in date and time order) of a tile (e.g. '14TPL') in a range of dates (YYYYDDD, both included)
+    def get_time_series_rows(self, tile, start_year_doy, end_year_doy):
+        # Get the rows in tile order (each tile's rows are in date and time order)
+        keys, order = self.get_tile_order()
+        # Get the tile key
+        tile_key = get_tile_order_key(encode_tile(tile))
+        # Get the tile's rows and their dates
+        rows = order[np.searchsorted(keys, tile_key, side='left'):np.searchsorted(keys, tile_key, side='right')]
+        dates = self.year_doy[rows]
+        # Return the rows in the range of dates
+        return rows[np.searchsorted(dates, start_year_doy, side='left'):
+                    np.searchsorted(dates, end_year_doy, side='right')]
+
+    # Get the first and last (exclusive) rows of a major tile code on a date (YYYYDDD)
+    def get_date_major_rows(self, year_doy, major_code):
+        # If the index hasn't been made yet
+        if self.date_major_index is None:
+            # Make it
+            self.date_major_index = make_group_index(self.year_doy.astype(np.int64) * 1586 + self.tile // 676)
+        # Look up the rows
+        return look_up_group(self.date_major_index, year_doy * 1586 + major_code)
+
+    # Get the first and last (exclusive) rows of a tile code on a date (YYYYDDD)
+    def get_date_tile_rows(self, year_doy, tile_code):
+        # If the index hasn't been made yet
+        if self.date_tile_index is None:
+            # Make it
+            self.date_tile_index = make_group_index(self.year_doy.astype(np.int64) * 1072136 + self.tile)
+        # Look up the rows
+        return look_up_group(self.date_tile_index, year_doy * 1072136 + tile_code)
+
+    # Get the rows in (band, column, minor row, minor column) order and their keys
+    def get_tile_order(self):
+        # If they haven't been made yet
+        if self.tile_order is None:
+            # Get the keys
+            keys = get_tile_order_key(self.tile)
+            # Sort the rows (stable, so each tile's rows stay in date and time order)
+            self.tile_order = np.argsort(keys, kind='stable')
+            self.tile_keys = keys[self.tile_order]
+        # Return them
+        return self.tile_keys, self.tile_order
+
+    # Get a granule record of a row
+    def get_granule_at(self, row):
+        return HLSGranule(int(self.sensor[row]), int(self.tile[row]), int(self.year_doy[row]), int(self.time[row]),
+                          int(self.version[row]), self.get_title(row))
+
+    # Get the rows in granule ID order and their packed ID keys (see get_id_key)
+    def get_id_order(self):
+        # If they haven't been made yet
+        if self.id_order is None:
+            # Assemble the keys
+            keys = get_id_key(self.sensor, self.tile, self.year_doy.astype(np.int64), self.time)
+            # Sort the rows
+            self.id_order = np.argsort(keys, kind='stable')
+            self.id_keys = keys[self.id_order]
+        # Return them
+        return self.id_keys, self.id_order
+
+    # Get the rows of a granule ID (with or without the acquisition time), in acquisition time order
+    def get_id_rows(self, granule_id):
+        # Parse the ID (sensor code, tile code, date and time, or None for the time)
+        parsed_id = parse_granule_id(granule_id)
+        # If it is not an HLS ID
+        if parsed_id is None:
+            # No rows
+            return np.zeros(0, dtype=np.int64)
+        # Get the sorted keys
+        keys, order = self.get_id_order()
+        # Get the key range of the ID (every time of the day if there is no time)
+        sensor, tile, year_doy, time = parsed_id
+        if time is None:
+            low, high = get_id_key(sensor, tile, year_doy, 0), get_id_key(sensor, tile, year_doy, 240000)
+        else:
+            low = get_id_key(sensor, tile, year_doy, time)
+            high = low + 1
+        # Return the rows
+        return order[np.searchsorted(keys, low, side='left'):np.searchsorted(keys, high, side='left')]
+
+    # Get a view of the titles by granule ID
+    def get_by_id_view(self):
+        return HLSCatalogIDView(self)
+
+    # Get a nested view of the titles by year and DOY (like by_date[year][doy])
+    def get_by_date_view(self):
+        return HLSCatalogView(self, lambda: (self.year_doy, None), BY_DATE_LEVELS)
+
+    # Get a nested view of the titles by tile (like by_tile[band][column][minor_row][minor_column])
+    def get_by_tile_view(self):
+        return HLSCatalogView(self, self.get_tile_order, BY_TILE_LEVELS)
+
+
+# Class for a read-only, nested dictionary style view of a catalog (e.g. view['2022']['123'] -> list of titles). Each
+# level is one component of a sorted integer key, found by (key // stride) % radix
+class HLSCatalogView(Mapping):
+
+    def __init__(self, catalog, get_keys, levels, level=0, low=0, high=None):
+
+        self.catalog = catalog
+        # Function that returns the sorted keys and the rows in key order (None if the rows are already in key order)
+        self.get_keys = get_keys
+        # (stride, radix, format, parse) of each level
+        self.levels = levels
+        # This view's level and range of keys
+        self.level = level
+        self.low = low
+        self.high = high
+
+    # Get the first and last (exclusive) positions of a range of keys
+    def get_positions(self, low, high):
+        # Get the sorted keys
+        keys, order = self.get_keys()
+        # Search for the range
+        return np.searchsorted(keys, low, side='left'), \
+            len(keys) if high is None else np.searchsorted(keys, high, side='left')
+
+    # Get the range of keys of one of this view's entries (None if the name isn't valid)
+    def get_key_range(self, name):
+        # Get the stride, radix and parser of the level
+        stride, radix, format_value, parse_value = self.levels[self.level]
+        # Try and parse the name
+        try:
+            value = parse_value(name)
+        # If it doesn't work
+        except (TypeError, ValueError):
+            return None
+        # If it is out of range
+        if value < 0 or (radix is not None and value >= radix):
+            return None
+        # Return the range
+        return self.low + value * stride, self.low + (value + 1) * stride
+
+    # Check if there are any titles for an entry
+    def __contains__(self, name):
+        # Get the range of keys of the entry
+        key_range = self.get_key_range(name)
+        # If the name isn't valid
+        if key_range is None:
+            return False
+        # Get the positions of the range
+        start, end = self.get_positions(*key_range)
+        # Check for any rows
+        return end > start
+
+    # Get an entry (a deeper view, or the list of titles at the last level)
+    def __getitem__(self, name):
+        # Get the range of keys of the entry
+        key_range = self.get_key_range(name)
+        # If the name isn't valid, or there are no titles
+        if key_range is None or not self.__contains__(name):
+            raise KeyError(name)
+        # If this is the last level
+        if self.level == len(self.levels) - 1:
+            # Get the positions of the range
+            start, end = self.get_positions(*key_range)
+            # Get the rows in key order
+            keys, order = self.get_keys()
+            # Return the titles
+            return self.catalog.get_titles(slice(start, end) if order is None else order[start:end])
+        # Otherwise, return the next level
+        return HLSCatalogView(self.catalog, self.get_keys, self.levels, level=self.level + 1, low=key_range[0],
+                              high=key_range[1])
+
+    # Get the names of the entries (in order)
+    def __iter__(self):
+        # Get the stride, radix and formatter of the level
+        stride, radix, format_value, parse_value = self.levels[self.level]
+        # Get the positions of this view's range
+        start, end = self.get_positions(self.low, self.high)
+        # Get the keys
+        keys, order = self.get_keys()
+        # Get the level's values in the range
+        values = keys[start:end] // stride
+        if radix is not None:
+            values = values % radix
+        # For each unique value (sorted already, keys are sorted)
+        for value in values[np.r_[True, values[1:] != values[:-1]]] if len(values) > 0 else []:
+            # Return the name
+            yield format_value(int(value))
+
+    # Get the number of entries
+    def __len__(self):
+        return sum(1 for name in self.__iter__())
+
+
+# Class for a read-only, dictionary style view of a catalog by granule ID (e.g. view['HLS.S30.T14TPL.2015334T173002']
+# -> title). Iterates over the IDs with acquisition time, but any of these forms can be looked up:
+# HLS.S30.T14TPL.2015334T173002 (with or without the .v2.0 version), HLS.S30.T14TPL.2015334 or HLSS30T14TPL2015334
+# (without acquisition time, the latest acquisition of the day)
+class HLSCatalogIDView(Mapping):
+
+    def __init__(self, catalog):
+
+        self.catalog = catalog
+
+    # Check if there is a granule for an ID
+    def __contains__(self, granule_id):
+        return len(self.catalog.get_id_rows(granule_id)) > 0
+
+    # Get the title of the granule for an ID
+    def __getitem__(self, granule_id):
+        # Get the rows of the ID
+        rows = self.catalog.get_id_rows(granule_id)
+        # If there are none
+        if len(rows) == 0:
+            raise KeyError(granule_id)
+        # Return the title (of the latest acquisition, if the ID has no time)
+        return self.catalog.get_title(rows[-1])
+
+    # Get the IDs (with acquisition time)
+    def __iter__(self):
+        # Get the rows in ID order
+        keys, order = self.catalog.get_id_order()
+        # For each row
+        for row in order:
+            # Return the ID (the title without the version)
+            yield self.catalog.get_title(row)[0:29]
+
+    # Get the number of granules
+    def __len__(self):
+        return len(self.catalog)
+
+
+# Class for a catalog split into one binary catalog file per year, which are opened the first time a year is used.
+# Optionally closes the least recently used years when the open years use more than a memory limit
+class HLSPartitionedCatalog:
+
+    def __init__(self, catalog_path, memory_limit_bytes=None):
+
+        # Directory of the year catalog files
+        self.catalog_path = Path(catalog_path)
+        self.memory_limit_bytes = memory_limit_bytes
+        # Row count and file name of each year and version of the catalog (from the partition list, version 0 until
+        # the first update; lists written before the file names were listed have a {year}.bin file for each year)
+        with open(self.catalog_path / 'partitions.json', 'r') as f:
+            partition_list = json.load(f)
+        self.year_rows = {int(year): rows for year, rows in partition_list['years'].items()}
+        self.year_files = {year: partition_list.get('files', {}).get(str(year), f'{year}.bin')
+                           for year in self.year_rows.keys()}
+        self.version = partition_list.get('version', 0)
+        # Open year catalogs, least recently used first, the memory each used when it was last checked and their total
+        self.partitions = OrderedDict()
+        self.partition_bytes = {}
+        self.open_bytes = 0
+        self.lock = threading.Lock()
+
+    # Get the number of granules
+    def __len__(self):
+        return sum(self.year_rows.values())
+
+    # Get the catalog of a year (None if there are no granules in the year)
+    def get_partition(self, year):
+        # If there are no granules in the year
+        if year not in self.year_rows.keys():
+            return None
+        with self.lock:
+            # If the year is open
+            if year in self.partitions.keys():
+                # Mark it as recently used
+                self.partitions.move_to_end(year)
+            # Otherwise
+            else:
+                # Open the year's catalog
+                partition = open_catalog_file(self.catalog_path / self.year_files[year])
+                # If it is not a catalog file
+                if partition is False:
+                    raise ValueError(f'Could not open the {year} catalog of {self.catalog_path}: '
+                                     f'{self.year_files[year]} is not a version {CATALOG_VERSION} HLS catalog file.')
+                self.partitions[year] = partition
+            # Get the catalog
+            partition = self.partitions[year]
+            # If there is a memory limit
+            if self.memory_limit_bytes is not None:
+                # Bring the year's memory up to date in the total (its indexes grow as it is used, so check it on
+                # every use; the other open years were checked when they were last used)
+                size_bytes = partition.get_size_bytes()
+                self.open_bytes += size_bytes - self.partition_bytes.get(year, 0)
+                self.partition_bytes[year] = size_bytes
+                # Close the least recently used years (but not this one) until the open years are under the limit
+                while len(self.partitions) > 1 and self.open_bytes > self.memory_limit_bytes:
+                    closed_year = next(iter(self.partitions.keys()))
+                    self.close_partition(closed_year)
+                    logging.info(f'Closed the {closed_year} catalog of {self.catalog_path}.')
+        # Return the catalog
+        return partition
+
+    # Close the catalog of a year if it is open (with the lock held)
+    def close_partition(self, year):
+        self.partitions.pop(year, None)
+        self.open_bytes -= self.partition_bytes.pop(year, 0)
+
+    # Get the catalogs of all the years
+    def get_all_partitions(self):
+        return [self.get_partition(year) for year in sorted(self.year_rows.keys())]
+
+    # Update the catalog in place with titles added and removed (only the years with changes are rewritten), optionally
+    # with the cloud cover and spatial coverage of titles added (dictionary of (cloud cover, spatial coverage) tuples by
+    # title, %, None if unknown). The years with changes are written to new files, which are all published at once by
+    # replacing the list of years (so a reader sees the whole update or none of it, and an update that stops partway
+    # leaves the catalog as it was). Records the update in the catalog's update log and returns its version number
+    def apply_delta(self, added=(), removed=(), coverage=None):
+        # Group the titles by year
+        added_by_year = {}
+        removed_by_year = {}
+        for titles, by_year in ((added, added_by_year), (removed, removed_by_year)):
+            for title in titles:
+                by_year.setdefault(int(title.split('.')[3][0:4]), []).append(title)
+        # Lists for the titles actually added and removed (leaving out ones that were already there, or not there)
+        added_titles = []
+        removed_titles = []
+        # Next version, and the row counts and file names of the years in it
+        version = self.version + 1
+        year_rows = dict(self.year_rows)
+        year_files = dict(self.year_files)
+        # For each year with changes
+        for year in sorted(set(added_by_year.keys()) | set(removed_by_year.keys())):
+            # Get the year's catalog
+            partition = self.get_partition(year)
+            # Get its titles
+            old_titles = [] if partition is None else partition.get_titles(slice(None))
+            old_set = set(old_titles)
+            # Get the changes to the year
+            year_removed = set([title for title in removed_by_year.get(year, []) if title in old_set])
+            year_added = [title for title in dict.fromkeys(added_by_year.get(year, [])) if title not in old_set]
+            added_titles.extend(year_added)
+            removed_titles.extend(sorted(year_removed))
+            # Make the year's new catalog
+            catalog = make_granule_catalog([title for title in old_titles if title not in year_removed] + year_added)
+            # Keep the coverage of the titles that were already there, and set the coverage of the ones added
+            if partition is not None:
+                catalog.set_coverage(partition.titles, partition.cloud_cover, partition.spatial_coverage)
+            if coverage is not None:
+                year_coverage = [coverage.get(title, (None, None)) for title in year_added]
+                catalog.set_coverage(year_added, encode_coverage([values[0] for values in year_coverage]),
+                                     encode_coverage([values[1] for values in year_coverage]))
+            # If there are no titles left in the year
+            if len(catalog) == 0:
+                # Leave the year out of the new version
+                year_rows.pop(year, None)
+                year_files.pop(year, None)
+            # Otherwise
+            else:
+                # Write the year's new catalog to a new file (the old one is still listed until the update is published)
+                year_files[year] = f'{year}.v{version}.bin'
+                write_catalog_file(catalog, self.catalog_path / year_files[year])
+                year_rows[year] = len(catalog)
+        # Publish the new version (replacing the list of years)
+        write_partition_list(self.catalog_path, year_rows, version, year_files)
+        # Record the update in the update log
+        with open(self.catalog_path / 'deltas.jsonl', 'a') as f:
+            f.write(json.dumps({'version': version, 'date': datetime.datetime.now().isoformat(),
+                                'added': added_titles, 'removed': removed_titles}) + '\n')
+        # Get the files that are no longer listed
+        superseded_files = set(self.year_files.values()) - set(year_files.values())
+        with self.lock:
+            # Close the years with changes
+            for year, file_name in self.year_files.items():
+                if year_files.get(year) != file_name:
+                    self.close_partition(year)
+            # Use the new version
+            self.year_rows, self.year_files, self.version = year_rows, year_files, version
+        # Remove the files that are no longer listed (processes that have them open keep reading them until they
+        # close them)
+        for file_name in superseded_files:
+            (self.catalog_path / file_name).unlink(missing_ok=True)
+        # Log the info
+        logging.info(f'Version {self.version} of {self.catalog_path}: {len(added_titles)} added and '
+                     f'{len(removed_titles)} removed.')
+        # Return the version
+        return self.version
+
+    # Bring the catalog up to date with a catalog of all the granules (e.g. made again from a support file that has
+    # changed since), as an update (so the version and update log carry on). Returns the version number
+    def apply_catalog(self, catalog):
+        # Lists for the titles added and removed, and the coverage of the titles added
+        added = []
+        removed = []
+        coverage = {}
+        # Get the new catalog of each year
+        partitions = catalog.split_by_year()
+        # For each year in either catalog
+        for year in sorted(set(self.year_rows.keys()) | set(partitions.keys())):
+            # Get the year's old and new titles
+            old_titles = self.get_partition(year).titles if year in self.year_rows.keys() else \
+                np.zeros(0, dtype=f'S{TITLE_WIDTH}')
+            new_titles = partitions[year].titles if year in partitions.keys() else np.zeros(0, dtype=f'S{TITLE_WIDTH}')
+            # Add the titles only in the new catalog (and their coverage), and the ones only in the old catalog
+            year_added = np.flatnonzero(~np.isin(new_titles, old_titles))
+            added.extend(new_titles[year_added].astype(str).tolist())
+            if len(year_added) > 0:
+                coverage.update(zip(new_titles[year_added].astype(str).tolist(),
+                                    zip(decode_coverage(partitions[year].cloud_cover[year_added]),
+                                        decode_coverage(partitions[year].spatial_coverage[year_added]))))
+            removed.extend(old_titles[~np.isin(old_titles, new_titles)].astype(str).tolist())
+        # If nothing has changed
+        if len(added) == 0 and len(removed) == 0:
+            # Rewrite the list of years (marking the catalog as up to date)
+            write_partition_list(self.catalog_path, self.year_rows, self.version, self.year_files)
+            return self.version
+        # Update the catalog
+        return self.apply_delta(added=added, removed=removed, coverage=coverage)
+
+    # Iterate over the updates in the update log (dictionaries with the version, date, and titles added and removed)
+    def iterate_deltas(self):
+        # If there have been no updates
+        if not exists(self.catalog_path / 'deltas.jsonl'):
+            return
+        # For each update
+        with open(self.catalog_path / 'deltas.jsonl', 'r') as f:
+            for line in f:
+                yield json.loads(line)
+
+    # Get the titles added after one version, up to and including another (the latest if None), that were not removed
+    # again by then
+    def get_added_between(self, from_version, to_version=None):
+        # Set for the titles
+        added_set = set()
+        # For each update in the range
+        for delta in self.iterate_deltas():
+            if from_version < delta['version'] and (to_version is None or delta['version'] <= to_version):
+                # Add the titles added, and leave out the ones removed
+                added_set.update(delta['added'])
+                added_set.difference_update(delta['removed'])
+        # Return the titles (in date, tile and time order)
+        return sorted(added_set, key=lambda title: (title[15:22], title[9:14], title[23:29]))
+
+    # Get the titles of the granules on a date (YYYYDDD), optionally only those in a (major) tile (e.g. '14T') and
+    # within cloud cover and spatial coverage thresholds (see HLSGranuleCatalog.filter_rows)
+    def get_files(self, year_doy, major_tile=None, max_cloud_cover=None, min_spatial_coverage=None):
+        # Get the year's catalog
+        partition = self.get_partition(year_doy // 1000)
+        # Return its files
+        return [] if partition is None else \
+            partition.get_files(year_doy, major_tile=major_tile, max_cloud_cover=max_cloud_cover,
+                                min_spatial_coverage=min_spatial_coverage)
+
+    # Get the titles of the granules on a date (YYYYDDD) and their tile codes (see encode_tile), optionally only those
+    # within cloud cover and spatial coverage thresholds
+    def get_files_and_tiles(self, year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        # Get the year's catalog
+        partition = self.get_partition(year_doy // 1000)
+        # Return its files and their tiles
+        return ([], np.zeros(0, dtype=np.int32)) if partition is None else \
+            partition.get_files_and_tiles(year_doy, max_cloud_cover=max_cloud_cover,
+                                          min_spatial_coverage=min_spatial_coverage)
+
+    # Get the titles of the granules in a tile (e.g. '14TPL') on a date (YYYYDDD)
+    def get_tile_files(self, year_doy, tile):
+        # Get the year's catalog
+        partition = self.get_partition(year_doy // 1000)
+        # Return its files
+        return [] if partition is None else partition.get_tile_files(year_doy, tile)
+
+    # Get the catalogs of the years in a range of dates (YYYYDDD)
+    def get_partitions_between(self, start_year_doy, end_year_doy):
+        return [self.get_partition(year) for year in sorted(self.year_rows.keys())
+                if start_year_doy // 1000 <= year <= end_year_doy // 1000]
+
+    # Get the titles of the granules in a range of dates (YYYYDDD, both included), optionally only those in a (major)
+    # tile (e.g. '14T') and within cloud cover and spatial coverage thresholds
+    def get_files_between(self, start_year_doy, end_year_doy, major_tile=None, max_cloud_cover=None,
+                          min_spatial_coverage=None):
+        return [file for partition in self.get_partitions_between(start_year_doy, end_year_doy)
+                for file in partition.get_files_between(start_year_doy, end_year_doy, major_tile=major_tile,
+                                                        max_cloud_cover=max_cloud_cover,
+                                                        min_spatial_coverage=min_spatial_coverage)]
+
+    # Get the time series (titles in date and time order) of each of some tiles (e.g. ['14TPL', '31UDQ']) in a range
+    # of dates (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage
+    # thresholds. Returns a dictionary of the time series by tile
+    def get_time_series(self, tiles, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        # Dictionary for the time series
+        series = {tile: [] for tile in tiles}
+        # For each year in the range (in order)
+        for partition in self.get_partitions_between(start_year_doy, end_year_doy):
+            # Add the year's time series
+            for tile, files in partition.get_time_series(tiles, start_year_doy, end_year_doy,
+                                                         max_cloud_cover=max_cloud_cover,
+                                                         min_spatial_coverage=min_spatial_coverage).items():
+                series[tile].extend(files)
+        # Return the time series
+        return series
+
+    # Iterate over the time series (titles in date and time order) of a tile (e.g. '14TPL') in a range of dates
+    # (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage thresholds. Each
+    # year is only opened when the series reaches it
+    def iterate_time_series(self, tile, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        # For each year in the range (in order)
+        for year in sorted(self.year_rows.keys()):
+            if start_year_doy // 1000 <= year <= end_year_doy // 1000:
+                # Yield the year's time series
+                yield from self.get_partition(year).iterate_time_series(tile, start_year_doy, end_year_doy,
+                                                                        max_cloud_cover=max_cloud_cover,
+                                                                        min_spatial_coverage=min_spatial_coverage)
+
+    # Get a granule record of a granule ID (None if there isn't one)
+    def get_granule(self, granule_id):
+        # Parse the ID
+        parsed_id = parse_granule_id(granule_id)
+        # Get the year's catalog
+        partition = None if parsed_id is None else self.get_partition(parsed_id[2] // 1000)
+        # If there is no catalog
+        if partition is None:
+            return None
+        # Get the rows of the ID
+        rows = partition.get_id_rows(granule_id)
+        # Return the record (of the latest acquisition, if the ID has no time)
+        return partition.get_granule_at(rows[-1]) if len(rows) > 0 else None
+
+    # Get a nested view of the titles by year and DOY (only the years used are opened)
+    def get_by_date_view(self):
+        return HLSPartitionedDateView(self)
+
+    # Get a nested view of the titles by tile (opens every year when used)
+    def get_by_tile_view(self):
+        return HLSMergedView(lambda: [partition.get_by_tile_view() for partition in self.get_all_partitions()])
+
+    # Get a view of the titles by granule ID (only the years looked up are opened, unless it is iterated over)
+    def get_by_id_view(self):
+        return HLSPartitionedIDView(self)
+
+
+# Class for a read-only view of a partitioned catalog by year and DOY (like by_date[year][doy])
+class HLSPartitionedDateView(Mapping):
+
+    def __init__(self, catalog):
+
+        self.catalog = catalog
+
+    # Check if there are granules in a year
+    def __contains__(self, year):
+        return str(year).isdigit() and int(year) in self.catalog.year_rows.keys()
+
+    # Get the view of a year's DOYs
+    def __getitem__(self, year):
+        # If there are no granules in the year
+        if not self.__contains__(year):
+            raise KeyError(year)
+        # Return the year's view
+        return self.catalog.get_partition(int(year)).get_by_date_view()[str(year)]
+
+    # Get the years
+    def __iter__(self):
+        for year in sorted(self.catalog.year_rows.keys()):
+            yield str(year)
+
+    # Get the number of years
+    def __len__(self):
+        return len(self.catalog.year_rows)
+
+
+# Class for a read-only view of a partitioned catalog by granule ID (see HLSCatalogIDView)
+class HLSPartitionedIDView(Mapping):
+
+    def __init__(self, catalog):
+
+        self.catalog = catalog
+
+    # Check if there is a granule for an ID
+    def __contains__(self, granule_id):
+        return self.catalog.get_granule(granule_id) is not None
+
+    # Get the title of the granule for an ID
+    def __getitem__(self, granule_id):
+        # Get the granule
+        granule = self.catalog.get_granule(granule_id)
+        # If there isn't one
+        if granule is None:
+            raise KeyError(granule_id)
+        # Return its title
+        return granule.title
+
+    # Get the IDs (with acquisition time)
+    def __iter__(self):
+        # For each year
+        for partition in self.catalog.get_all_partitions():
+            # Return its IDs
+            yield from partition.get_by_id_view()
+
+    # Get the number of granules
+    def __len__(self):
+        return len(self.catalog)
+
+
+# Class for a read-only view that merges nested views of the same shape (e.g. the "by_tile" views of each year). Lists
+# of titles at the last level are joined
+class HLSMergedView(Mapping):
+
+    def __init__(self, get_views):
+
+        # Function that returns the views to merge
+        self.get_views = get_views
+
+    # Check if any of the views has an entry
+    def __contains__(self, name):
+        return any([name in view for view in self.get_views()])
+
+    # Get an entry (a merged deeper view, or the joined list of titles at the last level)
+    def __getitem__(self, name):
+        # Get the entries of the views that have one
+        entries = [view[name] for view in self.get_views() if name in view]
+        # If there are none
+        if len(entries) == 0:
+            raise KeyError(name)
+        # If they are lists of titles
+        if isinstance(entries[0], list):
+            # Join them
+            return [title for entry in entries for title in entry]
+        # Otherwise, merge them
+        return entries[0] if len(entries) == 1 else HLSMergedView(lambda: entries)
+
+    # Get the names of the entries (in order, the names of a level all have the same width)
+    def __iter__(self):
+        return iter(sorted(set([name for view in self.get_views() for name in view])))
+
+    # Get the number of entries
+    def __len__(self):
+        return len(set([name for view in self.get_views() for name in view]))
+
+
+# Class for a granule record (the parsed parts of one HLS title)
+class HLSGranule:
+
+    __slots__ = ('sensor', 'tile', 'year_doy', 'time', 'version', 'title')
+
+    def __init__(self, sensor, tile, year_doy, time, version, title):
+
+        # Sensor code (index in SENSORS)
+        self.sensor = sensor
+        # Tile code (see encode_tile)
+        self.tile = tile
+        # Acquisition date (YYYYDDD) and time (HHMMSS)
+        self.year_doy = year_doy
+        self.time = time
+        # Version (major * 10 + minor)
+        self.version = version
+        self.title = title
+
+    # Get the sensor (L30 or S30)
+    def get_sensor(self):
+        return SENSORS[self.sensor]
+
+    # Get the tile (e.g. '14TPL')
+    def get_tile(self):
+        return decode_tile(self.tile)
+
+    # Get the (major) tile (e.g. '14T')
+    def get_major_tile(self):
+        return decode_tile(self.tile)[0:3]
+
+    # Get the MGRS components (major row, major col, minor row, minor col)
+    def get_mgrs_components(self):
+        column, band, minor_column, minor_row = decode_tile_components(self.tile)
+        return chr(band + 65), f'{column:02d}', chr(minor_row + 65), chr(minor_column + 65)
+
+    # Get the packed ID key (see get_id_key)
+    def get_id_key(self):
+        return get_id_key(self.sensor, self.tile, self.year_doy, self.time)
+
+    def __repr__(self):
+        return f'HLSGranule({self.title})'
+
+
+# Levels of the "by_date" view (year, DOY) of YYYYDDD keys
+BY_DATE_LEVELS = ((1000, None, str, int),
+                  (1, 1000, lambda value: f'{value:03d}', int))
+# Levels of the "by_tile" view (band, column, minor row, minor column)
+BY_TILE_LEVELS = ((61 * 676, None, lambda value: chr(value + 65), lambda name: ord(name) - 65),
+                  (676, 61, lambda value: f'{value:02d}', int),
+                  (26, 26, lambda value: chr(value + 65), lambda name: ord(name) - 65),
+                  (1, 26, lambda value: chr(value + 65), lambda name: ord(name) - 65))
+
+
+# Get the packed ID key of granules (sensor code, tile code, date and time; works on arrays and single values). Keys
+# sort by date, tile, sensor and then time, and fit in 64 bits
+def get_id_key(sensor, tile, year_doy, time):
+    return ((year_doy * 1072136 + tile) * 2 + sensor) * 240000 + time
+
+
+# Parse a granule ID (see HLSCatalogIDView) into the sensor code, tile code, date and time (None if the ID has no
+# time). Returns None if it is not an HLS ID
+def parse_granule_id(granule_id):
+    # If it is the older ID without separators (e.g. HLSS30T14TPL2015334)
+    if len(granule_id) == 19 and '.' not in granule_id:
+        # Put the separators in
+        granule_id = f'{granule_id[0:3]}.{granule_id[3:6]}.{granule_id[6:12]}.{granule_id[12:19]}'
+    # Split the ID
+    split_id = granule_id.split('.')
+    # Try and get the parts
+    try:
+        sensor = SENSORS.index(split_id[1])
+        tile = encode_tile(split_id[2][1:6])
+        year_doy = int(split_id[3][0:7])
+        time = int(split_id[3][8:14]) if len(split_id[3]) > 7 else None
+    # If it doesn't work
+    except (IndexError, ValueError):
+        return None
+    # Return the parts
+    return sensor, tile, year_doy, time
+
+
+# Make an index of the groups of rows that share a (sorted) key. Returns the unique keys and the first row of each
+# group (plus the row count at the end, so group i is rows starts[i] to starts[i + 1])
+def make_group_index(keys):
+    # Get the first row of each group
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+    # Return the unique keys and the group boundaries
+    return keys[starts], np.r_[starts, len(keys)]
+
+
+# Look up the first and last (exclusive) rows of a key in a group index (an empty range if there are none)
+def look_up_group(index, key):
+    # Get the unique keys and the group boundaries
+    keys, starts = index
+    # Find the key
+    position = np.searchsorted(keys, key)
+    # If it isn't there
+    if position == len(keys) or keys[position] != key:
+        # Empty range
+        return 0, 0
+    # Return the group's rows
+    return starts[position], starts[position + 1]
+
+
+# Make a catalog from HLS titles (any iterable of titles)
+def make_granule_catalog(titles):
+    # Put the titles in one contiguous buffer (one fixed width byte string per title)
+    titles = np.array([title.encode() if isinstance(title, str) else title for title in titles], dtype='S')
+    # Make the catalog from the buffer
+    return make_granule_catalog_from_buffer(titles)
+
+
+# Make a catalog from a support file of HLS titles, reading the whole file at once instead of parsing each line. Lines
+# of a line-delimited file are all the same width, so the titles are sliced straight out of the file. Otherwise (e.g.
+# the older single JSON list) the titles are found with a regular expression
+def make_granule_catalog_from_file(file_path):
+    # Read the file
+    with open(file_path, 'rb') as f:
+        contents = f.read()
+    # Get the width of the first line (a quoted title and a newline, or a carriage return and newline)
+    width = contents.find(b'\n') + 1
+    # If the lines could all be quoted titles of the same width
+    if width in (TITLE_WIDTH + 3, TITLE_WIDTH + 4) and len(contents) % width == 0:
+        # View the file as a matrix of characters (one row per line)
+        lines = np.frombuffer(contents, dtype=np.uint8).reshape(-1, width)
+        # If every line is a quoted title
+        if (lines[:, 0] == ord('"')).all() and (lines[:, TITLE_WIDTH + 1] == ord('"')).all() and \
+                (lines[:, -1] == ord('\n')).all() and (width == TITLE_WIDTH + 3 or (lines[:, -2] == ord('\r')).all()):
+            # Make the catalog from the titles (sliced out of the lines)
+            return make_granule_catalog_from_buffer(
+                np.ascontiguousarray(lines[:, 1:TITLE_WIDTH + 1]).view(f'S{TITLE_WIDTH}').ravel())
+    # Otherwise, find the quoted titles
+    return make_granule_catalog_from_buffer(np.array(TITLE_PATTERN.findall(contents), dtype='S'))
+
+
+# Make a catalog from a buffer of HLS titles (array of byte strings)
+def make_granule_catalog_from_buffer(titles):
+    # Mark any titles that are longer than an HLS title
+    valid = np.ones(len(titles), dtype=bool)
+    if titles.dtype.itemsize > TITLE_WIDTH:
+        valid &= ~titles.view(np.uint8).reshape(len(titles), -1)[:, TITLE_WIDTH:].any(axis=1)
+    # Fix the width of the buffer
+    titles = titles.astype(f'S{TITLE_WIDTH}', copy=False)
+    # View the buffer as a matrix of characters (one row per title)
+    characters = titles.view(np.uint8).reshape(len(titles), TITLE_WIDTH)
+    # Check that the separators are all where they should be (shorter titles are padded with zeros, so fail)
+    for position, separator in SEPARATORS.items():
+        valid &= characters[:, position] == ord(separator)
+    # If there are titles that are not in the HLS format
+    if not valid.all():
+        # Log a warning
+        logging.warning(f'Skipped {np.count_nonzero(~valid)} titles that are not in the HLS format.')
+        # Drop them
+        titles = titles[valid]
+        characters = characters[valid]
+    # Get the columns from the characters
+    sensor = (characters[:, 4] == ord('S')).astype(np.int8)
+    tile = encode_tile_characters(characters[:, 9:14])
+    year_doy = get_number_from_characters(characters[:, 15:22])
+    time = get_number_from_characters(characters[:, 23:29])
+    version = (get_number_from_characters(characters[:, 31:32]) * 10 +
+               get_number_from_characters(characters[:, 33:34])).astype(np.int16)
+    # Sort the rows by date, tile and time (packed into one key, which sorts faster than the three columns)
+    order = np.argsort((year_doy.astype(np.int64) * 1072136 + tile) * 240000 + time, kind='stable')
+    # Return the catalog
+    return HLSGranuleCatalog(year_doy[order], tile[order], time[order], sensor[order], version[order], titles[order])
+
+
+# Get the coverage codes (whole %, -1 if unknown) of cloud cover or spatial coverage values (%, None if unknown)
+def encode_coverage(values):
+    return np.array([-1 if value is None else min(max(round(value), 0), 100) for value in values], dtype=np.int8)
+
+
+# Get the cloud cover or spatial coverage values (%, None if unknown) of coverage codes
+def decode_coverage(codes):
+    return [None if code < 0 else code for code in np.asarray(codes).tolist()]
+
+
+# Get the numbers written in each row of a matrix of (digit) characters
+def get_number_from_characters(characters):
+    # Powers of ten for each digit
+    powers = 10 ** np.arange(characters.shape[1] - 1, -1, -1, dtype=np.int32)
+    # Return the numbers
+    return (characters.astype(np.int32) - ord('0')) @ powers
+
+
+# Get the tile codes of a matrix of tile characters (e.g. '14TPL')
+def encode_tile_characters(characters):
+    # Get the column, band, minor column and minor row
+    column = get_number_from_characters(characters[:, 0:2])
+    band, minor_column, minor_row = [characters[:, index].astype(np.int32) - ord('A') for index in (2, 3, 4)]
+    # Return the codes
+    return ((column * 26 + band) * 26 + minor_column) * 26 + minor_row
+
+
+# Get the tile codes of HLS titles (see encode_tile)
+def encode_title_tiles(titles):
+    # View the titles as a matrix of characters (one row per title)
+    characters = np.array([title.encode() if isinstance(title, str) else title for title in titles],
+                          dtype=f'S{TITLE_WIDTH}').view(np.uint8).reshape(-1, TITLE_WIDTH)
+    # Return the codes of their tile characters
+    return encode_tile_characters(characters[:, 9:14])
+
+
+# Get the keys of tile codes that sort in the nesting order of the "by_tile" view (band, column, minor row, minor
+# column; works on arrays and single codes)
+def get_tile_order_key(code):
+    column, band, minor_column, minor_row = decode_tile_components(code)
+    return ((band * 61 + column) * 26 + minor_row) * 26 + minor_column
+
+
+# Get the code of a tile (e.g. '14TPL')
+def encode_tile(tile):
+    return ((int(tile[0:2]) * 26 + ord(tile[2]) - 65) * 26 + ord(tile[3]) - 65) * 26 + ord(tile[4]) - 65
+
+
+# Get the code of a major tile (e.g. '14T')
+def encode_major_tile(major_tile):
+    return int(major_tile[0:2]) * 26 + ord(major_tile[2]) - 65
+
+
+# Get the tile (e.g. '14TPL') of a tile code
+def decode_tile(code):
+    column, band, minor_column, minor_row = decode_tile_components(code)
+    return f'{column:02d}{chr(band + 65)}{chr(minor_column + 65)}{chr(minor_row + 65)}'
+
+
+# Get the column, band, minor column and minor row of tile codes (works on arrays and single codes)
+def decode_tile_components(code):
+    return code // 17576, code // 676 % 26, code // 26 % 26, code % 26
+
+
+# Write a catalog to a binary file (header, then each column, then the titles; every part aligned to 8 bytes)
+def write_catalog_file(catalog, file_path):
+    # Temporary path (so that a partly written file is never opened, even if other processes write it at the same
+    # time)
+    temp_path = Path(file_path).with_suffix(f'.{getpid()}.partial')
+    # Open the temporary file
+    with open(temp_path, 'wb') as f:
+        # Write the header
+        f.write(np.array([(CATALOG_MAGIC, CATALOG_VERSION, 0, len(catalog), TITLE_WIDTH)],
+                         dtype=CATALOG_HEADER).tobytes())
+        # For each column (and then the titles)
+        for column in [getattr(catalog, name).astype(dtype, copy=False) for name, dtype in CATALOG_COLUMNS] + \
+                      [catalog.titles]:
+            # Write the column
+            f.write(np.ascontiguousarray(column).tobytes())
+            # Pad to the next 8 bytes
+            f.write(bytes(-column.nbytes % 8))
+    # Move the file into place
+    replace(temp_path, file_path)
+
+
+# Open a binary catalog file (memory-mapped read-only, so processes that open the same file share its pages). Returns
+# False if the file is not a catalog file
+def open_catalog_file(file_path):
+    # Map the file
+    buffer = np.memmap(file_path, dtype=np.uint8, mode='r')
+    # Read the header
+    header = buffer[0:CATALOG_HEADER.itemsize].view(CATALOG_HEADER)[0]
+    # If it is not a catalog file (or one with another layout)
+    if header['magic'] != CATALOG_MAGIC or header['version'] != CATALOG_VERSION or \
+            header['title_width'] != TITLE_WIDTH:
+        # Log error
+        logging.error(f'{file_path} is not a version {CATALOG_VERSION} HLS catalog file.')
+        return False
+    # Get the row count
+    rows = int(header['rows'])
+    # Columns (views of the mapped file)
+    columns = {}
+    # Offset of the first column
+    offset = CATALOG_HEADER.itemsize
+    # For each column (and then the titles)
+    for name, dtype in CATALOG_COLUMNS + (('titles', f'S{TITLE_WIDTH}'),):
+        # Get the size of the column
+        size = rows * np.dtype(dtype).itemsize
+        # View the column
+        columns[name] = buffer[offset:offset + size].view(dtype)
+        # Move to the next column
+        offset += size + -size % 8
+    # Return the catalog
+    return HLSGranuleCatalog(**columns)
+
+
+# Write a catalog as one binary catalog file per year (in a directory, with a list of the years and their row counts).
+# A catalog already at the path is never replaced (other processes may be reading it), so returns False if there is one
+def write_partitioned_catalog(catalog, catalog_path):
+    # Temporary directory (so that a partly written catalog is never opened, even if other processes write it at the
+    # same time)
+    temp_path = Path(catalog_path).with_suffix(f'.{getpid()}.partial')
+    makedirs(temp_path, exist_ok=True)
+    # Split the catalog by year
+    partitions = catalog.split_by_year()
+    # For each year
+    for year, partition in partitions.items():
+        # Write the year's catalog
+        write_catalog_file(partition, temp_path / f'{year}.bin')
+    # Write the list of years
+    write_partition_list(temp_path, {year: len(partition) for year, partition in partitions.items()}, 0,
+                         {year: f'{year}.bin' for year in partitions.keys()})
+    # Move the catalog into place
+    return move_partitioned_catalog(temp_path, catalog_path)
+
+
+# Copy a partitioned catalog to a temporary directory next to a new path, to be updated and then moved into place (see
+# move_partitioned_catalog) without disturbing processes reading the old one. The year files listed are hard-linked
+# where the file system allows (they are never changed once written), the list of years and the update log are copied
+# (so the version and update log carry on). Returns the temporary path
+def copy_partitioned_catalog(catalog_path, new_catalog_path):
+    # Temporary directory
+    temp_path = Path(new_catalog_path).with_suffix(f'.{getpid()}.partial')
+    makedirs(temp_path, exist_ok=True)
+    # Get the year files listed (any others are left over from an update that didn't finish)
+    year_files = set(HLSPartitionedCatalog(catalog_path).year_files.values())
+    # For each file of the catalog
+    for file_path in Path(catalog_path).iterdir():
+        # If it is a year file that isn't listed, or a partly written file
+        if (file_path.suffix == '.bin' and file_path.name not in year_files) or file_path.suffix == '.partial':
+            # Leave it out
+            continue
+        # If it is a year file
+        if file_path.suffix == '.bin':
+            # Try and link it
+            try:
+                link(file_path, temp_path / file_path.name)
+                continue
+            # If it doesn't work (e.g. another file system)
+            except OSError:
+                pass
+        # Copy it
+        shutil.copy2(file_path, temp_path / file_path.name)
+    # Return the temporary path
+    return temp_path
+
+
+# Move a catalog written to a temporary directory into place. A catalog already at the path is never replaced (other
+# processes may be reading it), so returns False (and removes the temporary directory) if there is one
+def move_partitioned_catalog(temp_path, catalog_path):
+    # Try and move the catalog into place
+    try:
+        replace(temp_path, catalog_path)
+    # If it doesn't work (there is already a catalog there, e.g. another process has just moved its catalog into place)
+    except OSError:
+        # Keep that one, and only remove this one
+        shutil.rmtree(temp_path, ignore_errors=True)
+        return False
+    # Return True
+    return True
+
+
+# Get the path to the binary catalog of a support file (next to it, named for the layout of its files, so a catalog
+# written with another layout is never opened)
+def get_catalog_path(file_path):
+    return Path(file_path).with_suffix(f'.v{CATALOG_VERSION}.catalog')
+
+
+# Check if the binary catalog of a support file is there and up to date (at least as new as the file)
+def is_catalog_up_to_date(catalog_path, file_path):
+    return exists(Path(catalog_path) / 'partitions.json') and \
+        (Path(catalog_path) / 'partitions.json').stat().st_mtime >= Path(file_path).stat().st_mtime
+
+
+# Write the list of years (their row counts and file names) and the version of a partitioned catalog. Replacing the list
+# publishes a version of the catalog
+def write_partition_list(catalog_path, year_rows, version, year_files):
+    # Temporary path (so that a partly written list is never read)
+    temp_path = Path(catalog_path) / f'partitions.{getpid()}.partial'
+    # Write the list
+    with open(temp_path, 'w') as f:
+        json.dump({'version': version, 'years': {str(year): rows for year, rows in sorted(year_rows.items())},
+                   'files': {str(year): file_name for year, file_name in sorted(year_files.items())}}, f)
+    # Move it into place
+    replace(temp_path, Path(catalog_path) / 'partitions.json')
@@ -0,0 +1,440 @@
+import json
+import sqlite3
+import datetime
+import logging
+import threading
+import numpy as np
+import t_hls_catalog
+from collections.abc import Mapping
+from os import getpid
+from pathlib import Path
+
+
+# Tables of the catalog database (granules, the update log and the catalog's version and source file)
+CATALOG_TABLES = '''
+CREATE TABLE IF NOT EXISTS granules (title TEXT PRIMARY KEY, year_doy INTEGER NOT NULL, tile INTEGER NOT NULL,
+                                     major_tile INTEGER NOT NULL, time INTEGER NOT NULL, sensor INTEGER NOT NULL,
+                                     version INTEGER NOT NULL, cloud_cover INTEGER, spatial_coverage INTEGER);
+CREATE TABLE IF NOT EXISTS deltas (version INTEGER PRIMARY KEY, date TEXT NOT NULL, added TEXT NOT NULL,
+                                   removed TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS catalog_info (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+'''
+# Indexes of the granules table, by date, by (major tile, date) and by (tile, date). The rest of each key keeps the
+# rows of a query in the same (date, tile, time) order as the in-memory catalog, so no query needs a sort
+CATALOG_INDEXES = '''
+CREATE INDEX IF NOT EXISTS granules_by_date ON granules (year_doy, tile, time);
+CREATE INDEX IF NOT EXISTS granules_by_major_tile ON granules (major_tile, year_doy, tile, time);
+CREATE INDEX IF NOT EXISTS granules_by_tile ON granules (tile, year_doy, time);
+'''
+# Levels of the "by_date" view (year, DOY) of YYYYDDD values
+BY_DATE_LEVELS = (lambda value: str(value // 1000),
+                  lambda value: f'{value % 1000:03d}')
+# Levels of the "by_tile" view (band, column, minor row, minor column) of tile codes
+BY_TILE_LEVELS = (lambda code: t_hls_catalog.decode_tile(code)[2],
+                  lambda code: t_hls_catalog.decode_tile(code)[0:2],
+                  lambda code: t_hls_catalog.decode_tile(code)[4],
+                  lambda code: t_hls_catalog.decode_tile(code)[3])
+
+
+# Class for a granule catalog in an SQLite database (WAL mode, so one process can update it while any number of others
+# read it). Has the same queries as the binary catalogs (see t_hls_catalog), each answered from an index
+class HLSSQLiteCatalog:
+
+    def __init__(self, database_path):
+
+        self.database_path = Path(database_path)
+        # Connection of each thread (connections can't be shared between threads or processes)
+        self.connections = threading.local()
+
+    # Only pickle the path (a process opens its own connection)
+    def __getstate__(self):
+        return {'database_path': self.database_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['database_path'])
+
+    # Get the connection of this thread (and process), opening it if it isn't open yet
+    def get_connection(self):
+        # If this thread doesn't have a connection (or it was opened by another process before a fork)
+        if getattr(self.connections, 'pid', None) != getpid():
+            # Open the database (autocommit, transactions are started explicitly; waits for a writer's lock instead
+            # of failing)
+            connection = sqlite3.connect(self.database_path, timeout=60, isolation_level=None)
+            # Use the write-ahead log (readers don't block the writer, or the writer the readers)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # If the tables aren't there yet
+            if len(connection.execute("SELECT name FROM sqlite_master WHERE name = 'granules'").fetchall()) == 0:
+                # Make them
+                connection.executescript(CATALOG_TABLES + CATALOG_INDEXES)
+            # If the granules table is from before the coverage columns
+            elif 'cloud_cover' not in [row[1] for row in connection.execute('PRAGMA table_info(granules)')]:
+                # Add them (unknown for the granules already there)
+                connection.executescript('ALTER TABLE granules ADD COLUMN cloud_cover INTEGER; '
+                                         'ALTER TABLE granules ADD COLUMN spatial_coverage INTEGER;')
+            # Reference the connection
+            self.connections.connection = connection
+            self.connections.pid = getpid()
+        # Return the connection
+        return self.connections.connection
+
+    # Run a query and get all the rows
+    def query(self, sql, parameters=()):
+        return self.get_connection().execute(sql, parameters).fetchall()
+
+    # Run a query and get the first column of all the rows
+    def query_column(self, sql, parameters=()):
+        return [row[0] for row in self.get_connection().execute(sql, parameters)]
+
+    # Get a value from the catalog info (None if it isn't there)
+    def get_info(self, name):
+        rows = self.query('SELECT value FROM catalog_info WHERE name = ?', (name,))
+        return rows[0][0] if len(rows) > 0 else None
+
+    # Get the version of the catalog (0 until the first update)
+    def get_version(self):
+        return int(self.get_info('version') or 0)
+
+    # Check if the catalog was made from (or last updated to) a support file, and is newer than it
+    def is_up_to_date(self, file_path):
+        return self.get_info('source') == Path(file_path).name and \
+            float(self.get_info('source_mtime') or 0) >= Path(file_path).stat().st_mtime
+
+    # Record the support file the catalog was made from (or last updated to), in a transaction
+    def set_source(self, connection, file_path):
+        for name, value in (('source', Path(file_path).name), ('source_mtime', Path(file_path).stat().st_mtime)):
+            connection.execute('INSERT OR REPLACE INTO catalog_info VALUES (?, ?)', (name, str(value)))
+
+    # Write the granules of a catalog (see t_hls_catalog.make_granule_catalog) to the catalog, optionally recording the
+    # support file it was made from. An empty catalog is filled in bulk (version 0), otherwise the catalog is brought
+    # up to date as an update (so the version and update log carry on). Readers see the old granules until it is done.
+    # Returns the version number
+    def write_catalog(self, catalog, source_path=None):
+        # Get the titles already there
+        old_titles = self.query_column('SELECT title FROM granules')
+        # If there are any (or there have been updates)
+        if len(old_titles) > 0 or self.get_version() > 0:
+            # Get the new titles
+            new_titles = catalog.titles.astype(str).tolist()
+            old_set, new_set = set(old_titles), set(new_titles)
+            # Get the titles only in the new catalog and their coverage
+            added_rows = [row for row, title in enumerate(new_titles) if title not in old_set]
+            added = [new_titles[row] for row in added_rows]
+            coverage = dict(zip(added, zip(t_hls_catalog.decode_coverage(catalog.cloud_cover[added_rows]),
+                                           t_hls_catalog.decode_coverage(catalog.spatial_coverage[added_rows]))))
+            # Update the catalog with them, and the titles only in the old catalog
+            return self.apply_delta(added=added, removed=[title for title in old_titles if title not in new_set],
+                                    coverage=coverage, source_path=source_path)
+        # Get the connection
+        connection = self.get_connection()
+        # Start the transaction (taking the write lock)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Remove the indexes (they are faster to make again after a bulk insert than to keep up to date during it)
+            for index in ('granules_by_date', 'granules_by_major_tile', 'granules_by_tile'):
+                connection.execute(f'DROP INDEX IF EXISTS {index}')
+            # Add the granules
+            connection.executemany('INSERT OR IGNORE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   zip(catalog.titles.astype(str).tolist(), catalog.year_doy.tolist(),
+                                       catalog.tile.tolist(), (catalog.tile // 676).tolist(), catalog.time.tolist(),
+                                       catalog.sensor.tolist(), catalog.version.tolist(),
+                                       t_hls_catalog.decode_coverage(catalog.cloud_cover),
+                                       t_hls_catalog.decode_coverage(catalog.spatial_coverage)))
+            # Make the indexes
+            for statement in CATALOG_INDEXES.strip().split(';')[:-1]:
+                connection.execute(statement)
+            # If there is a support file
+            if source_path is not None:
+                # Record it
+                self.set_source(connection, source_path)
+            # Finish the transaction
+            connection.execute('COMMIT')
+        # If it doesn't work
+        except BaseException:
+            # Leave the catalog as it was
+            connection.execute('ROLLBACK')
+            raise
+        # Log the info
+        logging.info(f'Wrote {len(catalog)} granules to {self.database_path}.')
+        # Return the version
+        return 0
+
+    # Update the catalog in place with titles added and removed (in one transaction, so readers see all of it or none
+    # of it), optionally with the cloud cover and spatial coverage of titles added (see
+    # t_hls_catalog.HLSPartitionedCatalog.apply_delta) and recording the support file it is now up to date with.
+    # Records the update in the catalog's update log and returns its version number
+    def apply_delta(self, added=(), removed=(), coverage=None, source_path=None):
+        # Parse the titles to add
+        catalog = t_hls_catalog.make_granule_catalog(added)
+        # Get their coverage
+        titles = catalog.titles.astype(str).tolist()
+        added_coverage = [(coverage or {}).get(title, (None, None)) for title in titles]
+        cloud_cover = t_hls_catalog.decode_coverage(t_hls_catalog.encode_coverage([values[0] for values in
+                                                                                   added_coverage]))
+        spatial_coverage = t_hls_catalog.decode_coverage(t_hls_catalog.encode_coverage([values[1] for values in
+                                                                                        added_coverage]))
+        # Lists for the titles actually added and removed (leaving out ones that were already there, or not there)
+        added_titles = []
+        removed_titles = []
+        # Get the connection
+        connection = self.get_connection()
+        # Start the transaction (taking the write lock)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # For each title to remove
+            for title in sorted(set(removed)):
+                # If it was removed
+                if connection.execute('DELETE FROM granules WHERE title = ?', (title,)).rowcount > 0:
+                    # Keep it
+                    removed_titles.append(title)
+            # For each granule to add
+            for row in zip(titles, catalog.year_doy.tolist(), catalog.tile.tolist(), (catalog.tile // 676).tolist(),
+                           catalog.time.tolist(), catalog.sensor.tolist(), catalog.version.tolist(), cloud_cover,
+                           spatial_coverage):
+                # If it was added
+                if connection.execute('INSERT OR IGNORE INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                      row).rowcount > 0:
+                    # Keep it
+                    added_titles.append(row[0])
+            # Next version
+            version = int((connection.execute("SELECT value FROM catalog_info WHERE name = 'version'").fetchone() or
+                           (0,))[0]) + 1
+            # Record the update in the update log
+            connection.execute('INSERT INTO deltas VALUES (?, ?, ?, ?)',
+                               (version, datetime.datetime.now().isoformat(), json.dumps(added_titles),
+                                json.dumps(removed_titles)))
+            connection.execute('INSERT OR REPLACE INTO catalog_info VALUES (?, ?)', ('version', str(version)))
+            # If there is a support file
+            if source_path is not None:
+                # Record it
+                self.set_source(connection, source_path)
+            # Finish the transaction
+            connection.execute('COMMIT')
+        # If it doesn't work
+        except BaseException:
+            # Leave the catalog as it was
+            connection.execute('ROLLBACK')
+            raise
+        # Log the info
+        logging.info(f'Version {version} of {self.database_path}: {len(added_titles)} added and '
+                     f'{len(removed_titles)} removed.')
+        # Return the version
+        return version
+
+    # Iterate over the updates in the update log (dictionaries with the version, date, and titles added and removed)
+    def iterate_deltas(self):
+        for version, date, added, removed in self.query('SELECT * FROM deltas ORDER BY version'):
+            yield {'version': version, 'date': date, 'added': json.loads(added), 'removed': json.loads(removed)}
+
+    # Get the titles added after one version, up to and including another (the latest if None), that were not removed
+    # again by then
+    def get_added_between(self, from_version, to_version=None):
+        # Set for the titles
+        added_set = set()
+        # For each update in the range
+        for delta in self.iterate_deltas():
+            if from_version < delta['version'] and (to_version is None or delta['version'] <= to_version):
+                # Add the titles added, and leave out the ones removed
+                added_set.update(delta['added'])
+                added_set.difference_update(delta['removed'])
+        # Return the titles (in date, tile and time order)
+        return sorted(added_set, key=lambda title: (title[15:22], title[9:14], title[23:29]))
+
+    # Get the number of granules
+    def __len__(self):
+        return self.query('SELECT count(*) FROM granules')[0][0]
+
+    # Get the titles of the granules on a date (YYYYDDD), optionally only those in a (major) tile (e.g. '14T') and
+    # within cloud cover and spatial coverage thresholds (see get_filter_condition)
+    def get_files(self, year_doy, major_tile=None, max_cloud_cover=None, min_spatial_coverage=None):
+        # Get the condition of the thresholds
+        condition, parameters = get_filter_condition(max_cloud_cover, min_spatial_coverage)
+        # If there is no tile
+        if major_tile is None:
+            # Return all the titles of the date
+            return self.query_column(f'SELECT title FROM granules WHERE year_doy = ?{condition} ORDER BY tile, time',
+                                     (year_doy,) + parameters)
+        # Return the titles in the major tile on the date
+        return self.query_column(f'SELECT title FROM granules WHERE major_tile = ? AND year_doy = ?{condition} '
+                                 f'ORDER BY tile, time',
+                                 (t_hls_catalog.encode_major_tile(major_tile), year_doy) + parameters)
+
+    # Get the titles of the granules on a date (YYYYDDD) and their tile codes (see t_hls_catalog.encode_tile),
+    # optionally only those within cloud cover and spatial coverage thresholds
+    def get_files_and_tiles(self, year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        condition, parameters = get_filter_condition(max_cloud_cover, min_spatial_coverage)
+        rows = self.query(f'SELECT title, tile FROM granules WHERE year_doy = ?{condition} ORDER BY tile, time',
+                          (year_doy,) + parameters)
+        return [row[0] for row in rows], np.array([row[1] for row in rows], dtype=np.int32)
+
+    # Get the titles of the granules in a tile (e.g. '14TPL') on a date (YYYYDDD)
+    def get_tile_files(self, year_doy, tile):
+        return self.query_column('SELECT title FROM granules WHERE tile = ? AND year_doy = ? ORDER BY time',
+                                 (t_hls_catalog.encode_tile(tile), year_doy))
+
+    # Get the titles of the granules in a range of dates (YYYYDDD, both included), optionally only those in a (major)
+    # tile (e.g. '14T') and within cloud cover and spatial coverage thresholds
+    def get_files_between(self, start_year_doy, end_year_doy, major_tile=None, max_cloud_cover=None,
+                          min_spatial_coverage=None):
+        # Get the condition of the thresholds
+        condition, parameters = get_filter_condition(max_cloud_cover, min_spatial_coverage)
+        # If there is no tile
+        if major_tile is None:
+            # Return all the titles of the range
+            return self.query_column(f'SELECT title FROM granules WHERE year_doy BETWEEN ? AND ?{condition} '
+                                     f'ORDER BY year_doy, tile, time', (start_year_doy, end_year_doy) + parameters)
+        # Return the titles in the major tile in the range
+        return self.query_column(f'SELECT title FROM granules WHERE major_tile = ? AND year_doy BETWEEN ? AND ?'
+                                 f'{condition} ORDER BY year_doy, tile, time',
+                                 (t_hls_catalog.encode_major_tile(major_tile), start_year_doy, end_year_doy) +
+                                 parameters)
+
+    # Get the time series (titles in date and time order) of each of some tiles (e.g. ['14TPL', '31UDQ']) in a range
+    # of dates (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage
+    # thresholds. Returns a dictionary of the time series by tile
+    def get_time_series(self, tiles, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        return {tile: list(self.iterate_time_series(tile, start_year_doy, end_year_doy, max_cloud_cover=max_cloud_cover,
+                                                    min_spatial_coverage=min_spatial_coverage)) for tile in tiles}
+
+    # Iterate over the time series (titles in date and time order) of a tile (e.g. '14TPL') in a range of dates
+    # (YYYYDDD, both included), optionally only the granules within cloud cover and spatial coverage thresholds,
+    # reading the rows as they are needed
+    def iterate_time_series(self, tile, start_year_doy, end_year_doy, max_cloud_cover=None, min_spatial_coverage=None):
+        # Get the condition of the thresholds
+        condition, parameters = get_filter_condition(max_cloud_cover, min_spatial_coverage)
+        # Start the query
+        rows = self.get_connection().execute(f'SELECT title FROM granules WHERE tile = ? AND year_doy BETWEEN ? AND ?'
+                                             f'{condition} ORDER BY year_doy, time',
+                                             (t_hls_catalog.encode_tile(tile), start_year_doy, end_year_doy) +
+                                             parameters)
+        # Yield the titles
+        for row in rows:
+            yield row[0]
+
+    # Get a granule record of a granule ID (see t_hls_catalog.HLSCatalogIDView, None if there isn't one)
+    def get_granule(self, granule_id):
+        # Parse the ID (sensor code, tile code, date and time, or None for the time)
+        parsed_id = t_hls_catalog.parse_granule_id(granule_id)
+        # If it is not an HLS ID
+        if parsed_id is None:
+            return None
+        # Get the granule (the latest acquisition of the day if there is no time)
+        sensor, tile, year_doy, time = parsed_id
+        rows = self.query('SELECT sensor, tile, year_doy, time, version, title FROM granules '
+                          'WHERE tile = ? AND year_doy = ? AND sensor = ? AND time BETWEEN ? AND ? '
+                          'ORDER BY time DESC LIMIT 1',
+                          (tile, year_doy, sensor, 0 if time is None else time, 239999 if time is None else time))
+        # Return the record
+        return t_hls_catalog.HLSGranule(*rows[0]) if len(rows) > 0 else None
+
+    # Get a nested view of the titles by year and DOY (like by_date[year][doy])
+    def get_by_date_view(self):
+        return HLSSQLiteView(self, 'year_doy', BY_DATE_LEVELS)
+
+    # Get a nested view of the titles by tile (like by_tile[band][column][minor_row][minor_column])
+    def get_by_tile_view(self):
+        return HLSSQLiteView(self, 'tile', BY_TILE_LEVELS)
+
+    # Get a view of the titles by granule ID
+    def get_by_id_view(self):
+        return HLSSQLiteIDView(self)
+
+
+# Get the condition (to add to a query's WHERE clause) and parameters of cloud cover (maximum %) and spatial coverage
+# (minimum %) thresholds (granules with no metadata are kept)
+def get_filter_condition(max_cloud_cover=None, min_spatial_coverage=None):
+    # Condition and parameters
+    condition = ''
+    parameters = ()
+    # If there is a cloud cover threshold
+    if max_cloud_cover is not None:
+        condition += ' AND (cloud_cover IS NULL OR cloud_cover <= ?)'
+        parameters += (max_cloud_cover,)
+    # If there is a spatial coverage threshold
+    if min_spatial_coverage is not None:
+        condition += ' AND (spatial_coverage IS NULL OR spatial_coverage >= ?)'
+        parameters += (min_spatial_coverage,)
+    # Return them
+    return condition, parameters
+
+
+# Class for a read-only, nested dictionary style view of an SQLite catalog (e.g. view['2022']['123'] -> list of
+# titles). Each level is named by a function of the values of a column (the date or the tile code), and the last level
+# holds the titles with one value of the column
+class HLSSQLiteView(Mapping):
+
+    def __init__(self, catalog, column, levels, names=(), values=None):
+
+        self.catalog = catalog
+        self.column = column
+        self.levels = levels
+        # Names of the levels above this one
+        self.names = names
+        # Values of the column under this view (None for the top view, which reads them each time it is used)
+        self.values = values
+
+    # Get the values of the column under this view (read from the index of the column)
+    def get_values(self):
+        # If this is a deeper view
+        if self.values is not None:
+            # Use the values found by the view above
+            return self.values
+        # Read the values
+        return self.catalog.query_column(f'SELECT DISTINCT {self.column} FROM granules ORDER BY {self.column}')
+
+    # Check if there is an entry
+    def __contains__(self, name):
+        return name in self.__iter__()
+
+    # Get an entry (a deeper view, or the list of titles at the last level)
+    def __getitem__(self, name):
+        # Get the values of the entry
+        values = [value for value in self.get_values() if self.levels[len(self.names)](value) == name]
+        # If there are none
+        if len(values) == 0:
+            raise KeyError(name)
+        # If this is the last level
+        if len(self.names) == len(self.levels) - 1:
+            # Return the titles (in date, tile and time order)
+            return self.catalog.query_column(f'SELECT title FROM granules WHERE {self.column} = ? '
+                                             f'ORDER BY year_doy, tile, time', (values[0],))
+        # Return the deeper view
+        return HLSSQLiteView(self.catalog, self.column, self.levels, self.names + (name,), values)
+
+    # Get the names of the entries (in order, the names of a level all have the same width)
+    def __iter__(self):
+        return iter(sorted(set([self.levels[len(self.names)](value) for value in self.get_values()])))
+
+    # Get the number of entries
+    def __len__(self):
+        return len(set([self.levels[len(self.names)](value) for value in self.get_values()]))
+
+
+# Class for a read-only view of an SQLite catalog by granule ID (see t_hls_catalog.HLSCatalogIDView)
+class HLSSQLiteIDView(Mapping):
+
+    def __init__(self, catalog):
+
+        self.catalog = catalog
+
+    # Check if there is a granule for an ID
+    def __contains__(self, granule_id):
+        return self.catalog.get_granule(granule_id) is not None
+
+    # Get the title of the granule for an ID
+    def __getitem__(self, granule_id):
+        # Get the granule
+        granule = self.catalog.get_granule(granule_id)
+        # If there isn't one
+        if granule is None:
+            raise KeyError(granule_id)
+        # Return its title
+        return granule.title
+
+    # Get the IDs (with acquisition time, the titles without the version)
+    def __iter__(self):
+        for title in self.catalog.query_column('SELECT title FROM granules ORDER BY year_doy, tile, sensor, time'):
+            yield title[0:29]
+
+    # Get the number of granules
+    def __len__(self):
+        return len(self.catalog)
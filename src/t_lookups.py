@@ -41,3 +41,12 @@ eastward_intermajor_minor = {}
 southward_intermajor_minor = {}
 
 northward_intermajor_minor = {}
+
+# Letters of the latitude bands of the (major) tiles, from south to north (8 degrees each, X is 12)
+band_letters = 'CDEFGHJKLMNPQRSTUVWX'
+
+# Column letters of the 100km squares (minor columns) in each set of zones (zone number % 3), west to east
+minor_column_letters = {1: 'ABCDEFGH', 2: 'JKLMNPQR', 0: 'STUVWXYZ'}
+
+# Row letters of the 100km squares (minor rows), south to north (they repeat, and start 5 letters later in even zones)
+minor_row_letters = 'ABCDEFGHJKLMNPQRSTUV'
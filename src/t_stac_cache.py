@@ -0,0 +1,168 @@
+import json
+import hashlib
+import logging
+import datetime
+import threading
+import t_stac_search
+from os import environ, makedirs, remove, replace, scandir, utime
+from os.path import exists
+from pathlib import Path
+from time import time
+
+
+# Class for a disk-backed cache of STAC responses, keyed by URL
+class STACResponseCache:
+
+    def __init__(self, cache_path, immutable_after_days=30, max_size_bytes=2 * 1024 ** 3):
+
+        self.cache_path = Path(cache_path)
+        self.immutable_after_days = immutable_after_days
+        self.max_size_bytes = max_size_bytes
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+
+        # If there is no cache directory
+        if not exists(self.cache_path):
+            # Make the directory
+            makedirs(self.cache_path)
+        # Add up the size of the existing entries
+        for entry in scandir(self.cache_path):
+            self.size_bytes += entry.stat().st_size
+
+    # Get the path to the entry for a URL
+    def get_entry_path(self, target_url):
+        # Hash the URL to make the file name
+        return self.cache_path / (hashlib.sha256(target_url.encode()).hexdigest() + '.json')
+
+    # Get the entry for a URL (dictionary with the text and validators), or None if there isn't one
+    def get(self, target_url):
+        # Path to the entry
+        entry_path = self.get_entry_path(target_url)
+        # Try and read the entry
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        # If it doesn't work (no entry, or one that was only partly written)
+        except (OSError, ValueError):
+            # Return None
+            return None
+        # Mark the entry as recently used (for eviction)
+        utime(entry_path)
+        # Return the entry
+        return entry
+
+    # Add (or replace) the entry for a URL from a response's text and headers
+    def put(self, target_url, text, headers):
+        # Assemble the entry
+        entry = {'url': target_url,
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'),
+                 'fetched': time(),
+                 'text': text}
+        # Write the entry
+        self.write_entry(target_url, entry)
+
+    # Record that a cached entry was confirmed as current by the server (e.g. a 304 response)
+    def touch(self, target_url, entry):
+        # Update the fetch time
+        entry['fetched'] = time()
+        # Write the entry
+        self.write_entry(target_url, entry)
+
+    # Write an entry to disk and evict old entries if the cache is too large
+    def write_entry(self, target_url, entry):
+        # Path to the entry
+        entry_path = self.get_entry_path(target_url)
+        # Temporary path (so that readers never see a partial entry)
+        temp_path = entry_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        # Write the entry
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        # Get the size of the new entry
+        new_size = temp_path.stat().st_size
+        with self.lock:
+            # If there is an entry being replaced
+            if exists(entry_path):
+                # Remove its size
+                self.size_bytes -= entry_path.stat().st_size
+            # Move the entry into place
+            replace(temp_path, entry_path)
+            # Add its size
+            self.size_bytes += new_size
+            # If the cache is now too large
+            if self.size_bytes > self.max_size_bytes:
+                # Evict entries
+                self.evict()
+
+    # Remove the least recently used entries until the cache is back under 90% of its size limit
+    def evict(self):
+        # Get the entries, least recently used first
+        entries = sorted([entry for entry in scandir(self.cache_path) if entry.name.endswith('.json')],
+                         key=lambda entry: entry.stat().st_mtime)
+        # For each entry
+        for entry in entries:
+            # If the cache is small enough
+            if self.size_bytes <= self.max_size_bytes * 0.9:
+                # Stop
+                break
+            # Get the size of the entry
+            entry_size = entry.stat().st_size
+            # Try and remove the entry
+            try:
+                remove(entry.path)
+            # If it doesn't work (e.g. another process already removed it)
+            except OSError:
+                # Skip it
+                continue
+            # Remove its size
+            self.size_bytes -= entry_size
+        # Log the info
+        logging.info(f'Evicted STAC cache entries down to {self.size_bytes} bytes.')
+
+    # Check if an entry can be used without asking the server (its year/month/day closed out long before it was fetched)
+    def is_immutable(self, target_url, entry):
+        # Get the last date covered by the page
+        end_date = get_end_date_from_STAC_url(target_url)
+        # If the page is not a year, month or day page (e.g. the collection)
+        if end_date is None:
+            # It can always change
+            return False
+        # Date on which the page is considered closed out
+        closed_date = end_date + datetime.timedelta(days=self.immutable_after_days)
+        # Immutable if the entry was fetched after the page was closed out
+        return datetime.date.fromtimestamp(entry['fetched']) > closed_date
+
+
+# Get the last date covered by a STAC year, month or day URL (None if it is not one)
+def get_end_date_from_STAC_url(target_url):
+    # Get the (year, month, day) components of the URL
+    components = t_stac_search.get_date_from_STAC_link({'href': target_url})
+    # If it is a day
+    if len(components) == 3:
+        # Return the day
+        return datetime.date(*components)
+    # If it is a month
+    elif len(components) == 2:
+        # Get the first day of the next month
+        year, month = components
+        next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+        # Return the last day of the month
+        return next_month - datetime.timedelta(days=1)
+    # If it is a year
+    elif len(components) == 1:
+        # Return the last day of the year
+        return datetime.date(components[0], 12, 31)
+    # Otherwise (not a dated page)
+    return None
+
+
+# Get the cache set up in the environmental variables (None if there isn't one)
+def get_default_cache():
+    # If there is no cache path
+    if 'stac_cache_path' not in environ.keys():
+        # No cache
+        return None
+    # Return the cache
+    return STACResponseCache(environ['stac_cache_path'],
+                             immutable_after_days=int(environ.get('stac_cache_immutable_days', 30)),
+                             max_size_bytes=int(environ.get('stac_cache_max_bytes', 2 * 1024 ** 3)))
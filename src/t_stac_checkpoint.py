@@ -0,0 +1,91 @@
+import json
+import hashlib
+import logging
+import threading
+from os import fsync
+from os.path import exists
+
+
+# Class for an append-only record of the day pages finished by a STAC harvest (one JSON line per day, with the day's
+# titles or metadata records). Only the finished day URLs (and where their lines are in the file) are kept in memory,
+# the items of a finished day are read back from the file when they are needed
+class STACHarvestCheckpoint:
+
+    def __init__(self, checkpoint_path):
+
+        self.checkpoint_path = checkpoint_path
+        # Position of the line of each finished day in the file, by day URL
+        self.day_offsets = {}
+        # Days that could not be retrieved by this harvest (e.g. once the retry budget was used up), left unfinished so
+        # the next harvest requests them again
+        self.lost_days = set()
+        self.lock = threading.Lock()
+
+        # If there is a checkpoint from an earlier harvest
+        if exists(self.checkpoint_path):
+            # Read it
+            self.read_checkpoint()
+
+    # Read the finished days from the checkpoint file (a line at a time)
+    def read_checkpoint(self):
+        # Open the file
+        with open(self.checkpoint_path, 'rb+') as f:
+            # Position of the first line
+            offset = 0
+            # For each line
+            for line in iter(f.readline, b''):
+                # If it was only partly written (harvest killed mid-write)
+                if not line.endswith(b'\n'):
+                    # Cut the file back to the last complete line
+                    f.truncate(offset)
+                    # Log a warning
+                    logging.warning(f'Removed a partly written line from {self.checkpoint_path}.')
+                    break
+                # Reference the position of the line by day URL
+                self.day_offsets[json.loads(line)['day']] = offset
+                # Move to the next line
+                offset += len(line)
+        # Log the info
+        logging.info(f'{len(self.day_offsets)} finished days read from {self.checkpoint_path}.')
+
+    # Check if a day page has already been finished
+    def is_done(self, day_url):
+        return day_url in self.day_offsets.keys()
+
+    # Get the items of a finished day page (read back from the file)
+    def get_items(self, day_url):
+        # Open the file
+        with open(self.checkpoint_path, 'rb') as f:
+            # Go to the day's line
+            f.seek(self.day_offsets[day_url])
+            # Read its items
+            return json.loads(f.readline())['items']
+
+    # Record a day page that could not be retrieved (it stays unfinished)
+    def record_lost(self, day_url):
+        with self.lock:
+            self.lost_days.add(day_url)
+
+    # Record a finished day page and its items
+    def record(self, day_url, items):
+        # Assemble the line
+        line = (json.dumps({'day': day_url, 'items': items}) + '\n').encode()
+        with self.lock:
+            # Append the line to the file
+            with open(self.checkpoint_path, 'ab') as f:
+                # Get the position of the line
+                offset = f.seek(0, 2)
+                f.write(line)
+                # Make sure it is on disk before moving on
+                f.flush()
+                fsync(f.fileno())
+            # Reference the position of the line by day URL
+            self.day_offsets[day_url] = offset
+            # It is no longer lost
+            self.lost_days.discard(day_url)
+
+
+# Get a checksum of a title list that does not depend on its order (to compare harvests)
+def get_catalog_checksum(title_list):
+    # Hash the sorted titles
+    return hashlib.sha256('\n'.join(sorted(title_list)).encode()).hexdigest()
@@ -0,0 +1,160 @@
+import logging
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from time import sleep, time
+
+
+# Class for the retry policy shared by all the requests of a crawl
+class STACRetryPolicy:
+
+    def __init__(self, attempt_limit=5, retry_limit=500, retry_window=600, base_delay=1, max_delay=60,
+                 retryable_statuses=(408, 425, 429, 500, 502, 503, 504), throttle_statuses=(429, 503),
+                 breaker_threshold=5, breaker_pause=60, requests_per_second=None, max_retry_after=300):
+
+        # Attempts allowed for a single URL
+        self.attempt_limit = attempt_limit
+        # Retries allowed across all the URLs of the crawl in a window of time (seconds, None for the whole crawl). The
+        # budget refills as the window moves (retry_limit retries every retry_window seconds, up to retry_limit at
+        # once), so failures hours earlier in a long crawl don't leave it without retries
+        self.retry_limit = retry_limit
+        self.retry_window = retry_window
+        self.retry_tokens = retry_limit
+        self.refill_time = time()
+        # Retries used so far
+        self.retry_count = 0
+        # Backoff (seconds)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Longest Retry-After delay (seconds) the server can ask for (longer requests are cut down to it)
+        self.max_retry_after = max_retry_after
+        # Status codes that are worth retrying, and the ones that mean the server is throttling us
+        self.retryable_statuses = retryable_statuses
+        self.throttle_statuses = throttle_statuses
+        # Circuit breaker (pause the whole crawl after this many throttled responses in a row)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+        self.breaker_trips = 0
+        self.throttle_count = 0
+        self.paused_until = 0
+        # Rate limit (across every thread that shares the policy)
+        self.requests_per_second = requests_per_second
+        self.next_request_time = 0
+        self.lock = threading.Lock()
+
+    # Check if a status code is worth retrying (None is a connection error, which is)
+    def is_retryable(self, status_code):
+        return status_code is None or status_code in self.retryable_statuses
+
+    # Wait until any pause from the circuit breaker is over
+    def wait_if_paused(self):
+        # Get the remaining pause
+        remaining = self.paused_until - time()
+        # If there is one
+        if remaining > 0:
+            # Log the info
+            logging.info(f'Crawl paused by the circuit breaker. Waiting {round(remaining)} seconds.')
+            # Wait it out
+            sleep(remaining)
+
+    # Wait for a turn under the rate limit (if there is one)
+    def wait_for_rate_limit(self):
+        # If there is no rate limit
+        if not self.requests_per_second:
+            return
+        with self.lock:
+            # Get the time of this request's turn
+            turn_time = max(time(), self.next_request_time)
+            # Book the next turn
+            self.next_request_time = turn_time + 1 / self.requests_per_second
+        # Wait for the turn
+        sleep(max(0, turn_time - time()))
+
+    # Record a successful response
+    def record_success(self):
+        with self.lock:
+            # The server is no longer throttling in a row
+            self.throttle_count = 0
+
+    # Record a failed response (status code, or None for a connection error) and its Retry-After delay (if any)
+    def record_failure(self, status_code, retry_after=None):
+        # If the server is not throttling
+        if status_code not in self.throttle_statuses:
+            # Nothing to do
+            return
+        with self.lock:
+            # Add to the throttled responses in a row
+            self.throttle_count += 1
+            # If there have been too many in a row
+            if self.throttle_count >= self.breaker_threshold:
+                # Pause for the longer of the breaker pause and the server's request (up to the longest allowed)
+                pause = max(self.breaker_pause, min(retry_after or 0, self.max_retry_after))
+                # Log a warning
+                logging.warning(f'{self.throttle_count} throttled responses in a row. Pausing the crawl for '
+                                f'{round(pause)} seconds.')
+                # Pause the crawl
+                self.paused_until = max(self.paused_until, time() + pause)
+                # Count the trip
+                self.breaker_trips += 1
+                # Start counting again
+                self.throttle_count = 0
+
+    # Get the delay before the next attempt at a URL (None if it should not be retried)
+    def get_retry_delay(self, attempt_count, retry_after=None):
+        # If the URL has used all its attempts
+        if attempt_count >= self.attempt_limit:
+            # No retry
+            return None
+        with self.lock:
+            # If the budget refills
+            if self.retry_window:
+                # Add the retries for the time since it was last refilled (up to the limit)
+                now = time()
+                self.retry_tokens = min(self.retry_limit, self.retry_tokens +
+                                        (now - self.refill_time) * self.retry_limit / self.retry_window)
+                self.refill_time = now
+            # If the crawl has used all its retries
+            if self.retry_tokens < 1:
+                # Log an error
+                logging.error(f'All {self.retry_limit} retries for the crawl' +
+                              (f' in {self.retry_window} seconds' if self.retry_window else '') + ' have been used.')
+                # No retry
+                return None
+            # Use up a retry
+            self.retry_tokens -= 1
+            self.retry_count += 1
+        # If the server asked for a delay
+        if retry_after is not None:
+            # Respect it (up to the longest allowed)
+            return min(retry_after, self.max_retry_after)
+        # Otherwise, exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt_count - 1)))
+
+
+# Get the delay (seconds) requested by the Retry-After header of a response (None if there isn't one), optionally cut
+# down to a longest delay (so a misbehaving server can't stall a crawl)
+def get_retry_after(response, max_delay=None):
+    # If there is no response or header
+    if response is None or 'Retry-After' not in response.headers.keys():
+        return None
+    # Get the header
+    retry_after = response.headers['Retry-After']
+    # If it is a number of seconds
+    if retry_after.strip().isdigit():
+        delay = int(retry_after)
+    # Otherwise, try and read it as an HTTP date
+    else:
+        try:
+            delay = max(0, parsedate_to_datetime(retry_after).timestamp() - time())
+        # If it doesn't work
+        except (TypeError, ValueError):
+            # Ignore it
+            return None
+    # If the delay is longer than allowed
+    if max_delay is not None and delay > max_delay:
+        # Log a warning
+        logging.warning(f'Retry-After of {round(delay)} seconds cut down to {max_delay} seconds.')
+        # Cut it down
+        delay = max_delay
+    # Return the delay
+    return delay
@@ -1,135 +1,529 @@
 import json
+import math
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+import t_stac_retry
+import t_stac_checkpoint
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep, time
 from dotenv import load_dotenv
 from os import environ
+from urllib.parse import urlencode
 
 
 # Load environmental variables from .env
 load_dotenv()
 
+# Side of an HLS tile (km, an MGRS 100km square and its overlap with the squares around it)
+HLS_TILE_SIDE_KM = 109.8
 
-# Get a list of item titles from a STAC data product
-def get_items_from_STAC(data_product):
+
+# Get a list of item titles from a STAC data product (optionally only from days on or after a datetime.date, and
+# optionally as metadata records from each item's page instead of titles)
+def get_items_from_STAC(data_product, max_workers=1, start_date=None, cache=None, retry_policy=None,
+                        checkpoint_path=None, with_metadata=False, session=None):
     # Start time
     stime = time()
-    # List to hold the items
-    item_list = []
-    # Start (unauthenticated) session
-    s = requests.session()
+    # Get an iterator over the item titles
+    title_iterator = iterate_items_from_STAC(data_product, max_workers=max_workers, start_date=start_date, cache=cache,
+                                             retry_policy=retry_policy, checkpoint_path=checkpoint_path,
+                                             with_metadata=with_metadata, session=session)
+    # If the crawl could not be started
+    if title_iterator is False:
+        # Return False
+        return False
+    # Get all the item titles
+    item_list = list(title_iterator)
+    # Log the success
+    logging.info(f'All items retrieved for {data_product} in {round(time() - stime)} seconds.')
+    # Return the list of item titles
+    return item_list
+
+
+# Get an iterator over the item titles (or metadata records) of a STAC data product, yielding them as each day page
+# is parsed (returns False if the collection, years and months could not be crawled). Metadata records take a request
+# for each item, so crawling with metadata is not supported for whole archives (use iterate_items_from_STAC_search,
+# which returns whole items a page at a time). Takes the path to a checkpoint file, or a checkpoint already open (so the
+# caller can check for days lost by the harvest once it is done)
+def iterate_items_from_STAC(data_product, max_workers=1, start_date=None, cache=None, retry_policy=None,
+                            checkpoint_path=None, with_metadata=False, session=None, checkpoint=None):
+    # If there is an open checkpoint
+    if checkpoint:
+        # Use it
+        pass
+    # Otherwise, if there is a checkpoint file
+    elif checkpoint_path:
+        # Open the checkpoint (picking up the days finished by an earlier, interrupted harvest)
+        checkpoint = t_stac_checkpoint.STACHarvestCheckpoint(checkpoint_path)
+    # Otherwise
+    else:
+        # No checkpoint
+        checkpoint = None
+    # If there is no retry policy
+    if retry_policy is None:
+        # Make one to share between all the requests of the crawl
+        retry_policy = t_stac_retry.STACRetryPolicy()
+    # If there is a session (e.g. shared with the crawl of another data product)
+    if session:
+        # Use it
+        s = session
+    # Otherwise
+    else:
+        # Start (unauthenticated) session, with a connection pool large enough for the workers
+        s = make_STAC_session(max_workers)
     # Data product URL
     data_product_url = environ['stac_root'] + f'LPCLOUD/collections/{data_product}'
     # Logging info
     logging.info(f"Requesting {data_product_url} from STAC.")
     # Request the data product and retrieve the text
-    dataset_dict = get_text_from_STAC_request(data_product_url, session=s)
+    dataset_dict = get_text_from_STAC_request(data_product_url, session=s, cache=cache, retry_policy=retry_policy)
     # If the text was retrieved
     if dataset_dict:
         # Get all the children from the dataset (years)
-        dataset_children = filter_STAC_dataset_links(dataset_dict, 'child')
+        year_links = filter_STAC_dataset_links(dataset_dict, 'child')
+        # If there is a start date
+        if start_date:
+            # Log the info
+            logging.info(f'Only retrieving items on or after {start_date} for {data_product}.')
+            # Only keep the years on or after the start date
+            year_links = filter_STAC_links_by_date(year_links, start_date)
     # Otherwise (no text retrieved)
     else:
         # Log error
         logging.error(f'Text could not be retrieved from {data_product_url}.')
         # Return False
         return False
-    # For each of the years
-    for year_link in dataset_children:
-        # Get the href as the link
-        year_link = year_link['href']
-        # Request the data from the year links and retrieve the text
-        year_dict = get_text_from_STAC_request(year_link, session=s)
+    # Thread pool for requesting sibling pages in parallel (a single worker requests them one at a time)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Get all the children of the years (months)
+        month_links = get_STAC_links_from_pages(year_links, 'child', s, executor, cache=cache,
+                                                retry_policy=retry_policy)
+        # If there is a start date
+        if start_date:
+            # Only keep the months on or after the start date
+            month_links = filter_STAC_links_by_date(month_links, start_date)
+        # Get all the children of the months (days)
+        day_links = get_STAC_links_from_pages(month_links, 'child', s, executor, cache=cache,
+                                              retry_policy=retry_policy)
+    # If there is a start date
+    if start_date:
+        # Only keep the days on or after the start date
+        day_links = filter_STAC_links_by_date(day_links, start_date)
+    # Return an iterator over the items of the days (scenes/base files)
+    return iterate_items_from_day_pages(day_links, s, max_workers=max_workers, cache=cache, retry_policy=retry_policy,
+                                        checkpoint=checkpoint, with_metadata=with_metadata)
+
+
+# Get a list of item titles (or metadata records) from a STAC data product with the item search endpoint (paging
+# through the results)
+def get_items_from_STAC_search(data_product, start_date=None, end_date=None, bbox=None, limit=2000,
+                               retry_policy=None, with_metadata=False, session=None):
+    # Start time
+    stime = time()
+    # Get an iterator over the items
+    item_iterator = iterate_items_from_STAC_search(data_product, start_date=start_date, end_date=end_date, bbox=bbox,
+                                                   limit=limit, retry_policy=retry_policy,
+                                                   with_metadata=with_metadata, session=session)
+    # If the search could not be started
+    if item_iterator is False:
+        # Return False
+        return False
+    # Get all the items
+    item_list = list(item_iterator)
+    # Log the success
+    logging.info(f'{len(item_list)} items retrieved for {data_product} by search in {round(time() - stime)} seconds.')
+    # Return the list of item titles
+    return item_list
+
+
+# Get an iterator over the item titles (or metadata records) of a STAC data product from the item search endpoint,
+# yielding them as each page of results is parsed (returns False if the first page could not be retrieved)
+def iterate_items_from_STAC_search(data_product, start_date=None, end_date=None, bbox=None, limit=2000,
+                                   retry_policy=None, with_metadata=False, session=None):
+    # If there is no retry policy
+    if retry_policy is None:
+        # Make one to share between all the requests of the search
+        retry_policy = t_stac_retry.STACRetryPolicy()
+    # Use the session if there is one, otherwise start an (unauthenticated) session
+    s = session if session else make_STAC_session()
+    # Parameters for the search
+    params = {'collections': data_product, 'limit': limit}
+    # If there is a start or end date (datetime.date objects)
+    if start_date or end_date:
+        # Assemble the datetime range (open ended where there is no date)
+        params['datetime'] = (f'{start_date.isoformat()}T00:00:00Z' if start_date else '..') + '/' + \
+                             (f'{end_date.isoformat()}T23:59:59Z' if end_date else '..')
+    # If there is a bounding box (west, south, east, north)
+    if bbox:
+        # Add it as a comma separated string
+        params['bbox'] = ','.join([str(coordinate) for coordinate in bbox])
+    # Search URL for the first page
+    page_url = environ['stac_root'] + 'LPCLOUD/search?' + urlencode(params)
+    # Logging info
+    logging.info(f'Searching {data_product} with {page_url}.')
+    # Request the first page and retrieve the text
+    page_dict = get_text_from_STAC_request(page_url, session=s, retry_policy=retry_policy)
+    # If the text was not retrieved
+    if not page_dict:
+        # Log error
+        logging.error(f'Text could not be retrieved from {page_url}.')
+        # Return False
+        return False
+    # Return an iterator over the items of the pages
+    return iterate_items_from_search_pages(page_dict, s, retry_policy=retry_policy, with_metadata=with_metadata)
+
+
+# Iterate over the items of the pages of an item search, from its first page (requesting each next page once the items
+# of the one before have been used)
+def iterate_items_from_search_pages(page_dict, session, retry_policy=None, with_metadata=False):
+    # Page count
+    page_count = 1
+    # While there is a page of results
+    while page_dict:
+        # For each item (feature) on the page
+        for item in page_dict['features']:
+            # If the metadata is needed
+            if with_metadata:
+                # Yield the metadata record (the search returns whole items, so there is nothing more to request)
+                yield get_record_from_STAC_item(item)
+            # Otherwise
+            else:
+                # Yield the file name base (the item ID is the same as its 'title' in the catalog)
+                yield item['id']
+        # Get the link to the next page (if any)
+        next_links = filter_STAC_dataset_links(page_dict, 'next')
+        # If there are no more pages
+        if len(next_links) == 0:
+            # Log the info
+            logging.info(f'Search finished after {page_count} pages.')
+            return
+        # Request the next page and retrieve the text
+        page_count += 1
+        page_dict = get_text_from_STAC_request(next_links[0]['href'], session=session, retry_policy=retry_policy)
+        # If the text was not retrieved
+        if not page_dict:
+            # Log error
+            logging.error(f'Text could not be retrieved from {next_links[0]["href"]}. Search stopped after '
+                          f'{page_count - 1} pages.')
+
+
+# Request a list of STAC pages (in parallel) and get their links of a particular relation, in order
+def get_STAC_links_from_pages(page_links, filter, session, executor, cache=None, retry_policy=None):
+    # List to hold the links
+    links_list = []
+    # Get the hrefs of the pages
+    page_urls = [page_link['href'] for page_link in page_links]
+    # Request the pages with the executor (results come back in the same order as the URLs)
+    page_dicts = executor.map(lambda page_url: get_text_from_STAC_request(page_url, session=session, cache=cache,
+                                                                          retry_policy=retry_policy),
+                              page_urls)
+    # For each page
+    for page_url, page_dict in zip(page_urls, page_dicts):
         # If the text was retrieved
-        if year_dict:
-            # Get all the children from the dataset (years)
-            year_children = filter_STAC_dataset_links(year_dict, 'child')
+        if page_dict:
+            # Get all the links of the relation from the page
+            links_list.extend(filter_STAC_dataset_links(page_dict, filter))
         # Otherwise (no text retrieved)
         else:
             # Log warning
-            logging.warning(f'No text was retrieved from {year_link}. Skipping.')
-            # Skip the year
-            continue
-        # For each of the months
-        for month_link in year_children:
+            logging.warning(f'No text was retrieved from {page_url}. Skipping.')
+    # Return the list
+    return links_list
+
+
+# Request the day pages (in parallel) and yield their items (titles, or metadata records), in order
+def iterate_items_from_day_pages(day_links, session, max_workers=1, cache=None, retry_policy=None, checkpoint=None,
+                                 with_metadata=False):
+    # Queue of days in order, with the future of their request (None for days finished in the checkpoint)
+    day_queue = deque()
+    # Thread pool for requesting the days in parallel
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # For each day
+        for day_link in day_links:
             # Get the href as the link
-            month_link = month_link['href']
-            # Request the data from the month links and retrieve the text
-            month_dict = get_text_from_STAC_request(month_link, session=s)
-            # If the text was retrieved
-            if month_dict:
-                # Get all the children (days)
-                month_children = filter_STAC_dataset_links(month_dict, 'child')
-            # Otherwise (no text retrieved)
+            day_url = day_link['href']
+            # If the day was finished in the checkpoint
+            if checkpoint and checkpoint.is_done(day_url):
+                # Nothing to request
+                day_queue.append((day_url, None))
+            # Otherwise
             else:
-                # Log warning
-                logging.warning(f'No text was retrieved from {month_link}. Skipping.')
-                # Skip the month
-                continue
-            # For each of the days
-            for day_link in month_children:
-                # Get the href as the link
-                day_link = day_link['href']
-                # Request the data from the day links and retrieve the text
-                day_dict = get_text_from_STAC_request(day_link, session=s)
-                # If the text was retrieved
-                if day_dict:
-                    # Get all the items (scenes/base files)
-                    day_items = filter_STAC_dataset_links(day_dict, 'item')
-                # Otherwise (no text retrieved)
-                else:
-                    # Log warning
-                    logging.warning(f'No text was retrieved from {day_link}. Skipping.')
-                    # Skip the month
-                    continue
-                # For each item
-                for item in day_items:
-                    # Add the file name base ('title') to the list
-                    item_list.append(item['title'])
-    # Log the success
-    logging.info(f'All items retrieved for {data_product} in {round(time() - stime)} seconds.')
-    # Return the list of item titles
-    return item_list
+                # Request the day
+                day_queue.append((day_url, executor.submit(request_items_from_day_page, day_url, session,
+                                                           cache=cache, retry_policy=retry_policy,
+                                                           with_metadata=with_metadata)))
+            # If enough days are queued to keep the workers busy
+            if len(day_queue) > max_workers * 2:
+                # Yield the items of the oldest day (so only a few pages are held at once)
+                yield from get_items_from_day_page(*day_queue.popleft(), checkpoint=checkpoint)
+        # While there are days left in the queue
+        while len(day_queue) > 0:
+            # Yield the items of the oldest day
+            yield from get_items_from_day_page(*day_queue.popleft(), checkpoint=checkpoint)
+
+
+# Request a day page and get its items: titles, or metadata records from each item's page (False if it failed)
+def request_items_from_day_page(day_url, session, cache=None, retry_policy=None, with_metadata=False):
+    # Request the day and retrieve the text
+    day_dict = get_text_from_STAC_request(day_url, session=session, cache=cache, retry_policy=retry_policy)
+    # If the text was not retrieved
+    if not day_dict:
+        # Return False
+        return False
+    # Get the items (scenes/base files)
+    item_links = filter_STAC_dataset_links(day_dict, 'item')
+    # If only the titles are needed
+    if not with_metadata:
+        # Return the titles
+        return [item_link['title'] for item_link in item_links]
+    # List to hold the records
+    record_list = []
+    # For each item (one request each, through the cache so that a day repeated after an interruption is not requested
+    # again)
+    for item_link in item_links:
+        # Request the item and retrieve the text
+        item_dict = get_text_from_STAC_request(item_link['href'], session=session, cache=cache,
+                                               retry_policy=retry_policy)
+        # If the text was not retrieved
+        if not item_dict:
+            # Log warning
+            logging.warning(f'No text was retrieved from {item_link["href"]}. Leaving {day_url} unfinished.')
+            # Return False (so the day is not recorded with records missing their metadata, and is requested again by
+            # the next harvest)
+            return False
+        # Add the record
+        record_list.append(get_record_from_STAC_item(item_dict))
+    # Return the records
+    return record_list
+
+
+# Get the items of a requested day page (or from the checkpoint, if the day was already finished)
+def get_items_from_day_page(day_url, day_future, checkpoint=None):
+    # If the day was finished in the checkpoint
+    if day_future is None:
+        # Return its items
+        return checkpoint.get_items(day_url)
+    # Wait for the requested day
+    day_items = day_future.result()
+    # If the text was not retrieved
+    if day_items is False:
+        # Log warning
+        logging.warning(f'No text was retrieved from {day_url}. Skipping.')
+        # If there is a checkpoint
+        if checkpoint:
+            # Record the lost day (it stays unfinished, so the next harvest requests it again)
+            checkpoint.record_lost(day_url)
+        # No items
+        return []
+    # If there is a checkpoint
+    if checkpoint:
+        # Record the finished day
+        checkpoint.record(day_url, day_items)
+    # Return the items
+    return day_items
+
+
+# Get a compact metadata record from a STAC item (title, datetime, cloud and spatial coverage, footprint, band hrefs)
+def get_record_from_STAC_item(item):
+    # Get the properties and assets (if any)
+    properties = item.get('properties', {})
+    assets = item.get('assets', {})
+    # Return the record
+    return {'title': item['id'],
+            'datetime': properties.get('datetime'),
+            'cloud_cover': properties.get('eo:cloud_cover'),
+            'spatial_coverage': get_spatial_coverage_from_geometry(item.get('geometry')),
+            'bbox': item.get('bbox'),
+            # Hrefs of the bands (B01, B02...) and the Fmask
+            'assets': {key: asset['href'] for key, asset in assets.items() if key[0] == 'B' or key == 'Fmask'}}
 
 
-def get_text_from_STAC_request(target_url, session=requests.session(), attempt_limit=3):
+# Get the spatial coverage of an item (% of its tile with data, 0 to 100) from its footprint (GeoJSON polygon or
+# multipolygon in longitude and latitude, the item's geometry). Returns None if there is no footprint
+def get_spatial_coverage_from_geometry(geometry):
+    # If there is no footprint
+    if not geometry or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+        return None
+    # Get the polygons
+    polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+    # Area of the footprint (square km)
+    area = 0
+    # For each ring of each polygon (the outer ring, then any holes)
+    for polygon in polygons:
+        for ring_index, ring in enumerate(polygon):
+            # Longitudes relative to the first point (so a ring across the antimeridian stays in one piece)
+            longitudes = [(point[0] - ring[0][0] + 180) % 360 - 180 for point in ring]
+            latitudes = [point[1] for point in ring]
+            # Scale to km around the ring's mean latitude (tiles are small enough for a flat approximation)
+            scale = 111.32 * math.cos(math.radians(sum(latitudes) / len(latitudes)))
+            x = [longitude * scale for longitude in longitudes]
+            y = [latitude * 110.57 for latitude in latitudes]
+            # Get the area of the ring (shoelace formula)
+            ring_area = abs(sum([x[index - 1] * y[index] - x[index] * y[index - 1] for index in range(len(x))])) / 2
+            # Add the outer ring, take away the holes
+            area += ring_area if ring_index == 0 else -ring_area
+    # Return the coverage of the tile
+    return min(100, round(area / HLS_TILE_SIDE_KM ** 2 * 100))
+
+
+# Get the title of an item (either a title already, or a metadata record)
+def get_title_from_item(item):
+    # If the item is a title
+    if isinstance(item, str):
+        return item
+    # Otherwise, get it from the record
+    return item['title']
+
+
+# Keep the year, month or day links that are on or after a date (datetime.date object)
+def filter_STAC_links_by_date(links, start_date):
+    # List to hold the links
+    links_list = []
+    # For each link
+    for link in links:
+        # Get the (year, month, day) components of the link
+        link_date = get_date_from_STAC_link(link)
+        # If the link is on or after the start date (to the precision of the link)
+        if link_date >= (start_date.year, start_date.month, start_date.day)[0:len(link_date)]:
+            # Keep the link
+            links_list.append(link)
+    # Return the list
+    return links_list
+
+
+# Get the date components from a year (.../YYYY), month (.../YYYY/MM) or day (.../YYYY/MM/DD) link
+def get_date_from_STAC_link(link):
+    # List for the date components
+    components = []
+    # For each part of the href, from the end
+    for part in reversed(link['href'].rstrip('/').split('/')):
+        # If the part is not a number
+        if not part.isdigit():
+            # We've reached the collection, so stop
+            break
+        # Add the component to the front
+        components.insert(0, int(part))
+        # If the part is a year
+        if len(part) == 4:
+            # Stop
+            break
+    # Return the components as a tuple
+    return tuple(components)
+
+
+# Make a requests session that can hold a connection open for each worker
+def make_STAC_session(max_workers=1):
+    # Start (unauthenticated) session
+    session = requests.session()
+    # Make an adapter with a pool of connections (at least the requests default of 10)
+    adapter = HTTPAdapter(pool_connections=max(max_workers, 10), pool_maxsize=max(max_workers, 10))
+    # Mount the adapter for both schemes
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Return the session
+    return session
+
+
+def get_text_from_STAC_request(target_url, session=requests.session(), attempt_limit=3, cache=None, retry_policy=None):
+    # If there is no retry policy shared with the rest of the crawl
+    if retry_policy is None:
+        # Make one for this request
+        retry_policy = t_stac_retry.STACRetryPolicy(attempt_limit=attempt_limit)
     # Logging info
     logging.info(f"Requesting {target_url} from STAC.")
+    # Cached entry for the URL (if any)
+    entry = None
+    # Headers for the request
+    headers = {}
+    # If there is a cache
+    if cache:
+        # Get the entry for the URL
+        entry = cache.get(target_url)
+    # If there is an entry
+    if entry:
+        # If the page has been closed out since it was cached
+        if cache.is_immutable(target_url, entry):
+            # Log the info
+            logging.info(f'Using cached text for {target_url}.')
+            # Return the cached text
+            return json.loads(entry['text'])
+        # Otherwise, ask the server to only send the page if it has changed
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
     # Attempt count
     attempt_count = 0
     # While loop to get through the validation steps
     while True:
         # Increment attempt count
         attempt_count += 1
-        # If the attempt count exceeds the limit
-        if attempt_count > attempt_limit:
-            # Log and error
-            logging.error(f'All {attempt_limit} attempts to retrieve text from {target_url} failed.')
-            # Return False
-            return False
         # Log the attempt
-        logging.info(f'Attempting to retrieve text from {target_url}. Attempt {attempt_count} of {attempt_limit}.')
+        logging.info(f'Attempting to retrieve text from {target_url}. '
+                     f'Attempt {attempt_count} of {retry_policy.attempt_limit}.')
+        # Wait if the crawl is paused, then for a turn under the rate limit
+        retry_policy.wait_if_paused()
+        retry_policy.wait_for_rate_limit()
         # Make a request for the dataset from STAC
         r = attempt_request(session,
-                            target_url)
-        # If the request was unsuccessful
-        if not r:
-            # Log warning
-            logging.warning(f'Request for {target_url} was unsuccessful.')
-            # Skip the loop
-            continue
-        # Get the text from the request
-        r_text = attempt_request_to_text(r)
-        # If the text retrieval was unsuccessful
-        if not r_text:
+                            target_url,
+                            headers=headers)
+        # Get the status code (None if the request could not be made)
+        status_code = r.status_code if r is not None else None
+        # Get the delay asked for by the server (if any, and up to the longest allowed)
+        retry_after = t_stac_retry.get_retry_after(r, max_delay=retry_policy.max_retry_after)
+        # If the page has not changed since it was cached
+        if status_code == 304 and entry:
+            # Record the success
+            retry_policy.record_success()
+            # Log the info
+            logging.info(f'Cached text for {target_url} is still current.')
+            # Record the revalidation
+            cache.touch(target_url, entry)
+            # Return the cached text
+            return json.loads(entry['text'])
+        # If the request was successful
+        if status_code == 200:
+            # Record the success
+            retry_policy.record_success()
+            # Get the text from the request
+            r_text = attempt_request_to_text(r)
+            # If the text retrieval was successful
+            if r_text:
+                # If there is a cache
+                if cache:
+                    # Add the response to the cache
+                    cache.put(target_url, r.text, r.headers)
+                # If we get this far, log the info
+                logging.info(f'Retrieval of text from {target_url} successful in {attempt_count} attempts.')
+                # Return the text
+                return r_text
             # Log warning
             logging.warning(f'Text retrieval from request for {target_url} was unsuccessful.')
-            # Skip the loop
-            continue
-        # If we get this far, log the info
-        logging.info(f'Retrieval of text from {target_url} successful in {attempt_count} attempts.')
-        # Return the text
-        return r_text
+        # Otherwise, if the request failed in a way that retrying won't fix (e.g. 404)
+        elif not retry_policy.is_retryable(status_code):
+            # Log an error
+            logging.error(f'Status code of {status_code} for {target_url}. Not retrying.')
+            # Return False
+            return False
+        # Otherwise (a failure worth retrying)
+        else:
+            # Record the failure (for the circuit breaker)
+            retry_policy.record_failure(status_code, retry_after=retry_after)
+        # Get the delay before the next attempt
+        back_off = retry_policy.get_retry_delay(attempt_count, retry_after=retry_after)
+        # If there are no attempts left
+        if back_off is None:
+            # Log and error
+            logging.error(f'All {attempt_count} attempts to retrieve text from {target_url} failed.')
+            # Return False
+            return False
+        # Log a warning
+        logging.warning(f'Status code of {status_code} for {target_url}. Waiting {back_off:.1f} seconds.')
+        # Wait a hot second
+        sleep(back_off)
 
 
 def attempt_request_to_text(response):
@@ -155,47 +549,29 @@ def filter_STAC_dataset_links(dataset, filter):
     return links_list
 
 
-# Attempt a request until it is successful or hard limit is reached
-def attempt_request(session, target_url, attempt_limit=10):
-    # Back-off timer
-    back_off = 0
-    # Attempt count
-    attempt_count = 1
+# Attempt a single request (returns None if the request could not be made, e.g. connection error)
+def attempt_request(session, target_url, headers=None):
     # Log the attempt
-    logging.info(f'Making request for {target_url}. Attempt {attempt_count}.')
+    logging.info(f'Making request for {target_url}.')
     # Try the request
-    r = session.get(target_url)
-    # If we get a non-200 status request
-    while r.status_code != 200:
-        # Log the attempt
-        logging.info(f'{r.status_code} for {target_url}.')
-        # Increment attempt count
-        attempt_count += 1
-        # If we have exceeded the attempt limit
-        if attempt_count > attempt_limit:
-            # Log an error
-            logging.error(f'Request for {target_url} failed after {attempt_count} of {attempt_limit} attempts.')
-            # Return False (failed)
-            return False
+    try:
+        r = session.get(target_url, headers=headers)
+    # If it doesn't work
+    except requests.exceptions.RequestException as e:
         # Log a warning
-        logging.warning(f'Status code of {r.status_code} for {target_url}. Waiting {back_off} seconds.')
-        # Wait a hot second_
-        sleep(back_off)
-        # Log the attempt
-        logging.info(f'Making request for {target_url}. Attempt {attempt_count}.')
-        # Try again
-        r = session.get(target_url)
-        # Add to back off timer
-        back_off += 1
-    # Log the attempt
-    logging.info(f'Finished with request for {target_url}. Attempt {attempt_count}.')
+        logging.warning(f'Request for {target_url} could not be made: {e}')
+        # Return None
+        return None
+    # Log the status
+    logging.info(f'{r.status_code} for {target_url}.')
     # Return the completed request
     return r
 
 
 def main():
 
-    get_items_from_STAC('HLSS30.v2.0')
+    get_items_from_STAC('HLSS30.v2.0', max_workers=8)
+    #get_items_from_STAC_search('HLSS30.v2.0', start_date=datetime.date(2022, 5, 1), bbox=(-100, 40, -95, 45))
     #get_items_from_STAC('HLSL30.v2.0')
 
 
@@ -0,0 +1,109 @@
+import json
+import hashlib
+import logging
+import datetime
+import threading
+from os import getpid, replace
+from os.path import exists
+from pathlib import Path
+
+
+# Lock for updating the manifest (datasets can be written from several threads at once)
+manifest_lock = threading.Lock()
+
+
+# Class for the manifest of the support files directory (support_manifest.json), which records the snapshots of each
+# dataset's support file (date, file name, file count and checksum), so that the latest one can be found with a single
+# read
+class SupportFileManifest:
+
+    def __init__(self, support_files_path):
+
+        self.support_files_path = Path(support_files_path)
+        self.manifest_path = self.support_files_path / 'support_manifest.json'
+
+    # Read the manifest (dictionary of snapshot lists by dataset, oldest first)
+    def read(self):
+        # If there is no manifest yet
+        if not exists(self.manifest_path):
+            # No snapshots
+            return {}
+        # Try and read the manifest
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        # If it doesn't work
+        except (OSError, ValueError):
+            # Log a warning
+            logging.warning(f'Could not read {self.manifest_path}. Ignoring it.')
+            return {}
+
+    # Write the manifest
+    def write(self, manifest):
+        # Temporary path (so that a partly written manifest is never read)
+        temp_path = self.manifest_path.with_suffix(f'.{getpid()}.partial')
+        # Write the manifest
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        # Move it into place
+        replace(temp_path, self.manifest_path)
+
+    # Get the snapshots of a dataset (oldest first)
+    def get_snapshots(self, dataset):
+        return self.read().get(dataset, [])
+
+    # Get the date (datetime date object) of the latest snapshot of a dataset (None if there isn't one)
+    def get_latest_date(self, dataset):
+        # Get the snapshots
+        snapshots = self.get_snapshots(dataset)
+        # If there are none
+        if len(snapshots) == 0:
+            return None
+        # Return the date of the latest one
+        return datetime.date.fromisoformat(snapshots[-1]['date'])
+
+    # Add (or replace) the snapshot of a dataset's support file from a date
+    def add_snapshot(self, dataset, date, file_path, file_count):
+        # Assemble the snapshot
+        snapshot = {'date': date.strftime('%Y-%m-%d'),
+                    'file': Path(file_path).name,
+                    'file_count': file_count,
+                    'sha256': get_file_checksum(file_path)}
+        with manifest_lock:
+            # Read the manifest
+            manifest = self.read()
+            # Replace any snapshot from the same date
+            snapshots = [entry for entry in manifest.get(dataset, []) if entry['date'] != snapshot['date']]
+            snapshots.append(snapshot)
+            # Keep them oldest first
+            manifest[dataset] = sorted(snapshots, key=lambda entry: entry['date'])
+            # Write the manifest
+            self.write(manifest)
+
+    # Remove the snapshots of a dataset from the manifest, except the latest few. Returns the snapshots removed
+    def remove_old_snapshots(self, dataset, keep=1):
+        with manifest_lock:
+            # Read the manifest
+            manifest = self.read()
+            # Get the snapshots
+            snapshots = manifest.get(dataset, [])
+            # Split off the old ones
+            old_snapshots = snapshots[0:max(0, len(snapshots) - keep)]
+            manifest[dataset] = snapshots[len(old_snapshots):]
+            # Write the manifest
+            self.write(manifest)
+        # Return the old snapshots
+        return old_snapshots
+
+
+# Get the SHA-256 checksum of a file
+def get_file_checksum(file_path):
+    # Hash
+    checksum = hashlib.sha256()
+    # Open the file
+    with open(file_path, 'rb') as f:
+        # Hash it a chunk at a time
+        for chunk in iter(lambda: f.read(1024 ** 2), b''):
+            checksum.update(chunk)
+    # Return the checksum
+    return checksum.hexdigest()
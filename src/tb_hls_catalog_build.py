@@ -0,0 +1,329 @@
+import json
+import random
+import datetime
+import logging
+import tempfile
+import numpy as np
+import t_hls_albedo
+import t_hls_catalog
+import t_hls_catalog_sqlite
+import t_stac_retry
+from tb_stac_local_server import LocalSTACServer
+from concurrent.futures import ProcessPoolExecutor
+from os import environ
+from os.path import exists
+from pathlib import Path
+from time import time
+
+
+# Count the files on a date in a catalog over and over for a while (in a worker process). Returns the counts seen
+def count_files_repeatedly(catalog, year_doy, seconds):
+    counts = set()
+    stime = time()
+    while time() - stime < seconds:
+        counts.add(len(catalog.get_files(year_doy)))
+    return counts
+
+
+def main():
+
+    # Start the local server with both data products
+    server = LocalSTACServer(data_product='HLSL30.v2.0', extra_data_products=('HLSS30.v2.0',), latency=0.05)
+    server.start()
+    environ['stac_max_workers'] = '4'
+
+    # Build the datasets one after the other (cold start, empty support directory)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    stime = time()
+    l30 = t_hls_albedo.HLSDataset('L30')
+    l30_time = time() - stime
+    s30 = t_hls_albedo.HLSDataset('S30')
+    serial_time = time() - stime
+    print(f'One after the other: L30 in {l30_time:.2f} seconds, both in {serial_time:.2f} seconds.')
+
+    # Build the catalog (both datasets at the same time, cold start)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    stime = time()
+    catalog = t_hls_albedo.HLSDataCatalog()
+    catalog_time = time() - stime
+    print(f'Catalog: both in {catalog_time:.2f} seconds.')
+
+    # The datasets must be the same
+    assert catalog.l30.by_date == l30.by_date and catalog.s30.by_date == s30.by_date
+    assert catalog.l30.by_tile == l30.by_tile and catalog.s30.by_tile == s30.by_tile
+    assert sum([len(files) for doys in catalog.s30.by_date.values() for files in doys.values()]) == \
+        len(server.get_titles('HLSS30.v2.0'))
+
+    # Open the dataset again (from the binary catalog written on the first open)
+    s30 = t_hls_albedo.HLSDataset('S30')
+    assert isinstance(s30.catalog.get_partition(2021).year_doy, np.memmap)
+    assert s30.by_date == catalog.s30.by_date and s30.by_tile == catalog.s30.by_tile
+
+    # Publish a few more days and refresh (the catalog is updated in place, as a new version)
+    server.build_catalog('HLSS30.v2.0', (2022,), (3,), (6, 7, 8), ('14TPL', '14TQL'))
+    year_path = s30.catalog.catalog_path / '2021.bin'
+    year_time = year_path.stat().st_mtime
+    s30 = t_hls_albedo.HLSDataset('S30', refresh=True)
+    added = s30.get_added_between(0)
+    assert s30.catalog.version == 1 and len(added) == 6 and all(['.2022065T' <= title[14:23] for title in added])
+    assert year_path.stat().st_mtime == year_time
+    assert len(s30.catalog) == len(catalog.s30.catalog) + 6
+    print(f'Refresh: version {s30.catalog.version}, {len(added)} files added, 2021 left untouched.')
+
+    # A catalog that is already there is never replaced by another process writing one
+    assert not t_hls_catalog.write_partitioned_catalog(t_hls_catalog.make_granule_catalog([]), s30.catalog.catalog_path)
+    assert t_hls_albedo.HLSDataset('S30').catalog.version == 1
+    # A support file that changed after its catalog was written updates the catalog as another version
+    file_path = s30.get_dataset_file_path(s30.get_latest_dataset_file())
+    with open(file_path, 'r') as f:
+        lines = f.readlines()
+    with open(file_path, 'w') as f:
+        f.writelines(lines[1:] + [json.dumps('HLS.S30.T14TPL.2022070T173002.v2.0') + '\n'])
+    reader = t_hls_catalog.HLSPartitionedCatalog(s30.catalog.catalog_path)
+    reader_count = len(reader.get_files_between(2022001, 2022365))
+    stale = t_hls_albedo.HLSDataset('S30')
+    assert stale.catalog.catalog_path == s30.catalog.catalog_path and stale.catalog.version == 2
+    assert stale.get_added_between(1) == ['HLS.S30.T14TPL.2022070T173002.v2.0']
+    assert list(stale.catalog.iterate_deltas())[-1]['removed'] == [json.loads(lines[0])]
+    assert len(stale.catalog) == len(s30.catalog)
+    print(f'Changed support file: catalog updated to version {stale.catalog.version}.')
+    # The years with changes were written to new files and published at once. A reader that had a year open keeps
+    # reading the old one, and the superseded files are gone
+    assert len(reader.get_files_between(2022001, 2022365)) == reader_count and reader.version == 1
+    assert sorted([path.name for path in stale.catalog.catalog_path.glob('*.bin')]) == \
+        sorted(stale.catalog.year_files.values()) and stale.catalog.year_files[2022] == '2022.v2.bin'
+    # An update that stops before it is published leaves the catalog as it was (and logs nothing)
+    write_partition_list = t_hls_catalog.write_partition_list
+
+    def fail_to_publish(*args):
+        raise OSError('Stopped before publishing.')
+    t_hls_catalog.write_partition_list = fail_to_publish
+    try:
+        t_hls_catalog.HLSPartitionedCatalog(stale.catalog.catalog_path).apply_delta(removed=added)
+    except OSError:
+        pass
+    t_hls_catalog.write_partition_list = write_partition_list
+    stopped = t_hls_catalog.HLSPartitionedCatalog(stale.catalog.catalog_path)
+    assert stopped.version == 2 and len(list(stopped.iterate_deltas())) == 2 and len(stopped) == len(stale.catalog)
+    assert stopped.get_files_between(2022001, 2022365) == stale.catalog.get_files_between(2022001, 2022365)
+    print('Updates are published at once (readers and stopped updates see the version before).')
+    # Moving to a newer support file makes its catalog next to the older one (left as it is for readers still on it),
+    # carrying on the version and update log, and sharing the years without changes
+    new_path = s30.get_dataset_file_path(datetime.date(2030, 1, 1))
+    with open(new_path, 'w') as f:
+        f.writelines(lines[1:] + [json.dumps(title) + '\n' for title in
+                                  ('HLS.S30.T14TPL.2022070T173002.v2.0', 'HLS.S30.T14TPL.2022071T173002.v2.0')])
+    stale.update_catalog(file_path, new_path, added=['HLS.S30.T14TPL.2022071T173002.v2.0'])
+    moved = t_hls_catalog.HLSPartitionedCatalog(t_hls_catalog.get_catalog_path(new_path))
+    assert moved.version == 3 and moved.get_added_between(2) == ['HLS.S30.T14TPL.2022071T173002.v2.0']
+    assert list(moved.iterate_deltas())[0:2] == list(stale.catalog.iterate_deltas())
+    assert t_hls_catalog.HLSPartitionedCatalog(stale.catalog.catalog_path).version == 2
+    assert len(stale.catalog.get_files(2022071)) == 0 and len(moved.get_files(2022071)) == 1
+    assert (moved.catalog_path / moved.year_files[2021]).stat().st_ino == \
+        (stale.catalog.catalog_path / stale.catalog.year_files[2021]).stat().st_ino
+    print(f'Newer support file: catalog made next to the older one, version {moved.version}.')
+    # A catalog made from titles in memory has no versions
+    s30.ingest_titles([json.loads(line) for line in lines[0:10]])
+    assert s30.get_added_between(0) is False
+
+    # Build the catalog with a rate limit shared by both crawls
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    environ['stac_requests_per_second'] = '50'
+    server.request_count = 0
+    stime = time()
+    t_hls_albedo.HLSDataCatalog()
+    print(f'Rate limited catalog: {server.request_count} requests in {time() - stime:.2f} seconds (50 per second).')
+    assert server.request_count / (time() - stime) <= 55
+    environ.pop('stac_requests_per_second')
+
+    # Build a dataset with the item search endpoint instead of the crawl, then refresh it the same way
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    searched = t_hls_albedo.HLSDataset('S30', harvest_mode='search')
+    assert sorted([file for doys in searched.by_date.values() for files in doys.values() for file in files]) == \
+        sorted(server.get_titles('HLSS30.v2.0'))
+    searched = t_hls_albedo.HLSDataset('S30', refresh=True, harvest_mode='search')
+    assert len(searched.catalog) == len(server.get_titles('HLSS30.v2.0'))
+    print(f'Search harvest: {len(searched.catalog)} files.')
+    # A harvest with metadata goes through the item search (whole items a page at a time), even in crawl mode
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    environ['stac_harvest_metadata'] = 'True'
+    server.request_count = 0
+    with_metadata = t_hls_albedo.HLSDataset('S30')
+    environ.pop('stac_harvest_metadata')
+    assert len(with_metadata.catalog) == len(server.get_titles('HLSS30.v2.0')) and server.request_count == 1
+    assert exists(with_metadata.get_metadata_file_path(with_metadata.snapshot_date))
+    print(f'Metadata harvest: {len(with_metadata.catalog)} files, {server.request_count} request(s).')
+    # A crawl that loses a day (once its retry budget is used up) makes no support file and keeps its checkpoint, and
+    # the next harvest only requests the lost day again (a day of a clean crawl, the search sees days the crawl does not)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    crawled = t_hls_albedo.HLSDataset('S30')
+    lost_date = t_hls_albedo.get_date_from_file([file for doys in crawled.by_date.values() for files in doys.values()
+                                                 for file in files][0])
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    server.inject_failures(server.root + f'LPCLOUD/collections/HLSS30.v2.0/{lost_date.strftime("%Y/%m/%d")}',
+                           [500] * 3)
+    lost = t_hls_albedo.HLSDataset('S30', retry_policy=t_stac_retry.STACRetryPolicy(retry_limit=1, retry_window=None,
+                                                                                     base_delay=0.01))
+    assert len(lost.catalog) == 0 and lost.get_latest_dataset_file() is None
+    assert exists(environ['support_files_path'] + 'HLSS30.v2.0_harvest_checkpoint.jsonl')
+    resumed = t_hls_albedo.HLSDataset('S30', retry_policy=t_stac_retry.STACRetryPolicy(base_delay=0.01))
+    assert len(resumed.catalog) == len(crawled.catalog)
+    assert not exists(environ['support_files_path'] + 'HLSS30.v2.0_harvest_checkpoint.jsonl')
+    print(f'Lost day: no file made, then {len(resumed.catalog)} files once it was harvested again.')
+    server.failures.clear()
+
+    server.stop()
+
+    # Write a large support file (three years of S30 files)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    tiles = [f'{column:02d}{band}{minor_column}{minor_row}' for column in range(1, 61)
+             for band in 'CDEFGHJKLMNPQRSTUVWX' for minor_column in 'ABCDEFGH' for minor_row in 'ABCDEFGHJK']
+    titles = [f'HLS.S30.T{tile}.{year}{doy:03d}T{random.randint(0, 235959):06d}.v2.0'
+              for year in (2020, 2021, 2022) for doy in range(1, 366) for tile in random.sample(tiles, 1000)]
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_files_01012023.jsonl', 'w') as f:
+        for title in titles:
+            f.write(json.dumps(title) + '\n')
+
+    # Open it from the support file (parsed, and the binary catalog is written), then from the binary catalog
+    stime = time()
+    t_hls_albedo.HLSDataset('S30')
+    parsed_time = time() - stime
+    stime = time()
+    mapped = t_hls_albedo.HLSDataset('S30', memory_limit_bytes=40 * 1024 ** 2)
+    mapped_time = time() - stime
+    print(f'Open {len(mapped.catalog)} files: parsed in {parsed_time:.2f} seconds, '
+          f'mapped in {mapped_time:.3f} seconds.')
+    assert sorted([file for year in mapped.by_date.values() for files in year.values() for file in files]) == \
+        sorted(titles)
+
+    # Ingest the support file the old way (a dictionary of lists for each index, filled one title at a time)
+    file_path = mapped.get_dataset_file_path(datetime.date(2023, 1, 1))
+    stime = time()
+    files_by_date, files_by_tile = {}, {}
+    for title in t_hls_albedo.iterate_support_file(file_path):
+        year_doy, tile = title.split('.')[3][0:7], title.split('.')[2][1:6]
+        files_by_date.setdefault(year_doy[0:4], {}).setdefault(year_doy[4:7], []).append(title)
+        files_by_tile.setdefault(tile[2], {}).setdefault(tile[0:2], {}).setdefault(tile[4], {}).setdefault(
+            tile[3], {}).setdefault(year_doy, []).append(title)
+    dict_time = time() - stime
+    # Parse it a line at a time, then make the catalog
+    stime = time()
+    line_catalog = t_hls_catalog.make_granule_catalog(t_hls_albedo.iterate_support_file(file_path))
+    line_time = time() - stime
+    # Ingest it in one pass
+    stime = time()
+    bulk_catalog = t_hls_catalog.make_granule_catalog_from_file(file_path)
+    bulk_time = time() - stime
+    print(f'Ingest {len(bulk_catalog)} files: dictionaries in {dict_time:.2f} seconds, line by line in '
+          f'{line_time:.2f} seconds, one pass in {bulk_time:.2f} seconds. Speedup of {dict_time / bulk_time:.1f}x.')
+    # The catalogs must be the same
+    assert (bulk_catalog.titles == line_catalog.titles).all()
+    assert sorted(bulk_catalog.titles.astype(str).tolist()) == sorted(titles)
+    assert sum([len(files) for year in files_by_date.values() for files in year.values()]) == len(bulk_catalog)
+    # The older single JSON list (and Windows line endings) take the same path
+    with open(file_path.with_suffix('.json'), 'w') as f:
+        json.dump(titles[0:5000] + ['not a title'], f)
+    assert (t_hls_catalog.make_granule_catalog_from_file(file_path.with_suffix('.json')).titles ==
+            t_hls_catalog.make_granule_catalog(titles[0:5000]).titles).all()
+    with open(file_path.with_suffix('.crlf'), 'wb') as f:
+        f.write(''.join([json.dumps(title) + '\r\n' for title in titles[0:5000]]).encode())
+    assert (t_hls_catalog.make_granule_catalog_from_file(file_path.with_suffix('.crlf')).titles ==
+            t_hls_catalog.make_granule_catalog(titles[0:5000]).titles).all()
+
+    # A season's queries only open its year
+    mapped = t_hls_albedo.HLSDataset('S30', memory_limit_bytes=40 * 1024 ** 2)
+    assert len(mapped.catalog.partitions) == 0
+    assert mapped.check_for_files(titles[1500][9:12], datetime.date(2020, 1, 2)) == \
+        sorted([title for title in titles[1000:2000] if title[9:12] == titles[1500][9:12]],
+               key=lambda title: (title[9:14], title[23:29]))
+    assert list(mapped.catalog.partitions.keys()) == [2020]
+    print(f'One season: {mapped.catalog.get_partition(2020).get_size_bytes() / 1024 ** 2:.1f} MB open.')
+
+    # Touching every year (with its indexes) keeps the open years under the memory limit
+    for year in (2020, 2021, 2022):
+        for doy in range(1, 366):
+            mapped.check_for_files('14T', datetime.date(year, 1, 1) + datetime.timedelta(days=doy - 1))
+    assert sum([partition.get_size_bytes() for partition in mapped.catalog.partitions.values()]) <= 40 * 1024 ** 2
+    print(f'Years open after touching all three: {list(mapped.catalog.partitions.keys())}.')
+    # The running total of the open years' memory matches what they use (each is checked when it is used)
+    for year in list(mapped.catalog.partitions.keys()):
+        mapped.catalog.get_partition(year)
+    assert mapped.catalog.open_bytes == sum([partition.get_size_bytes()
+                                             for partition in mapped.catalog.partitions.values()])
+    # A year file that is not a catalog file fails clearly when it is opened (and is not kept open)
+    bad_path = Path(tempfile.mkdtemp())
+    with open(bad_path / '2020.bin', 'wb') as f:
+        f.write(bytes(64))
+    t_hls_catalog.write_partition_list(bad_path, {2020: 1}, 0, {2020: '2020.bin'})
+    bad_catalog = t_hls_catalog.HLSPartitionedCatalog(bad_path, memory_limit_bytes=40 * 1024 ** 2)
+    try:
+        bad_catalog.get_files(2020001)
+        assert False
+    except ValueError as error:
+        print(f'Bad year file: {error}')
+    assert len(bad_catalog.partitions) == 0
+
+    # Open it with the catalog in a database instead (written from the support file, then opened as it is)
+    stime = time()
+    t_hls_albedo.HLSDataset('S30', catalog_backend='sqlite')
+    written_time = time() - stime
+    stime = time()
+    database = t_hls_albedo.HLSDataset('S30', catalog_backend='sqlite')
+    print(f'Database: written in {written_time:.2f} seconds, opened in {time() - stime:.3f} seconds.')
+    assert len(database.catalog) == len(titles)
+    # The queries must match the binary catalog
+    samples = random.sample(titles, 500)
+    for title in samples:
+        date, tile = t_hls_albedo.get_date_from_file(title), title[9:14]
+        assert database.check_for_files(tile[0:3], date) == mapped.check_for_files(tile[0:3], date)
+        assert database.check_for_slivers(tile, date) == mapped.check_for_slivers(tile, date)
+        assert database.by_id[title[0:29]] == title and database.by_id[title[0:22]] == mapped.by_id[title[0:22]]
+    for title in samples[0:20]:
+        date, tile = t_hls_albedo.get_date_from_file(title), title[9:14]
+        assert database.get_relevant_tiles(tile, date) == mapped.get_relevant_tiles(tile, date)
+    start_date, end_date = datetime.date(2020, 11, 1), datetime.date(2021, 2, 28)
+    assert database.get_files_between(start_date, end_date, tile='14T') == \
+        mapped.get_files_between(start_date, end_date, tile='14T')
+    assert database.get_time_series(['14TPL', '31UDQ'], start_date, end_date) == \
+        mapped.get_time_series(['14TPL', '31UDQ'], start_date, end_date)
+    assert database.by_date['2021'] == mapped.by_date['2021']
+    assert database.by_tile['T']['14'] == mapped.by_tile['T']['14']
+    print('Same files from the database.')
+    # Time the queries of the relevant tile search (after a first pass, which opens the years and makes the indexes)
+    for dataset in (t_hls_albedo.HLSDataset('S30'), database):
+        for title in samples:
+            dataset.check_for_files(title[9:12], t_hls_albedo.get_date_from_file(title))
+        stime = time()
+        for title in samples:
+            dataset.check_for_files(title[9:12], t_hls_albedo.get_date_from_file(title))
+        print(f'{len(samples)} tile queries ({dataset.catalog_backend}): {time() - stime:.3f} seconds.')
+
+    # Update the database while other processes read it
+    year_doy = int(titles[0][15:22])
+    old_count = len(database.catalog.get_files(year_doy))
+    added = [f'HLS.S30.T{tile}.{year_doy}T999999.v2.0' for tile in tiles[0:500]]
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(count_files_repeatedly, database.catalog, year_doy, 2) for worker in range(4)]
+        stime = time()
+        version = database.catalog.apply_delta(added=added)
+        print(f'Updated to version {version} in {time() - stime:.3f} seconds while 4 processes read.')
+        counts = set().union(*[future.result() for future in futures])
+    # The readers only ever saw the whole update or none of it
+    assert counts <= {old_count, old_count + 500} and database.catalog.get_added_between(0) == sorted(added)
+    print(f'Counts seen by the readers: {sorted(counts)}.')
+    # Another connection to the same database (opened by its path alone) sees the update
+    reader = t_hls_catalog_sqlite.HLSSQLiteCatalog(database.catalog.database_path)
+    assert reader.get_version() == version and len(reader) == len(titles) + 500
+    assert reader.get_added_between(0) == sorted(added)
+    print(f'Second connection: version {reader.get_version()}, {len(reader)} files.')
+    # Writing the support file's granules again is another update (the version and update log carry on)
+    assert reader.write_catalog(t_hls_catalog.make_granule_catalog(titles)) == version + 1
+    assert len(reader) == len(titles) and [delta['removed'] for delta in reader.iterate_deltas()] == [[], sorted(added)]
+    print(f'Written again: version {reader.get_version()}, {len(reader)} files.')
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.WARNING)
+
+    main()
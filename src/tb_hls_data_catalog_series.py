@@ -0,0 +1,83 @@
+import json
+import random
+import datetime
+import tempfile
+import itertools
+import t_hls_albedo
+from os import environ
+from time import time
+
+
+# Make the titles of a dataset (L30 or S30) with an acquisition of every cell every few days
+def make_titles(sensor, cells, years, revisit_days):
+    titles = []
+    for year in years:
+        for doy in range(1 + random.randint(0, revisit_days - 1), 366, revisit_days):
+            for cell in cells:
+                titles.append(f'HLS.{sensor}.T{cell}.{year}{doy:03d}T{random.randint(0, 235959):06d}.v2.0')
+    return titles
+
+
+def main():
+
+    # Cells of a large region (every cell of ten major tiles)
+    cells = [f'{column:02d}{band}{minor_column}{minor_row}' for column in range(10, 15) for band in 'ST'
+             for minor_column in 'ABCDEFGH' for minor_row in 'ABCDEFGHJK']
+    # Write a support file for each dataset (two years, S30 every 3 days and L30 every 4)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    for sensor, revisit_days in (('L30', 4), ('S30', 3)):
+        with open(environ['support_files_path'] + f'HLS{sensor}.v2.0_files_01012023.jsonl', 'w') as f:
+            for title in make_titles(sensor, cells, (2021, 2022), revisit_days):
+                f.write(json.dumps(title) + '\n')
+    # Open both datasets
+    catalog = t_hls_albedo.HLSDataCatalog()
+    start_date, end_date = datetime.date(2021, 1, 1), datetime.date(2022, 12, 31)
+
+    # Time series of the region the old way (each dataset's lists joined, then sorted)
+    stime = time()
+    joined_list = sorted([file for dataset in (catalog.l30, catalog.s30)
+                          for files in dataset.get_time_series(cells, start_date, end_date).values()
+                          for file in files], key=t_hls_albedo.get_acquisition_key)
+    joined_time = time() - stime
+    # Time series of the region as one merged stream
+    catalog = t_hls_albedo.HLSDataCatalog()
+    stime = time()
+    merged_list = list(catalog.iterate_files_of_cells(cells, start_date, end_date))
+    merged_time = time() - stime
+    print(f'Time series of {len(cells)} cells ({len(merged_list)} files): joined and sorted in {joined_time:.2f} '
+          f'seconds, merged in {merged_time:.2f} seconds.')
+    # The files must be the same, in acquisition order
+    assert sorted(merged_list) == sorted(joined_list) and len(set(merged_list)) == len(merged_list)
+    assert [t_hls_albedo.get_acquisition_key(file) for file in merged_list] == \
+        [t_hls_albedo.get_acquisition_key(file) for file in joined_list]
+
+    # The first files of the stream only need the first year (the second year is never opened)
+    catalog = t_hls_albedo.HLSDataCatalog()
+    stime = time()
+    first_files = list(itertools.islice(catalog.iterate_files_of_cells(cells, start_date, end_date), 100))
+    print(f'First 100 files of the stream in {time() - stime:.3f} seconds.')
+    assert first_files == merged_list[0:100]
+    assert list(catalog.l30.catalog.partitions.keys()) == [2021]
+    assert list(catalog.s30.catalog.partitions.keys()) == [2021]
+
+    # The stream of one cell, and of a strip, has both sensors
+    series = list(catalog.iterate_time_series('14TCD', start_date, end_date))
+    assert set([file[4:7] for file in series]) == {'L30', 'S30'}
+    assert series == [file for file in merged_list if file[9:14] == '14TCD']
+    strip = t_hls_albedo.HLSTargetStrip(t_hls_albedo.get_date_from_file(series[0]))
+    strip.files = [series[0], series[0].replace('14TCD', '14TDD')]
+    assert list(catalog.iterate_strip_files(strip)) == \
+        [file for file in merged_list if file[9:14] in ('14TCD', '14TDD') and file[15:22] == series[0][15:22]]
+    print(f'Cell stream: {len(series)} files from both sensors.')
+
+    # The same stream from catalog databases
+    environ['hls_catalog_backend'] = 'sqlite'
+    catalog = t_hls_albedo.HLSDataCatalog()
+    stime = time()
+    assert list(catalog.iterate_files_of_cells(cells, start_date, end_date)) == merged_list
+    print(f'Merged from the databases in {time() - stime:.2f} seconds.')
+
+
+if __name__ == '__main__':
+
+    main()
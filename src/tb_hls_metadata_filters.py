@@ -0,0 +1,99 @@
+import json
+import random
+import datetime
+import tempfile
+import t_hls_albedo
+import t_hls_catalog
+from os import environ
+from time import time
+from tb_hls_relevant_tiles import make_busy_day_dataset
+
+
+def main():
+
+    # Write a support file and a metadata file with a few busy days (some files have no metadata)
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    date = datetime.date(2022, 5, 3)
+    dates = [date + datetime.timedelta(days=day) for day in range(3)]
+    titles = [title for target_date in dates for title in make_busy_day_dataset(target_date)[1]]
+    coverage = {title: (random.choice([None, random.randint(0, 100)]), random.choice([None, random.uniform(0, 100)]))
+                for title in titles}
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_metadata_01012023.jsonl', 'w') as f:
+        for title in titles:
+            f.write(json.dumps({'title': title, 'datetime': None, 'cloud_cover': coverage[title][0],
+                                'spatial_coverage': coverage[title][1], 'bbox': None, 'assets': {}}) + '\n')
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_files_01012023.jsonl', 'w') as f:
+        for title in titles:
+            f.write(json.dumps(title) + '\n')
+    thresholds = {'max_cloud_cover': 40, 'min_spatial_coverage': 30}
+
+    # Check a file against the thresholds (whole %, files with no metadata are kept)
+    def passes(title):
+        cloud_cover, spatial_coverage = coverage[title]
+        return (cloud_cover is None or cloud_cover <= 40) and \
+            (spatial_coverage is None or round(spatial_coverage) >= 30)
+    print(f'{sum([passes(title) for title in titles])} of {len(titles)} files within the thresholds.')
+
+    # For each catalog backend
+    for backend in ('binary', 'sqlite'):
+        # Open the dataset (the coverage is read from the metadata file once, into the catalog)
+        stime = time()
+        dataset = t_hls_albedo.HLSDataset('S30', catalog_backend=backend)
+        print(f'{backend}: opened in {time() - stime:.2f} seconds.')
+        stime = time()
+        t_hls_albedo.HLSDataset('S30', catalog_backend=backend)
+        print(f'{backend}: opened again (catalog already written) in {time() - stime:.2f} seconds.')
+
+        # Files of tiles
+        for tile in set([t_hls_albedo.get_tile_from_file(title)[0:3] for title in titles[0:50]]):
+            for target_date in dates:
+                assert dataset.check_for_files(tile, target_date, **thresholds) == \
+                    [file for file in dataset.check_for_files(tile, target_date) if passes(file)]
+        # Files in a range of dates and time series
+        assert dataset.get_files_between(dates[0], dates[-1], **thresholds) == \
+            [file for file in dataset.get_files_between(dates[0], dates[-1]) if passes(file)]
+        cell = t_hls_albedo.get_tile_from_file(titles[0])
+        assert list(dataset.iterate_time_series(cell, dates[0], dates[-1], **thresholds)) == \
+            dataset.get_time_series([cell], dates[0], dates[-1], **thresholds)[cell] == \
+            [file for file in dataset.get_time_series([cell], dates[0], dates[-1])[cell] if passes(file)]
+        print(f'{backend}: files of tiles, dates and time series filtered.')
+
+        # Relevant tiles (the search goes through every file, only the files returned are filtered)
+        targets = [(t_hls_albedo.get_tile_from_file(title), t_hls_albedo.get_date_from_file(title))
+                   for title in random.sample(titles, 200)]
+        results = {target: dataset.get_relevant_tiles(*target, **thresholds) for target in targets}
+        for target in targets:
+            assert results[target] == [file for file in dataset.get_relevant_tiles(*target) if passes(file)]
+        for max_workers in (1, 2):
+            batch_results = dataset.get_relevant_tiles_for_targets(targets, max_workers=max_workers, **thresholds)
+            assert all([set(batch_results[target]) == set(results[target]) for target in targets])
+        print(f'{backend}: relevant tiles filtered (one at a time, and in batches with 1 and 2 workers).')
+
+        # Strips (of the files within the thresholds only, in one process and spread over processes)
+        organizer = dataset.generate_strip_targets(**thresholds)
+        expected = [sorted(strip.files) for target_date in dates for strip in t_hls_albedo.make_strips_of_day(
+            [file for file in dataset.catalog.get_files(t_hls_albedo.get_year_doy_from_date(target_date))
+             if passes(file)], target_date)]
+        assert sorted([sorted(strip.files) for strip in organizer.strips]) == sorted(expected)
+        strip_files = set([file for strip in organizer.strips for file in strip.files])
+        assert strip_files == set([title for title in titles if passes(title)])
+        assert [(strip.date, strip.files) for strip in dataset.generate_strip_targets(max_workers=2,
+                                                                                      **thresholds).strips] == \
+            [(strip.date, strip.files) for strip in organizer.strips]
+        print(f'{backend}: {len(organizer.strips)} strips of {len(strip_files)} files (in 1 and 2 processes).')
+
+        # An update keeps the coverage of the files already there and sets the coverage of the files added
+        cloudy = f'HLS.S30.T14TPL.{t_hls_albedo.get_year_doy_from_date(dates[0])}T000001.v2.0'
+        dataset.catalog.apply_delta(added=[cloudy], coverage={cloudy: (90, 100)})
+        if backend == 'binary':
+            dataset.use_catalog(t_hls_catalog.HLSPartitionedCatalog(dataset.catalog.catalog_path))
+        assert cloudy in dataset.check_for_files('14T', dates[0])
+        assert cloudy not in dataset.check_for_files('14T', dates[0], **thresholds)
+        assert set(dataset.get_files_between(dates[0], dates[-1], **thresholds)) == \
+            set([title for title in titles if passes(title)])
+        print(f'{backend}: coverage kept through an update.')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,126 @@
+import json
+import random
+import datetime
+import tempfile
+import t_hls_albedo
+import t_hls_catalog
+from os import environ
+from time import time
+
+
+# The earlier version of get_relevant_tiles (four separate stack searches), to compare against
+def get_relevant_tiles_four_pass(dataset, mgrs_cell, date):
+    major_row, major_col, minor_row, minor_col = t_hls_albedo.get_mgrs_components(mgrs_cell)
+    tile_files = []
+    start_tile = f'{major_col}{major_row}'
+    to_search = {'N': [start_tile], 'S': [start_tile], 'W': [start_tile], 'E': [start_tile]}
+    for file in dataset.check_for_files(start_tile, date):
+        tile_files.append(file)
+    for direction, branches in (('N', ('N', 'W', 'E')), ('S', ('S', 'W', 'E')), ('W', ('W',)), ('E', ('E',))):
+        while len(to_search[direction]) > 0:
+            curr_tile = to_search[direction].pop()
+            for tile in t_hls_albedo.move_in_direction(curr_tile[-1], curr_tile[0:2], direction):
+                files_list = dataset.check_for_files(tile, date)
+                if len(files_list) > 0:
+                    for branch in branches:
+                        if tile not in to_search[branch]:
+                            to_search[branch].append(tile)
+                for file in files_list:
+                    if file not in tile_files:
+                        tile_files.append(file)
+    return tile_files
+
+
+# Make a dataset with one busy day (a swath of tiles with files)
+def make_busy_day_dataset(date, file_count=1000):
+    # Year and DOY
+    year_doy = t_hls_albedo.get_year_doy_from_date(date)
+    # Tiles in a swath (columns 10 to 29, every band)
+    tiles = [f'{column:02d}{band}{minor_column}{minor_row}' for column in range(10, 30)
+             for band in 'CDEFGHJKLMNPQRSTUVWX' for minor_column in 'ABCDEFGH' for minor_row in 'ABCDEFGHJK']
+    # Titles on the day
+    titles = [f'HLS.S30.T{tile}.{year_doy}T{random.randint(0, 235959):06d}.v2.0'
+              for tile in random.sample(tiles, file_count)]
+    # Make the dataset (without a support file)
+    dataset = t_hls_albedo.HLSDataset.__new__(t_hls_albedo.HLSDataset)
+    dataset.ingest_titles(titles)
+    # Return the dataset and titles
+    return dataset, titles
+
+
+def main():
+
+    # Make a busy day
+    date = datetime.date(2022, 5, 3)
+    dataset, titles = make_busy_day_dataset(date)
+    # Tile of every file on the day
+    cells = [t_hls_albedo.get_tile_from_file(title) for title in titles]
+
+    # Search from every file with the four pass search
+    stime = time()
+    four_pass_results = [get_relevant_tiles_four_pass(dataset, cell, date) for cell in cells]
+    four_pass_time = time() - stime
+    print(f'Four pass search from {len(cells)} tiles: {four_pass_time:.2f} seconds.')
+
+    # Search from every file with the single search
+    stime = time()
+    results = [dataset.get_relevant_tiles(cell, date) for cell in cells]
+    search_time = time() - stime
+    print(f'Single search from {len(cells)} tiles: {search_time:.2f} seconds. Speedup of '
+          f'{four_pass_time / search_time:.1f}x.')
+
+    # The results must be the same files
+    for four_pass_result, result in zip(four_pass_results, results):
+        assert len(result) == len(set(result)) and set(result) == set(four_pass_result)
+    print(f'Same files (average of {sum([len(result) for result in results]) / len(results):.0f} per search).')
+
+    # The search can be limited to a number of moves
+    assert set(dataset.get_relevant_tiles(cells[0], date, max_hops=0)) == \
+        set(dataset.catalog.get_files(t_hls_albedo.get_year_doy_from_date(date), major_tile=cells[0][0:3]))
+    assert len(dataset.get_relevant_tiles(cells[0], date, max_hops=2)) <= len(results[0])
+
+    # A band with files all the way around the globe (the four pass search never finishes on this)
+    year_doy = t_hls_albedo.get_year_doy_from_date(date)
+    dataset.use_catalog(t_hls_catalog.make_granule_catalog(
+        [f'HLS.S30.T{column:02d}TPL.{year_doy}T173002.v2.0' for column in range(1, 61)]))
+    assert len(dataset.get_relevant_tiles('14TPL', date)) == 60
+    print('Search around the globe finished.')
+
+    # Write a support file with a few busy days
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    dates = [date + datetime.timedelta(days=day) for day in range(4)]
+    targets = []
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_files_01012023.jsonl', 'w') as f:
+        for target_date in dates:
+            for title in make_busy_day_dataset(target_date)[1]:
+                f.write(json.dumps(title) + '\n')
+                targets.append((t_hls_albedo.get_tile_from_file(title), target_date))
+    dataset = t_hls_albedo.HLSDataset('S30')
+
+    # Search from every target one at a time
+    stime = time()
+    results = {target: dataset.get_relevant_tiles(*target) for target in targets}
+    search_time = time() - stime
+    print(f'One at a time from {len(targets)} targets: {search_time:.2f} seconds.')
+
+    # Search from every target in a batch (and in a batch spread over processes)
+    for max_workers in (1, 4):
+        stime = time()
+        batch_results = dataset.get_relevant_tiles_for_targets(targets, max_workers=max_workers)
+        batch_time = time() - stime
+        print(f'Batch with {max_workers} worker(s) from {len(targets)} targets: {batch_time:.2f} seconds. '
+              f'Speedup of {search_time / batch_time:.1f}x.')
+        assert batch_results.keys() == results.keys()
+        assert all([set(batch_results[target]) == set(results[target]) for target in targets])
+
+    # The same batch with the catalog in a database (every worker process reads the one database)
+    dataset = t_hls_albedo.HLSDataset('S30', catalog_backend='sqlite')
+    stime = time()
+    batch_results = dataset.get_relevant_tiles_for_targets(targets, max_workers=4)
+    print(f'Batch with 4 worker(s) on the database from {len(targets)} targets: {time() - stime:.2f} seconds.')
+    assert all([set(batch_results[target]) == set(results[target]) for target in targets])
+
+
+if __name__ == '__main__':
+
+    main()
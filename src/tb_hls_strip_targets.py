@@ -0,0 +1,138 @@
+import json
+import random
+import datetime
+import tempfile
+import t_hls_albedo
+import t_lookups
+from os import environ
+from time import time
+from tb_hls_relevant_tiles import make_busy_day_dataset
+
+
+# Group the files of a day into strips by searching from each file in turn (to compare against)
+def make_strips_by_search(files, date):
+    # Files of each cell
+    files_by_cell = {}
+    for file in files:
+        files_by_cell.setdefault(t_hls_albedo.get_tile_from_file(file), []).append(file)
+    # Cells next to each cell (both ways)
+    neighbours = {cell: set() for cell in files_by_cell.keys()}
+    for cell in files_by_cell.keys():
+        northward_cells, southward_cells = t_hls_albedo.get_northward_and_southward_cells(cell)
+        for other_cell in t_hls_albedo.move_minor_eastwards(cell) + northward_cells + southward_cells:
+            if other_cell in files_by_cell.keys():
+                neighbours[cell].add(other_cell)
+                neighbours[other_cell].add(cell)
+    # Search from each cell not reached yet
+    strips = []
+    reached = set()
+    for cell in files_by_cell.keys():
+        if cell not in reached:
+            strip_cells = {cell}
+            to_search = [cell]
+            while len(to_search) > 0:
+                for other_cell in neighbours[to_search.pop()]:
+                    if other_cell not in strip_cells:
+                        strip_cells.add(other_cell)
+                        to_search.append(other_cell)
+            reached.update(strip_cells)
+            strips.append(set([file for strip_cell in strip_cells for file in files_by_cell[strip_cell]]))
+    return strips
+
+
+# Make the cells of a row of 100km squares from one zone to another (at 45 degrees north)
+def make_row_of_cells(first_zone, last_zone, minor_row_in_odd_zones='F'):
+    cells = []
+    for zone in range(first_zone, last_zone + 1):
+        column_letters = t_lookups.minor_column_letters[zone % 3]
+        row_index = t_lookups.minor_row_letters.index(minor_row_in_odd_zones) + 5 * (zone % 2 == 0)
+        for easting in range(2, 8):
+            cells.append(f'{zone:02d}T{column_letters[easting - 1]}{t_lookups.minor_row_letters[row_index % 20]}')
+    return cells
+
+
+def main():
+
+    date = datetime.date(2022, 5, 3)
+    year_doy = t_hls_albedo.get_year_doy_from_date(date)
+
+    # A row of squares across three zones is one strip, with the same squares in the band to the north (slivers)
+    cells = make_row_of_cells(13, 15)
+    files = [f'HLS.S30.T{cell}.{year_doy}T173002.v2.0' for cell in cells] + \
+            [f'HLS.S30.T{cell[0:2]}U{cell[3:5]}.{year_doy}T173002.v2.0' for cell in cells[0:3]]
+    strips = t_hls_albedo.make_strips_of_day(files, date)
+    assert len(strips) == 1 and sorted(strips[0].files) == sorted(files)
+    # A gap splits the row into two strips
+    strips = t_hls_albedo.make_strips_of_day([file for file in files if cells[8] not in file], date)
+    assert len(strips) == 2
+    # Two rows apart are separate strips
+    strips = t_hls_albedo.make_strips_of_day(files + [f'HLS.S30.T{cell}.{year_doy}T173002.v2.0'
+                                                      for cell in make_row_of_cells(13, 15, 'H')], date)
+    assert len(strips) == 2
+    print('Rows of squares grouped into strips.')
+
+    # Busy days must have the same strips as a search from each file
+    for file_count in (1000, 4000, 16000):
+        dataset, titles = make_busy_day_dataset(date, file_count=file_count)
+        stime = time()
+        strips = t_hls_albedo.make_strips_of_day(titles, date)
+        strip_time = time() - stime
+        assert sorted([sorted(strip.files) for strip in strips]) == \
+            sorted([sorted(strip) for strip in make_strips_by_search(titles, date)])
+        print(f'{file_count} files on a day: {len(strips)} strips in {strip_time:.3f} seconds '
+              f'({strip_time / file_count * 1e6:.1f} microseconds per file).')
+
+    # Strips of every date in a dataset
+    dataset.ingest_titles([title for day in range(30) for title in
+                           make_busy_day_dataset(date + datetime.timedelta(days=day), file_count=2000)[1]])
+    stime = time()
+    organizer = dataset.generate_strip_targets()
+    print(f'{len(organizer.strips)} strips from {len(dataset.catalog)} files on 30 dates in {time() - stime:.2f} '
+          f'seconds.')
+    # Every file is in one strip, of its own date
+    assert len(organizer.by_file) == len(dataset.catalog) == sum([len(strip.files) for strip in organizer.strips])
+    file = random.choice(list(organizer.by_file.keys()))
+    assert organizer.by_file[file].date == t_hls_albedo.get_date_from_file(file)
+
+    # Write a support file with a season of busy days
+    environ['support_files_path'] = tempfile.mkdtemp() + '/'
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_files_01012023.jsonl', 'w') as f:
+        for day in range(120):
+            for title in make_busy_day_dataset(date + datetime.timedelta(days=day), file_count=4000)[1]:
+                f.write(json.dumps(title) + '\n')
+    dataset = t_hls_albedo.HLSDataset('S30')
+    # Generate the strips in one process, then spread over processes (each maps the same catalog files)
+    stime = time()
+    organizer = dataset.generate_strip_targets()
+    serial_time = time() - stime
+    print(f'{len(organizer.strips)} strips from {len(dataset.catalog)} files on 120 dates: {serial_time:.2f} seconds '
+          f'in one process.')
+    for max_workers in (2, 4):
+        stime = time()
+        pool_organizer = dataset.generate_strip_targets(max_workers=max_workers)
+        pool_time = time() - stime
+        print(f'{max_workers} processes: {pool_time:.2f} seconds. Speedup of {serial_time / pool_time:.1f}x.')
+        # The strips must be the same (and in the same order)
+        assert [(strip.date, strip.files) for strip in pool_organizer.strips] == \
+            [(strip.date, strip.files) for strip in organizer.strips]
+        assert pool_organizer.by_file.keys() == organizer.by_file.keys()
+    # A newer support file doesn't change the strips of the dataset opened before it (the workers open the same one)
+    with open(environ['support_files_path'] + 'HLSS30.v2.0_files_01022023.jsonl', 'w') as f:
+        for title in make_busy_day_dataset(date, file_count=100)[1]:
+            f.write(json.dumps(title) + '\n')
+    assert [(strip.date, strip.files) for strip in dataset.generate_strip_targets(max_workers=2).strips] == \
+        [(strip.date, strip.files) for strip in organizer.strips]
+    print('Workers open the same snapshot.')
+    (dataset.get_dataset_file_path(datetime.date(2023, 1, 2))).unlink()
+    # The strips from the catalog database must be the same (the tile codes come from the catalog either way)
+    database = t_hls_albedo.HLSDataset('S30', catalog_backend='sqlite')
+    stime = time()
+    database_organizer = database.generate_strip_targets()
+    print(f'From the database: {time() - stime:.2f} seconds.')
+    assert [(strip.date, strip.files) for strip in database_organizer.strips] == \
+        [(strip.date, strip.files) for strip in organizer.strips]
+
+
+if __name__ == '__main__':
+
+    main()
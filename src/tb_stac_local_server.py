@@ -0,0 +1,316 @@
+import json
+import hashlib
+import logging
+import datetime
+import tempfile
+import itertools
+import threading
+import t_stac_cache
+import t_stac_search
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import environ
+from urllib.parse import parse_qs, urlencode, urlparse
+from time import sleep, time
+
+
+# Class for a local stand-in of the STAC catalog (collection -> year -> month -> day -> items)
+class LocalSTACServer:
+
+    def __init__(self, data_product='HLSS30.v2.0', years=(2021, 2022), months=(1, 2, 3), days=(1, 2, 3, 4, 5),
+                 tiles=('14TPL', '14TQL', '15TUF', '15TVF'), latency=0.05, extra_data_products=()):
+
+        self.data_product = data_product
+        self.latency = latency
+        self.pages = {}
+        self.items = []
+        self.failures = {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+        # Start the server on a free local port
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(self))
+        # Root URL of the server (stands in for the 'stac_root' environmental variable)
+        self.root = f'http://127.0.0.1:{self.httpd.server_address[1]}/'
+        # Build the catalog pages for each data product
+        for product in (data_product,) + tuple(extra_data_products):
+            self.build_catalog(product, years, months, days, tiles)
+
+    # Build the pages of the catalog of a data product
+    def build_catalog(self, data_product, years, months, days, tiles):
+        # Collection URL
+        collection_url = self.root + f'LPCLOUD/collections/{data_product}'
+        # Collection page
+        collection_page = {'links': []}
+        # For each year
+        for year in years:
+            # Year URL
+            year_url = collection_url + f'/{year}'
+            # Add the year to the collection
+            collection_page['links'].append({'rel': 'child', 'title': str(year), 'href': year_url})
+            # Year page
+            year_page = {'links': []}
+            # For each month
+            for month in months:
+                # Month URL
+                month_url = year_url + f'/{month:02d}'
+                # Add the month to the year
+                year_page['links'].append({'rel': 'child', 'title': f'{month:02d}', 'href': month_url})
+                # Month page
+                month_page = {'links': []}
+                # For each day
+                for day in days:
+                    # Day URL
+                    day_url = month_url + f'/{day:02d}'
+                    # Add the day to the month
+                    month_page['links'].append({'rel': 'child', 'title': f'{day:02d}', 'href': day_url})
+                    # Day page
+                    day_page = {'links': []}
+                    # Get the DOY
+                    doy = (datetime.date(year, month, day) - datetime.date(year, 1, 1)).days + 1
+                    # For each tile
+                    for tile_index, tile in enumerate(tiles):
+                        # Assemble the item title
+                        title = f'HLS.{data_product[3:6]}.T{tile}.{year}{doy:03d}T173002.v2.0'
+                        # Item URL
+                        item_url = day_url + f'/{title}'
+                        # Footprint of the item (each tile gets its own one degree box, with data over part of a
+                        # tile's width at the equator)
+                        coverage = 100 - (tile_index * 13 + doy) % 60
+                        east = tile_index + coverage / 100 * t_stac_search.HLS_TILE_SIDE_KM / 111.32
+                        north = t_stac_search.HLS_TILE_SIDE_KM / 110.57
+                        # Item page
+                        item = {'id': title,
+                                'collection': data_product,
+                                'bbox': [tile_index, 0, tile_index + 1, 1],
+                                'geometry': {'type': 'Polygon',
+                                             'coordinates': [[[tile_index, 0], [east, 0], [east, north],
+                                                              [tile_index, north], [tile_index, 0]]]},
+                                'properties': {'datetime': f'{year}-{month:02d}-{day:02d}T17:30:02Z',
+                                               'eo:cloud_cover': (tile_index * 37 + doy * 11) % 101},
+                                'assets': {key: {'href': f'{self.root}data/{title}/{title}.{key}.tif'}
+                                           for key in ('B02', 'B03', 'B04', 'Fmask')},
+                                'links': []}
+                        # Add the item for searching
+                        self.items.append(item)
+                        # Reference the page
+                        self.pages[item_url] = item
+                        # Add the item to the day
+                        day_page['links'].append({'rel': 'item', 'title': title, 'href': item_url})
+                    # Reference the page
+                    self.pages[day_url] = day_page
+                # Reference the page
+                self.pages[month_url] = month_page
+            # Reference the page
+            self.pages[year_url] = year_page
+        # Reference the page
+        self.pages[collection_url] = collection_page
+
+    # Get the titles of all the items of a data product in the catalog (in crawl order)
+    def get_titles(self, data_product=None):
+        # Get the collection URL of the data product
+        collection_url = self.root + f'LPCLOUD/collections/{data_product or self.data_product}/'
+        # Return the item titles
+        return [link['title'] for url, page in self.pages.items() if url.startswith(collection_url)
+                for link in page['links'] if link['rel'] == 'item']
+
+    # Make the next requests for a URL fail with a list of status codes (optionally asking for a Retry-After delay)
+    def inject_failures(self, target_url, status_codes, retry_after=None):
+        self.failures[target_url] = [(status_code, retry_after) for status_code in status_codes]
+
+    # Get a page of item search results (datetime and bbox filters, 'page' parameter for paging)
+    def search(self, path):
+        # Get the parameters
+        params = {key: values[0] for key, values in parse_qs(urlparse(path).query).items()}
+        # Start with all the items of the collection
+        items = [item for item in self.items if item['collection'] == params.get('collections', self.data_product)]
+        # If there is a datetime range
+        if 'datetime' in params.keys():
+            # Split the range
+            start, end = params['datetime'].split('/')
+            # Keep the items in the range (ISO strings sort chronologically)
+            items = [item for item in items if (start == '..' or item['properties']['datetime'] >= start) and
+                     (end == '..' or item['properties']['datetime'] <= end)]
+        # If there is a bounding box
+        if 'bbox' in params.keys():
+            # Get the box
+            west, south, east, north = [float(coordinate) for coordinate in params['bbox'].split(',')]
+            # Keep the items that intersect the box
+            items = [item for item in items if item['bbox'][0] < east and item['bbox'][2] > west and
+                     item['bbox'][1] < north and item['bbox'][3] > south]
+        # Get the page size and number
+        limit = int(params.get('limit', 10))
+        page_number = int(params.get('page', 1))
+        # Page of results
+        page = {'type': 'FeatureCollection',
+                'features': items[(page_number - 1) * limit:page_number * limit],
+                'links': []}
+        # If there are more results
+        if page_number * limit < len(items):
+            # Link to the next page
+            params['page'] = page_number + 1
+            page['links'].append({'rel': 'next', 'href': self.root + 'LPCLOUD/search?' + urlencode(params)})
+        # Return the page
+        return page
+
+    # Serve the catalog in a background thread
+    def start(self):
+        # Start the thread
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        # Point the STAC search at the server
+        environ['stac_root'] = self.root
+
+    # Stop serving the catalog
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Make a request handler class that serves the pages of a local STAC server
+def make_handler(server):
+
+    class LocalSTACHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            # Count the request
+            with server.lock:
+                server.request_count += 1
+            # Wait to simulate the round trip to the remote server
+            sleep(server.latency)
+            # Get any injected failures for the URL
+            with server.lock:
+                failures = server.failures.get(server.root + self.path.lstrip('/'))
+                failure = failures.pop(0) if failures else None
+            # If there is a failure to respond with
+            if failure:
+                # Respond with the failure status
+                status_code, retry_after = failure
+                self.send_response(status_code)
+                if retry_after is not None:
+                    self.send_header('Retry-After', str(retry_after))
+                self.end_headers()
+                return
+            # If this is an item search
+            if self.path.startswith('/LPCLOUD/search'):
+                # Get the page of search results
+                page = server.search(self.path)
+            # Otherwise
+            else:
+                # Get the page
+                page = server.pages.get(server.root + self.path.lstrip('/'))
+            # If there is no such page
+            if page is None:
+                # Respond with not found
+                self.send_response(404)
+                self.end_headers()
+                return
+            # Encode the page
+            body = json.dumps(page).encode()
+            # Tag the version of the page
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            # If the client already has this version
+            if self.headers.get('If-None-Match') == etag:
+                # Respond with not modified
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            # Respond with the page
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            # Try and send the page
+            try:
+                self.wfile.write(body)
+            # If the client has gone away (e.g. a killed harvest)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        # Keep the request logging quiet
+        def log_message(self, format, *args):
+            pass
+
+    return LocalSTACHandler
+
+
+def main():
+
+    # Start the local server
+    server = LocalSTACServer()
+    server.start()
+
+    # Crawl one page at a time
+    stime = time()
+    serial_list = t_stac_search.get_items_from_STAC(server.data_product)
+    serial_time = time() - stime
+    print(f'Serial crawl: {len(serial_list)} items, {server.request_count} requests, {serial_time:.2f} seconds.')
+
+    # Crawl with a pool of workers
+    server.request_count = 0
+    stime = time()
+    concurrent_list = t_stac_search.get_items_from_STAC(server.data_product, max_workers=8)
+    concurrent_time = time() - stime
+    print(f'Concurrent crawl: {len(concurrent_list)} items, {server.request_count} requests, '
+          f'{concurrent_time:.2f} seconds.')
+
+    # The concurrent crawl must return the same title list
+    assert serial_list == server.get_titles()
+    assert concurrent_list == serial_list
+    print(f'Same title list. Speedup of {serial_time / concurrent_time:.1f}x.')
+
+    # Stream the titles as each day page is parsed
+    streamed_list = []
+    for title in t_stac_search.iterate_items_from_STAC(server.data_product, max_workers=8):
+        streamed_list.append(title)
+    assert streamed_list == serial_list
+    print(f'Streamed crawl: {len(streamed_list)} items.')
+
+    # Crawl with the metadata of each item (the search returns the same records without the item requests)
+    server.request_count = 0
+    record_list = t_stac_search.get_items_from_STAC(server.data_product, max_workers=8, with_metadata=True)
+    assert [record['title'] for record in record_list] == serial_list
+    assert sorted(record_list, key=lambda record: record['title']) == \
+        sorted(t_stac_search.get_items_from_STAC_search(server.data_product, limit=50, with_metadata=True),
+               key=lambda record: record['title'])
+    # The spatial coverage comes from each item's footprint
+    assert all([record['spatial_coverage'] == 100 - (tile_index * 13 + int(record['title'][19:22])) % 60
+                for record in record_list
+                for tile_index in [('14TPL', '14TQL', '15TUF', '15TVF').index(record['title'][9:14])]])
+    print(f'Metadata crawl: {len(record_list)} records, {server.request_count} requests.')
+
+    # Crawl twice with a response cache (the second crawl should only need the collection page)
+    cache = t_stac_cache.STACResponseCache(tempfile.mkdtemp())
+    t_stac_search.get_items_from_STAC(server.data_product, max_workers=8, cache=cache)
+    server.request_count = 0
+    cached_list = t_stac_search.get_items_from_STAC(server.data_product, max_workers=8, cache=cache)
+    assert cached_list == serial_list
+    print(f'Cached crawl: {len(cached_list)} items, {server.request_count} requests.')
+
+    # Harvest with the item search endpoint instead
+    server.request_count = 0
+    search_list = t_stac_search.get_items_from_STAC_search(server.data_product, limit=50)
+    assert sorted(search_list) == sorted(serial_list)
+    print(f'Search harvest: {len(search_list)} items, {server.request_count} requests.')
+    # The search can be streamed (the first items only need the first page)
+    server.request_count = 0
+    first_items = list(itertools.islice(t_stac_search.iterate_items_from_STAC_search(server.data_product, limit=50),
+                                        10))
+    assert first_items == search_list[0:10] and server.request_count == 1
+
+    # Harvest a date range and region with the item search endpoint
+    start_date, end_date = datetime.date(2022, 2, 1), datetime.date(2022, 3, 31)
+    search_list = t_stac_search.get_items_from_STAC_search(server.data_product, start_date=start_date,
+                                                           end_date=end_date, bbox=(0.5, 0, 1.5, 1), limit=50)
+    assert sorted(search_list) == sorted([title for title in serial_list if title.split('.')[2][1:6] in
+                                          ('14TPL', '14TQL') and title.split('.')[3][0:7] >= '2022032'])
+    print(f'Bounded search harvest: {len(search_list)} items.')
+
+    server.stop()
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.WARNING)
+
+    main()
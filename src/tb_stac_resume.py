@@ -0,0 +1,68 @@
+import sys
+import json
+import logging
+import tempfile
+import subprocess
+import t_stac_search
+import t_stac_checkpoint
+from tb_stac_local_server import LocalSTACServer
+from os import environ
+from pathlib import Path
+from time import sleep
+
+
+def main():
+
+    # Start the local server
+    server = LocalSTACServer(latency=0.05)
+    server.start()
+    # Checkpoint file for the harvest
+    checkpoint_path = Path(tempfile.mkdtemp(), f'{server.data_product}_harvest_checkpoint.jsonl')
+
+    # Uninterrupted harvest (for reference)
+    full_list = t_stac_search.get_items_from_STAC(server.data_product)
+    full_requests = server.request_count
+
+    # Start a checkpointed harvest in another process, and kill it part of the way through
+    harvest = subprocess.Popen([sys.executable, '-c',
+                                'import t_stac_search; '
+                                f't_stac_search.get_items_from_STAC("{server.data_product}", '
+                                f'checkpoint_path=r"{checkpoint_path}")'],
+                               env=environ.copy())
+    sleep(1.2)
+    harvest.kill()
+    harvest.wait()
+    # Finished days when the harvest was killed
+    checkpoint = t_stac_checkpoint.STACHarvestCheckpoint(checkpoint_path)
+    finished_days = len(checkpoint.day_offsets)
+    print(f'Harvest killed after {finished_days} finished days.')
+    assert 0 < finished_days < 30
+    # The items of a finished day are read back from the file (only the day URLs are kept in memory)
+    with open(checkpoint_path, 'r') as f:
+        records = [json.loads(line) for line in f]
+    assert all([checkpoint.get_items(record['day']) == record['items'] for record in records])
+
+    # Simulate a line that was only partly written when the harvest died
+    with open(checkpoint_path, 'a') as f:
+        f.write('{"day": "http://127.0.0.1/partial", "tit')
+
+    # Resume the harvest
+    server.request_count = 0
+    resumed_list = t_stac_search.get_items_from_STAC(server.data_product, checkpoint_path=checkpoint_path)
+    print(f'Resumed harvest: {len(resumed_list)} items, {server.request_count} requests '
+          f'(uninterrupted harvest made {full_requests}).')
+
+    # The resumed harvest must produce the same catalog as the uninterrupted one
+    assert resumed_list == full_list
+    assert t_stac_checkpoint.get_catalog_checksum(resumed_list) == t_stac_checkpoint.get_catalog_checksum(full_list)
+    assert server.request_count == full_requests - finished_days
+    print(f'Same catalog: {t_stac_checkpoint.get_catalog_checksum(resumed_list)}')
+
+    server.stop()
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.WARNING)
+
+    main()
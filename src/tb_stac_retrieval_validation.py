@@ -1,4 +1,5 @@
 import t_stac_search
+import t_stac_cache
 from random import shuffle
 import datetime
 import t_hls_albedo
@@ -9,6 +10,9 @@ shuffle(years)
 doys = list(range(1, 366))
 shuffle(doys)
 
+# Serve repeat validation runs from the local cache (if one is set up)
+cache = t_stac_cache.get_default_cache()
+
 while len(years) > 0:
 
     year = years.pop()
@@ -17,7 +21,7 @@ while len(years) > 0:
     # convert datetime
     date = datetime.date(year=year, day=1, month=1) + datetime.timedelta(days=doy - 1)
 
-    test_text = t_stac_search.get_text_from_STAC_request(f"https://cmr.earthdata.nasa.gov/stac/LPCLOUD/collections/HLSS30.v2.0/{str(date.year)}/{t_hls_albedo.zero_pad_number(str(date.month), digits=2)}/{t_hls_albedo.zero_pad_number(str(date.day), digits=2)}", attempt_limit=1)
+    test_text = t_stac_search.get_text_from_STAC_request(f"https://cmr.earthdata.nasa.gov/stac/LPCLOUD/collections/HLSS30.v2.0/{str(date.year)}/{t_hls_albedo.zero_pad_number(str(date.month), digits=2)}/{t_hls_albedo.zero_pad_number(str(date.day), digits=2)}", attempt_limit=1, cache=cache)
 
     link_list = []
 
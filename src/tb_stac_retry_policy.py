@@ -0,0 +1,121 @@
+import logging
+import tempfile
+import t_stac_retry
+import t_stac_search
+import t_stac_checkpoint
+from tb_stac_local_server import LocalSTACServer
+from pathlib import Path
+from time import sleep, time
+
+
+def main():
+
+    # Start the local server (no latency, the failures are the point)
+    server = LocalSTACServer(latency=0)
+    server.start()
+    # Full title list
+    all_titles = server.get_titles()
+    # Collection URL
+    collection_url = server.root + f'LPCLOUD/collections/{server.data_product}'
+
+    # Transient server errors on a few pages are retried until they succeed
+    server.inject_failures(collection_url + '/2021/01/01', [503, 500])
+    server.inject_failures(collection_url + '/2022/03', [502, 504, 503])
+    policy = t_stac_retry.STACRetryPolicy(base_delay=0.01)
+    server.request_count = 0
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, max_workers=4, retry_policy=policy)
+    assert item_list == all_titles
+    assert policy.retry_count == 5
+    print(f'Transient errors: {len(item_list)} items, {server.request_count} requests, {policy.retry_count} retries.')
+
+    # A missing page fails fast (one request) and only that day is skipped
+    server.inject_failures(collection_url + '/2021/02/03', [404] * 10)
+    policy = t_stac_retry.STACRetryPolicy(base_delay=0.01)
+    server.request_count = 0
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, retry_policy=policy)
+    assert len(item_list) == len(all_titles) - 4
+    assert policy.retry_count == 0
+    assert len(server.failures[collection_url + '/2021/02/03']) == 9
+    print(f'Missing page: {len(item_list)} items, {server.request_count} requests, {policy.retry_count} retries.')
+    server.failures.clear()
+
+    # A Retry-After header is respected
+    server.inject_failures(collection_url + '/2022', [429], retry_after=1)
+    policy = t_stac_retry.STACRetryPolicy(base_delay=0.01)
+    stime = time()
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, retry_policy=policy)
+    assert item_list == all_titles
+    assert time() - stime >= 1
+    print(f'Retry-After: {len(item_list)} items in {time() - stime:.2f} seconds.')
+
+    # A Retry-After header asking for too long is cut down to the longest allowed
+    server.inject_failures(collection_url + '/2022', [429], retry_after=100000)
+    policy = t_stac_retry.STACRetryPolicy(base_delay=0.01, breaker_pause=0.01, max_retry_after=0.5)
+    stime = time()
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, retry_policy=policy)
+    assert item_list == all_titles
+    assert 0.5 <= time() - stime < 10
+    print(f'Long Retry-After cut down: {len(item_list)} items in {time() - stime:.2f} seconds.')
+
+    # A dead URL only gets as many attempts as the per-request budget
+    server.inject_failures(collection_url + '/2021/03/05', [500] * 10)
+    policy = t_stac_retry.STACRetryPolicy(attempt_limit=3, base_delay=0.01)
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, retry_policy=policy)
+    assert len(item_list) == len(all_titles) - 4
+    assert len(server.failures[collection_url + '/2021/03/05']) == 7
+    print(f'Per-request budget: {10 - len(server.failures[collection_url + "/2021/03/05"])} attempts for a dead URL.')
+    server.failures.clear()
+
+    # The crawl stops retrying once the global budget is used up
+    for day in ('01', '02', '03', '04', '05'):
+        server.inject_failures(collection_url + f'/2022/01/{day}', [500] * 10)
+    policy = t_stac_retry.STACRetryPolicy(retry_limit=4, base_delay=0.01)
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, retry_policy=policy)
+    assert len(item_list) == len(all_titles) - 20
+    assert policy.retry_count == 4
+    print(f'Global budget: {policy.retry_count} retries used across the crawl.')
+    server.failures.clear()
+
+    # The global budget refills as its window moves (so a long crawl is not left without retries)
+    policy = t_stac_retry.STACRetryPolicy(retry_limit=2, retry_window=0.5, base_delay=0.01)
+    assert [policy.get_retry_delay(1) is not None for attempt in range(3)] == [True, True, False]
+    sleep(0.3)
+    assert policy.get_retry_delay(1) is not None and policy.get_retry_delay(1) is None
+    print(f'Refilling budget: {policy.retry_count} retries used, 2 every 0.5 seconds.')
+
+    # A day lost once the budget is used up stays unfinished in the checkpoint, and the next harvest requests it again
+    checkpoint_path = Path(tempfile.mkdtemp(), f'{server.data_product}_harvest_checkpoint.jsonl')
+    server.inject_failures(collection_url + '/2022/01/01', [500] * 3)
+    checkpoint = t_stac_checkpoint.STACHarvestCheckpoint(checkpoint_path)
+    policy = t_stac_retry.STACRetryPolicy(retry_limit=1, retry_window=None, base_delay=0.01)
+    item_list = list(t_stac_search.iterate_items_from_STAC(server.data_product, retry_policy=policy,
+                                                           checkpoint=checkpoint))
+    assert len(item_list) == len(all_titles) - 4
+    assert checkpoint.lost_days == {collection_url + '/2022/01/01'}
+    assert not t_stac_checkpoint.STACHarvestCheckpoint(checkpoint_path).is_done(collection_url + '/2022/01/01')
+    server.request_count = 0
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, checkpoint_path=checkpoint_path,
+                                                  retry_policy=t_stac_retry.STACRetryPolicy(base_delay=0.01))
+    assert sorted(item_list) == sorted(all_titles)
+    print(f'Lost day: left unfinished, then harvested again ({server.request_count} requests to resume).')
+    server.failures.clear()
+
+    # Throttling on many pages at once trips the circuit breaker and pauses the whole crawl
+    for day in ('01', '02', '03', '04', '05'):
+        server.inject_failures(collection_url + f'/2021/01/{day}', [429])
+    policy = t_stac_retry.STACRetryPolicy(base_delay=0.01, breaker_threshold=3, breaker_pause=1)
+    stime = time()
+    item_list = t_stac_search.get_items_from_STAC(server.data_product, max_workers=5, retry_policy=policy)
+    assert item_list == all_titles
+    assert policy.breaker_trips >= 1
+    assert time() - stime >= 1
+    print(f'Circuit breaker: tripped {policy.breaker_trips} time(s), crawl took {time() - stime:.2f} seconds.')
+
+    server.stop()
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    main()